@@ -15,14 +15,9 @@ import rich.traceback
 import buisciii
 import buisciii.config_json
 import buisciii.utils
-import buisciii.new_service
-import buisciii.scratch
-import buisciii.list
-import buisciii.bioinfo_doc
-import buisciii.clean
-import buisciii.archive
-import buisciii.copy_sftp
-import buisciii.autoclean_sftp
+
+# The modules of each command (and their dependencies: pdfkit, requests, etc.)
+# are imported inside the command, so that --help and light commands start fast
 
 log = logging.getLogger()
 
@@ -250,8 +245,16 @@ def setup_automatic_logging(service_path, resolution_id, command_name, conf):
     help="Show the full traceback on error for debugging purposes.",
 )
 @click.option("-d", "--dev", help="Develop settings", is_flag=True, default=False)
+@click.option(
+    "--refresh_cache",
+    is_flag=True,
+    default=False,
+    help="Discard the cached iSkyLIMS data and request it again.",
+)
 @click.pass_context
-def buisciii_cli(ctx, verbose, log_file, api_user, api_password, cred_file, dev, debug):
+def buisciii_cli(
+    ctx, verbose, log_file, api_user, api_password, cred_file, dev, debug, refresh_cache
+):
     if debug:
         # Set the base logger to output everything
         log.setLevel(logging.DEBUG)
@@ -277,6 +280,11 @@ def buisciii_cli(ctx, verbose, log_file, api_user, api_password, cred_file, dev,
     ctx.obj.update(buisciii.utils.get_yaml_config(conf, cred_file))
     ctx.obj["debug"] = debug
 
+    if refresh_cache:
+        from buisciii.drylab_api import clear_cache
+
+        clear_cache()
+
     # Manual logging if -l was specified
     if log_file:
         try:
@@ -312,6 +320,8 @@ def list(ctx, service):
     """
     List all available buisciii services.
     """
+    import buisciii.list
+
     service_list = buisciii.list.ListServices()
     service_list.print_table(service)
 
@@ -345,6 +355,8 @@ def new_service(ctx, resolution, path, no_create_folder, ask_path):
     """
     Create new service: this will create the service folder and copy templates depending on selected service/s.
     """
+    import buisciii.new_service
+
     if resolution is None:
         resolution = buisciii.utils.prompt_resolution_id()
 
@@ -414,13 +426,38 @@ def new_service(ctx, resolution, path, no_create_folder, ask_path):
         "scratch_to_service: From /data/ucct/bi/scratch_tmp/bi/ to /data/ucct/bi/service"
     ),
 )
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Number of rsync processes used to copy the service to scratch, splitting it by size. Default: scratch_copy jobs in configuration.json",
+)
+@click.option(
+    "-w",
+    "--no_wait",
+    is_flag=True,
+    default=False,
+    help="Submit the copy as a Slurm job (sbatch) instead of waiting for it.",
+)
+@click.option(
+    "-s",
+    "--status",
+    is_flag=True,
+    default=False,
+    help="Show the state and progress of the Slurm jobs submitted with --no_wait.",
+)
 @click.pass_context
-def scratch(ctx, resolution, path, tmp_dir, direction, ask_path):
+def scratch(ctx, resolution, path, tmp_dir, direction, ask_path, jobs, no_wait, status):
     """
     Copy service folder to scratch directory for execution.
     """
+    import buisciii.scratch
+
     if resolution is None:
         resolution = buisciii.utils.prompt_resolution_id()
+    if status:
+        direction = "status"
 
     debug = ctx.obj.get("debug", False)
     try:
@@ -433,6 +470,8 @@ def scratch(ctx, resolution, path, tmp_dir, direction, ask_path):
             ctx.obj["api_user"],
             ctx.obj["api_password"],
             ctx.obj["conf"],
+            jobs=jobs,
+            wait=False if no_wait else None,
         )
 
         # Automatic logging
@@ -498,6 +537,8 @@ def clean(ctx, resolution, path, ask_path, option):
     Service cleaning. This will either remove big files, rename folders before copy, revert this renaming,
     show removable files or show folders for no copy.
     """
+    import buisciii.clean
+
     if resolution is None:
         resolution = buisciii.utils.prompt_resolution_id()
 
@@ -559,6 +600,8 @@ def copy_sftp(ctx, resolution, path, ask_path, sftp_folder):
     """
     Copy resolution folder to SFTP, change status of the resolution in iSkyLIMS and generate md, pdf & html files.
     """
+    import buisciii.copy_sftp
+
     if resolution is None:
         resolution = buisciii.utils.prompt_resolution_id()
 
@@ -627,6 +670,11 @@ def finish(ctx, resolution, path, ask_path, sftp_folder, tmp_dir):
     """
     Service cleaning, big files removal, folders renaming before copy and resolution folder copying to the SFTP.
     """
+    import buisciii.service_context
+    import buisciii.clean
+    import buisciii.scratch
+    import buisciii.copy_sftp
+
     if resolution is None:
         resolution = buisciii.utils.prompt_resolution_id()
 
@@ -636,24 +684,14 @@ def finish(ctx, resolution, path, ask_path, sftp_folder, tmp_dir):
         if tmp_dir == "/scratch/bi/":
             clean_tmp_dir = "/data/ucct/bi/scratch_tmp/bi"
 
-        conf = buisciii.config_json.ConfigJson()
-        conf_api = conf.get_configuration("xtutatis_api_settings")
-        rest_api = buisciii.drylab_api.RestServiceApi(
-            conf_api["server"],
-            conf_api["api_url"],
+        # Resolution data and paths are obtained once for all the steps
+        context = buisciii.service_context.ServiceContext(
+            resolution,
             ctx.obj["api_user"],
             ctx.obj["api_password"],
+            ctx.obj["conf"],
         )
-        resolution_info = rest_api.get_request(
-            request_info="service-data", safe=True, resolution=resolution
-        )
-        service_folder = resolution_info["resolutions"][0]["resolution_full_number"]
-        service_path = os.path.join(
-            buisciii.utils.get_service_paths(
-                conf, "services_and_colaborations", resolution_info, "non_archived_path"
-            ),
-            service_folder,
-        )
+        service_path = context.full_path
 
         if not ctx.obj.get("manual_log_file"):
             setup_automatic_logging(service_path, resolution, "finish", ctx.obj["conf"])
@@ -667,6 +705,7 @@ def finish(ctx, resolution, path, ask_path, sftp_folder, tmp_dir):
             ctx.obj["api_user"],
             ctx.obj["api_password"],
             ctx.obj["conf"],
+            context=context,
         )
         clean_scratch.handle_clean()
         print(
@@ -683,6 +722,7 @@ def finish(ctx, resolution, path, ask_path, sftp_folder, tmp_dir):
             ctx.obj["api_user"],
             ctx.obj["api_password"],
             ctx.obj["conf"],
+            context=context,
         )
         copy_scratch2service.handle_scratch()
         print("Starting renaming of the service directory.")
@@ -694,6 +734,7 @@ def finish(ctx, resolution, path, ask_path, sftp_folder, tmp_dir):
             ctx.obj["api_user"],
             ctx.obj["api_password"],
             ctx.obj["conf"],
+            context=context,
         )
         rename_databi.handle_clean()
         print("Starting copy of the service directory to the SFTP folder")
@@ -705,6 +746,7 @@ def finish(ctx, resolution, path, ask_path, sftp_folder, tmp_dir):
             ctx.obj["api_user"],
             ctx.obj["api_password"],
             ctx.obj["conf"],
+            context=context,
         )
         copy_sftp.copy_sftp()
 
@@ -786,6 +828,8 @@ def bioinfo_doc(
     """
     Create the folder documentation structure in bioinfo_doc server
     """
+    import buisciii.bioinfo_doc
+
     if resolution is None:
         resolution = buisciii.utils.prompt_resolution_id()
 
@@ -871,6 +915,13 @@ def bioinfo_doc(
     default=None,
     help="Tsv output path + filename with archive stats and info",
 )
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of services compressed, copied and uncompressed at the same time on full archive/retrieve. Default 1.",
+)
 @click.pass_context
 def archive(
     ctx,
@@ -882,10 +933,12 @@ def archive(
     date_from,
     date_until,
     output_name,
+    jobs,
 ):
     """
     Archive services or retrieve services from archive
     """
+    import buisciii.archive
 
     debug = ctx.obj.get("debug", False)
     try:
@@ -905,6 +958,7 @@ def archive(
             date_from,
             date_until,
             output_name,
+            jobs,
         )
 
         archive_ser.handle_archive()
@@ -938,6 +992,7 @@ def archive(
 @click.pass_context
 def autoclean_sftp(ctx, sftp_folder, days):
     """Clean old sftp services"""
+    import buisciii.autoclean_sftp
 
     debug = ctx.obj.get("debug", False)
     try:
@@ -989,8 +1044,12 @@ def fix_permissions(ctx, input_directory):
             stderr.print(f"[red]Invalid input directory: {directory}")
             continue
         try:
-            buisciii.utils.remake_permissions(directory, permissions)
-            stderr.print(f"[green]Correct permissions were applied to {directory}")
+            counts = buisciii.utils.remake_permissions(directory, permissions)
+            stderr.print(
+                f"[green]Correct permissions were applied to {directory} "
+                f"({counts['owner_changed']} owners and {counts['mode_changed']} modes changed, "
+                f"{counts['directories']} directories and {counts['files']} files checked)"
+            )
         except Exception as e:
             if debug:
                 log.exception(f"EXCEPTION FOUND: {e}")
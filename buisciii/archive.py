@@ -1,9 +1,11 @@
 #!/usr/bin/env python
 
+import concurrent.futures
 import logging
 import os
 import shutil
 import sys
+import threading
 from math import pow
 
 import rich
@@ -24,6 +26,12 @@ stderr = rich.console.Console(
 )
 
 
+class ArchiveCancelled(Exception):
+    """
+    The user chose to exit in a prompt of a pipeline worker.
+    """
+
+
 class Archive:
     """
     This class handles the archive of active services and the retrieval of archived services, from/to the
@@ -43,6 +51,7 @@ class Archive:
         date_from=None,
         date_until=None,
         output_name=None,
+        jobs=1,
     ):
         log.info("Activated archive module of the BU-ISCIII tools")
 
@@ -85,10 +94,19 @@ class Archive:
             conf_api["api_url"],
             api_user,
             api_password,
+            cache_ttl=conf_api.get("cache_ttl", 0),
         )
 
+        # Checksums of files that did not change are not computed again
+        self.checksum_cache = buisciii.utils.get_checksum_cache(conf)
         self.skip_prompts = skip_prompts
         self.option = option
+        # Number of services processed at the same time in the full archive/retrieve
+        self.jobs = max(1, int(jobs)) if jobs else 1
+        # Only one worker may ask through prompt at a time
+        self.prompt_lock = threading.Lock()
+        # Set when the user exits from a worker, so that the others stop too
+        self.cancelled = threading.Event()
         self.date_from = date_from
         self.date_until = date_until
 
@@ -261,17 +279,16 @@ class Archive:
                 )
                 raise
 
+        if self.ser_type == "services_and_colaborations":
+            # Ask for all services at once, the API requests run concurrently
+            services_data = rest_api.get_request_batch(
+                "service-data", "service", list(self.services.keys())
+            )
+
         for service in self.services.keys():
             stderr.print(service)
             if self.ser_type == "services_and_colaborations":
-                if isinstance(
-                    (
-                        service_data := rest_api.get_request(
-                            request_info="service-data", safe=True, service=service
-                        )
-                    ),
-                    int,
-                ):
+                if isinstance((service_data := services_data[service]), int):
                     stderr.print(
                         f"[yellow]No services named '{service}' were found. Connection seemed right though!"
                     )
@@ -381,6 +398,38 @@ class Archive:
             )
         log.info(f"Chosen option for archive: {self.option.lstrip()}")
 
+    def prompt_selection(self, msg, choices):
+        """
+        Description:
+            Prompt selection making sure only one service asks at a time when
+            services are being processed in parallel.
+        """
+        with self.prompt_lock:
+            if self.cancelled.is_set():
+                raise ArchiveCancelled("Archive cancelled by the user")
+            try:
+                selection = buisciii.utils.prompt_selection(msg, choices)
+            except KeyboardInterrupt:
+                if threading.current_thread() is threading.main_thread():
+                    raise
+                selection = None
+        if selection is None:
+            self.cancel("Execution ended by the user cancelling a prompt")
+        return selection
+
+    def cancel(self, reason):
+        """
+        Description:
+            End the execution after the user chose to exit. Pipeline workers
+            raise ArchiveCancelled instead, so that pipeline_directory stops the
+            other services and exits from the main thread.
+        """
+        log.info(reason)
+        if threading.current_thread() is threading.main_thread():
+            sys.exit(0)
+        self.cancelled.set()
+        raise ArchiveCancelled(reason)
+
     def scout_directory_sizes(self):
         """
         Description:
@@ -399,17 +448,31 @@ class Archive:
         size_table.add_column("Directory size (GB)", justify="center")
         size_table.add_column("Found in", justify="center")
 
+        # Sizes of unchanged directories are reused from previous scouts
+        scout_conf = self.conf.get("scout", {})
+        threads = scout_conf.get("threads", 16)
+        size_cache = None
+        if scout_conf.get("cache"):
+            cache_file = os.path.join(
+                buisciii.utils.get_cache_dir(), "archive_dir_sizes.json"
+            )
+            size_cache = buisciii.utils.load_size_cache(cache_file)
+
         for service in self.services.keys():
             if "Data dir" in self.services[service]["found"]:
                 self.services[service]["non_archived_size"] = (
                     buisciii.utils.get_dir_size(
-                        self.services[service]["non_archived_path"]
+                        self.services[service]["non_archived_path"],
+                        threads=threads,
+                        cache=size_cache,
                     )
                     / pow(1024, 3)
                 )
             if "Archive" in self.services[service]["found"]:
                 self.services[service]["archived_size"] = buisciii.utils.get_dir_size(
-                    self.services[service]["archived_path"]
+                    self.services[service]["archived_path"],
+                    threads=threads,
+                    cache=size_cache,
                 ) / pow(1024, 3)
 
             if (
@@ -435,6 +498,9 @@ class Archive:
                     ),
                 )
 
+        if size_cache is not None:
+            buisciii.utils.save_size_cache(cache_file, size_cache)
+
         stderr.print(
             "Only the first 10 lines of the table will be shown here. Please check the .csv file for the complete info."
         )
@@ -442,128 +508,139 @@ class Archive:
         log.info("FINISHED: Directory scouting")
         return
 
-    def targz_directory(self, direction):
+    def targz_service(self, service, direction):
         """
         Description:
-            For all chosen services:
-                - Checks no prior .tar.gz files have been created before.
-                - Creates the .tar.gz file for all chosen services.
+            Create the .tar.gz file for a single service, checking no prior .tar.gz
+            file has been created before.
+
+        Returns:
+            (initial_size, compressed_size) in GB, or None if the service was skipped.
         """
-        log.info(
-            f"STARTING: Compression of services in the {('Archive' if direction == 'archive' else 'Data')} dir "
-            f"for {direction}."
-        )
+        location_check = "Data dir" if direction == "archive" else "Archive"
+        if location_check not in self.services[service]["found"]:
+            log.info(
+                f"Service {service}: not found on the '{location_check}' directory. Skipping!"
+            )
+            return None
 
-        total_initial_size = 0
-        total_compressed_size = 0
-        newly_compressed_services = []
+        dir_to_tar = (
+            self.services[service]["non_archived_path"]
+            if direction == "archive"
+            else self.services[service]["archived_path"]
+        )
 
-        # try:
-        for service in self.services.keys():
-            location_check = "Data dir" if direction == "archive" else "Archive"
-            if location_check not in self.services[service]["found"]:
-                log.info(
-                    f"Service {service}: not found on the '{location_check}' directory. Skipping!"
-                )
-                continue
+        # If dir size has been obtained previously, retrieve it.
+        # If dir could not be found, pass.
+        # This could very much be a function on its own.
+        if direction == "archive":
+            initial_size = self.services[service]["non_archived_size"]
+        else:
+            initial_size = self.services[service]["archived_size"]
 
-            dir_to_tar = (
-                self.services[service]["non_archived_path"]
-                if direction == "archive"
-                else self.services[service]["archived_path"]
+        # Check if there is a prior ".tar.gz" file.
+        # NOTE: I find dir_to_tar + ".tar.gz" easier to mentally locate the compressed files.
+        prompt_response = ""
+        if os.path.exists(dir_to_tar + ".tar.gz"):
+            stderr.print(
+                f"Seems like service {service} has already been compressed in the {location_check} dir",
+                f"Path: {dir_to_tar + '.tar.gz'}\n",
             )
-
-            # If dir size has been obtained previously, retrieve it.
-            # If dir could not be found, pass.
-            # This could very much be a function on its own.
-            if direction == "archive":
-                initial_size = self.services[service]["non_archived_size"]
+            if self.skip_prompts:
+                prompt_response = (
+                    f"Delete previous {service + '.tar.gz'} and compress again"
+                )
+                message = "automatically selected due to --skip-prompts"
             else:
-                initial_size = self.services[service]["archived_size"]
-
-            # Check if there is a prior ".tar.gz" file.
-            # NOTE: I find dir_to_tar + ".tar.gz" easier to mentally locate the compressed files.
-            prompt_response = ""
-            if os.path.exists(dir_to_tar + ".tar.gz"):
-                stderr.print(
-                    f"Seems like service {service} has already been compressed in the {location_check} dir",
-                    f"Path: {dir_to_tar + '.tar.gz'}\n",
+                message = "selected throught prompt"
+                prompt_response = self.prompt_selection(
+                    "What to do?",
+                    [
+                        "Just skip it",
+                        f"Delete previous {service + '.tar.gz'} and compress again",
+                    ],
                 )
-                if self.skip_prompts:
-                    prompt_response = (
-                        f"Delete previous {service + '.tar.gz'} and compress again"
+
+        try:
+            if prompt_response:
+                if prompt_response.startswith("Delete"):
+                    log.info(
+                        f"Service {service}: compressed service {dir_to_tar + '.tar.gz'} was already found."
+                        f"Option chosen is to DELETE it ({message})"
+                        "Compression process will be performed again."
                     )
-                    message = "automatically selected due to --skip-prompts"
+                    os.remove(dir_to_tar + ".tar.gz")
+                    buisciii.utils.remove_checksum_files(dir_to_tar + ".tar.gz")
                 else:
-                    message = "selected throught prompt"
-                    prompt_response = buisciii.utils.prompt_selection(
-                        "What to do?",
-                        [
-                            "Just skip it",
-                            f"Delete previous {service + '.tar.gz'} and compress again",
-                        ],
-                    )
+                    self.services[service]["compressed"] = "Found already compressed"
+
+            if not self.services[service]["compressed"] == "Found already compressed":
+                stderr.print(f"Compressing service {service}")
+                buisciii.utils.targz_dir(
+                    dir_to_tar + ".tar.gz",
+                    dir_to_tar,
+                    **self.conf.get("compression", {}),
+                )
+                self.services[service]["compressed"] = "Successfully compressed"
 
-            try:
-                if prompt_response:
-                    if prompt_response.startswith("Delete"):
-                        log.info(
-                            f"Service {service}: compressed service {dir_to_tar + '.tar.gz'} was already found."
-                            f"Option chosen is to DELETE it ({message})"
-                            "Compression process will be performed again."
-                        )
-                        os.remove(dir_to_tar + ".tar.gz")
-                    else:
-                        self.services[service][
-                            "compressed"
-                        ] = "Found already compressed"
+        except Exception as e:
+            stderr.print(
+                f"Compression of service {service} had an error and couldn't be finished."
+                "Deleting compressed file and skipping to the next one\n."
+                f"{e}"
+            )
 
-                if (
-                    not self.services[service]["compressed"]
-                    == "Found already compressed"
-                ):
-                    stderr.print(f"Compressing service {service}")
-                    buisciii.utils.targz_dir(dir_to_tar + ".tar.gz", dir_to_tar)
-                    self.services[service]["compressed"] = "Successfully compressed"
+            if os.path.exists(dir_to_tar + ".tar.gz"):
+                os.remove(dir_to_tar + ".tar.gz")
+                buisciii.utils.remove_checksum_files(dir_to_tar + ".tar.gz")
 
-            except Exception as e:
-                stderr.print(
-                    f"Compression of service {service} had an error and couldn't be finished."
-                    "Deleting compressed file and skipping to the next one\n."
-                    f"{e}"
-                )
+            log.info(
+                f"Service {service}: when compressing, a {e} error arised. Finishing compression,"
+                "deleting compressed file and skipping to the next service."
+            )
+            self.services[service][
+                "error_status"
+            ] = f"Error while compressing the directory: {e}"
 
-                if os.path.exists(dir_to_tar + ".tar.gz"):
-                    os.remove(dir_to_tar + ".tar.gz")
+            return None
 
-                log.info(
-                    f"Service {service}: when compressing, a {e} error arised. Finishing compression,"
-                    "deleting compressed file and skipping to the next service."
-                )
-                self.services[service][
-                    "error_status"
-                ] = f"Error while compressing the directory: {e}"
+        compressed_size = os.path.getsize(dir_to_tar + ".tar.gz") / pow(1024, 3)
 
-                continue
+        if direction == "archive":
+            self.services[service]["non_archived_compressed_size"] = compressed_size
+        else:
+            self.services[service]["archived_compressed_size"] = compressed_size
 
-            compressed_size = os.path.getsize(dir_to_tar + ".tar.gz") / pow(1024, 3)
+        stderr.print(f"Service {service} is compressed into {dir_to_tar + '.tar.gz'}")
+        log.info(
+            f"Service {service}: compression into {dir_to_tar + '.tar.gz'} successful."
+            f"Initial size: {initial_size:.3f} GB. Compressed size: {compressed_size:.3f} GB."
+            f"Saved space: {initial_size - compressed_size:.3f} GB."
+        )
+        return initial_size, compressed_size
 
-            if direction == "archive":
-                self.services[service]["non_archived_compressed_size"] = compressed_size
-            else:
-                self.services[service]["archived_compressed_size"] = compressed_size
+    def targz_directory(self, direction):
+        """
+        Description:
+            For all chosen services:
+                - Checks no prior .tar.gz files have been created before.
+                - Creates the .tar.gz file for all chosen services.
+        """
+        log.info(
+            f"STARTING: Compression of services in the {('Archive' if direction == 'archive' else 'Data')} dir "
+            f"for {direction}."
+        )
 
-            total_initial_size += initial_size
-            total_compressed_size += compressed_size
+        total_initial_size = 0
+        total_compressed_size = 0
+        newly_compressed_services = []
 
-            stderr.print(
-                f"Service {service} is compressed into {dir_to_tar + '.tar.gz'}"
-            )
-            log.info(
-                f"Service {service}: compression into {dir_to_tar + '.tar.gz'} successful."
-                f"Initial size: {initial_size:.3f} GB. Compressed size: {compressed_size:.3f} GB."
-                f"Saved space: {initial_size - compressed_size:.3f} GB."
-            )
+        for service in self.services.keys():
+            sizes = self.targz_service(service, direction)
+            if sizes is None:
+                continue
+            total_initial_size += sizes[0]
+            total_compressed_size += sizes[1]
 
         # General revision of the compression process
         newly_compressed_services = [
@@ -615,189 +692,220 @@ class Archive:
 
         return
 
-    def sync_directory(self, direction):
+    def sync_service(self, service, direction):
         """
         Description:
-            Move chosen services from a place to another depending on the direction chosen:
-                - direction = "archive": move service from "non_archived" to "archived".
-                - direction = "retrieve": move service from "archived" to "non_archived".
-            Make sure they are '.tar.gz' files.
+            Move a single compressed service from a place to another depending on the
+            direction chosen, checking md5 on both sides.
         """
-        log.info(
-            f"STARTING: Compressed service copy "
-            f"({('Data dir to Archive' if direction == 'archive' else 'Archive to Data dir' )})"
-        )
-
-        for service in self.services.keys():
-            # Check if there are any errors, skip
-            location_check = "Data dir" if direction == "archive" else "Archive"
-            if (
-                location_check not in self.services[service]["found"]
-                or self.services[service]["error_status"] != "No errors detected"
-            ):
-                log.info(
-                    f"Service {service}: not found on the '{location_check}' directory or has errors. Skipping."
-                )
-                continue
-
-            origin, destiny = (
-                (
-                    self.services[service]["non_archived_path"],
-                    self.services[service]["archived_path"],
-                )
-                if direction == "archive"
-                else (
-                    self.services[service]["archived_path"],
-                    self.services[service]["non_archived_path"],
-                )
+        # Check if there are any errors, skip
+        location_check = "Data dir" if direction == "archive" else "Archive"
+        if (
+            location_check not in self.services[service]["found"]
+            or self.services[service]["error_status"] != "No errors detected"
+        ):
+            log.info(
+                f"Service {service}: not found on the '{location_check}' directory or has errors. Skipping."
             )
+            return
 
-            if not (os.path.exists(origin + ".tar.gz")):
-                stderr.print(
-                    f"{origin.split('/')[-1] + 'tar.gz'} was not found "
-                    f"in the origin directory ({'/'.join(origin.split('/')[:-1])}"
-                )
+        origin, destiny = (
+            (
+                self.services[service]["non_archived_path"],
+                self.services[service]["archived_path"],
+            )
+            if direction == "archive"
+            else (
+                self.services[service]["archived_path"],
+                self.services[service]["non_archived_path"],
+            )
+        )
 
-                self.services[service][
-                    "error_status"
-                ] = "Compressed directory not found"
+        if not (os.path.exists(origin + ".tar.gz")):
+            stderr.print(
+                f"{origin.split('/')[-1] + 'tar.gz'} was not found "
+                f"in the origin directory ({'/'.join(origin.split('/')[:-1])}"
+            )
 
-                prompt_response = ""
-                if self.skip_prompts:
-                    stderr.print(
-                        f"Skipping service {service} automatically (option skip-prompts activated)"
-                    )
-                    log.info(
-                        f"Service {service}: compressed file {origin + '.tar.gz'} was not found. "
-                        "Skipped automatically (option skip-prompts activated)."
-                    )
-                    continue
-                else:
-                    prompt_response = buisciii.utils.prompt_selection(
-                        "What to do", ["Skip it", "Exit"]
-                    )
-                    if prompt_response == "Skip it":
-                        stderr.print(f"Skipping service {service}")
-                        log.info(
-                            f"Service {service}: compressed file {origin + '.tar.gz'} was not found. "
-                            "Skipped by user through prompt."
-                        )
-                        continue
-                    else:
-                        stderr.print("Exiting")
-                        log.info(
-                            f"Execution ended by user through prompt after service {service} "
-                            f"compressed {origin + '.tar.gz'} "
-                            f"file was not found in the {direction} process."
-                        )
-                        sys.exit(0)
+            self.services[service]["error_status"] = "Compressed directory not found"
 
-            # If compressed destiny exists:
             prompt_response = ""
-            if os.path.exists(destiny + ".tar.gz"):
+            if self.skip_prompts:
                 stderr.print(
-                    f"Seems like service ({service}) has already been {direction + 'd'}."
+                    f"Skipping service {service} automatically (option skip-prompts activated)"
                 )
-                if self.skip_prompts:
-                    prompt_response = f"Remove it and {direction} it again"
-                    message = "(automatically option skip-prompts activated)"
-                else:
-                    prompt_response = buisciii.utils.prompt_selection(
-                        "What to do?",
-                        [f"Remove it and {direction} it again", "Ignore this service"],
-                    )
-                    message = "(remove option selected throught prompt)"
-
-                if "Remove" in prompt_response:
-                    stderr.print(
-                        f"Removing {destiny + '.tar.gz'} automatically {message}."
-                    )
+                log.info(
+                    f"Service {service}: compressed file {origin + '.tar.gz'} was not found. "
+                    "Skipped automatically (option skip-prompts activated)."
+                )
+                return
+            else:
+                prompt_response = self.prompt_selection(
+                    "What to do", ["Skip it", "Exit"]
+                )
+                if prompt_response == "Skip it":
+                    stderr.print(f"Skipping service {service}")
                     log.info(
-                        f"Service {service}: already found in {destiny + '.tar.gz'}."
-                        f"File removed {message}, with intention to be copied again."
+                        f"Service {service}: compressed file {origin + '.tar.gz'} was not found. "
+                        "Skipped by user through prompt."
                     )
-                    os.remove(destiny + ".tar.gz")
+                    return
                 else:
-                    log.info(
-                        f"Service {service}: already found in {destiny + '.tar.gz'}. "
-                        "Transference skipped by user through prompt."
+                    stderr.print("Exiting")
+                    self.cancel(
+                        f"Execution ended by user through prompt after service {service} "
+                        f"compressed {origin + '.tar.gz'} "
+                        f"file was not found in the {direction} process."
                     )
-                    self.services[service][
-                        "error_status"
-                    ] = "Compressed directory found in destiny. Skipped."
-                    continue
 
-            origin_md5 = buisciii.utils.get_md5(origin + ".tar.gz")
+        # If compressed destiny exists:
+        prompt_response = ""
+        if os.path.exists(destiny + ".tar.gz"):
+            stderr.print(
+                f"Seems like service ({service}) has already been {direction + 'd'}."
+            )
+            if self.skip_prompts:
+                prompt_response = f"Remove it and {direction} it again"
+                message = "(automatically option skip-prompts activated)"
+            else:
+                prompt_response = self.prompt_selection(
+                    "What to do?",
+                    [f"Remove it and {direction} it again", "Ignore this service"],
+                )
+                message = "(remove option selected throught prompt)"
 
-            # Save origin md5
-            if direction == "archive":
-                self.services[service]["md5_non_archived"] = origin_md5
+            if "Remove" in prompt_response:
+                stderr.print(f"Removing {destiny + '.tar.gz'} automatically {message}.")
+                log.info(
+                    f"Service {service}: already found in {destiny + '.tar.gz'}."
+                    f"File removed {message}, with intention to be copied again."
+                )
+                os.remove(destiny + ".tar.gz")
+                buisciii.utils.remove_checksum_files(destiny + ".tar.gz")
             else:
-                self.services[service]["md5_archived"] = origin_md5
+                log.info(
+                    f"Service {service}: already found in {destiny + '.tar.gz'}. "
+                    "Transference skipped by user through prompt."
+                )
+                self.services[service][
+                    "error_status"
+                ] = "Compressed directory found in destiny. Skipped."
+                return
+
+        # Checksums are stored by the compression step, so the origin file does not
+        # need to be read again. Files compressed by previous versions have none.
+        origin_md5 = buisciii.utils.read_checksum_file(origin + ".tar.gz", "md5")
+        if origin_md5 is None:
+            origin_md5 = buisciii.utils.get_cached_checksums(
+                origin + ".tar.gz", ["md5"], self.checksum_cache
+            )["md5"]
+        origin_sha256 = buisciii.utils.read_checksum_file(origin + ".tar.gz", "sha256")
+        algorithms = ["md5", "sha256"] if origin_sha256 else ["md5"]
+
+        # Save origin md5
+        if direction == "archive":
+            self.services[service]["md5_non_archived"] = origin_md5
+        else:
+            self.services[service]["md5_archived"] = origin_md5
 
-            try:
+        try:
+            if self.conf["protocol"] == "rsync":
                 sysrsync.run(
                     source=origin + ".tar.gz",
                     destination=destiny + ".tar.gz",
                     options=self.conf["options"],
                     sync_source_contents=False,
                 )
-                destiny_md5 = buisciii.utils.get_md5(destiny + ".tar.gz")
-
-                # Save destiny md5
-                if direction == "archive":
-                    self.services[service]["md5_archived"] = destiny_md5
-                else:
-                    self.services[service]["md5_non_archived"] = destiny_md5
-
-                # Compare md5
-                if origin_md5 == destiny_md5:
-                    stderr.print(
-                        f"[green] Service {service}: Data copied successfully from its origin folder ({origin}) "
-                        f"to its destiny folder ({destiny}) (MD5: {origin_md5}; identical in both sides)",
-                        highlight=False,
-                    )
-                    log.info(
-                        f"Service {service}: copied successfully from {origin}.tar.gz to {destiny}.tar.gz."
-                        f" MD5: {origin_md5}, identical in both sides.)"
-                    )
-                    self.services[service][
-                        "copied"
-                    ] = f"Successfully copied (direction: {direction}), with matching MD5"
-                    os.remove(origin + ".tar.gz")
-                    log.info(f"Service {service}: deleted {origin}.tar.gz")
-                else:
-                    stderr.print(
-                        f"[red] ERROR: Service {service}: Data copied from its origin folder ({origin}) "
-                        f"to its destiny folder ({destiny}), but MD5 did not match (Origin MD5: {origin_md5}; "
-                        f"Destiny MD5: {destiny_md5})."
-                    )
-                    log.info(
-                        f"Service {service}: data copied from its origin folder ({origin}) to its "
-                        f"destiny folder ({destiny}), but MD5 did not match "
-                        f"(Origin MD5: {origin_md5}; Destiny MD5: {destiny_md5})."
-                    )
-
-                    self.services[service][
-                        "copied"
-                    ] = f"Copied (direction: {direction}), MD5 NOT MATCHING."
+                destiny_checksums = buisciii.utils.get_checksums(
+                    destiny + ".tar.gz", algorithms
+                )
+            else:
+                # Read the origin once, hashing the data while it is written
+                destiny_checksums = buisciii.utils.copy_file_with_checksums(
+                    origin + ".tar.gz", destiny + ".tar.gz", algorithms
+                )
+            destiny_md5 = destiny_checksums["md5"]
 
-                    self.services[service][
-                        "error_status"
-                    ] = "Copy error md5sum not matching"
-                    os.remove(destiny + ".tar.gz")
-                    log.info(f"Service {service}: deleted {destiny}.tar.gz")
+            # Save destiny md5
+            if direction == "archive":
+                self.services[service]["md5_archived"] = destiny_md5
+            else:
+                self.services[service]["md5_non_archived"] = destiny_md5
 
-            except Exception as e:
+            # Compare md5 (and sha256 if it was computed when compressing)
+            if origin_md5 == destiny_md5 and (
+                origin_sha256 is None or origin_sha256 == destiny_checksums["sha256"]
+            ):
                 stderr.print(
-                    f"[red] ERROR: {origin.split('/')[-1] + '.tar.gz'} "
-                    f"could not be copied to its destiny archive folder, {destiny}.",
+                    f"[green] Service {service}: Data copied successfully from its origin folder ({origin}) "
+                    f"to its destiny folder ({destiny}) (MD5: {origin_md5}; identical in both sides)",
                     highlight=False,
                 )
-                log.error(
-                    f"Directory {origin} could not be archived to {destiny}. Reason: {e}"
+                log.info(
+                    f"Service {service}: copied successfully from {origin}.tar.gz to {destiny}.tar.gz."
+                    f" MD5: {origin_md5}, identical in both sides.)"
                 )
-                raise
+                self.services[service][
+                    "copied"
+                ] = f"Successfully copied (direction: {direction}), with matching MD5"
+                for algorithm, digest in destiny_checksums.items():
+                    buisciii.utils.write_checksum_file(
+                        destiny + ".tar.gz", algorithm, digest
+                    )
+                if self.checksum_cache is not None:
+                    self.checksum_cache.store(destiny + ".tar.gz", destiny_checksums)
+                os.remove(origin + ".tar.gz")
+                buisciii.utils.remove_checksum_files(origin + ".tar.gz")
+                log.info(f"Service {service}: deleted {origin}.tar.gz")
+            else:
+                stderr.print(
+                    f"[red] ERROR: Service {service}: Data copied from its origin folder ({origin}) "
+                    f"to its destiny folder ({destiny}), but MD5 did not match (Origin MD5: {origin_md5}; "
+                    f"Destiny MD5: {destiny_md5})."
+                )
+                log.info(
+                    f"Service {service}: data copied from its origin folder ({origin}) to its "
+                    f"destiny folder ({destiny}), but MD5 did not match "
+                    f"(Origin MD5: {origin_md5}; Destiny MD5: {destiny_md5})."
+                )
+
+                self.services[service][
+                    "copied"
+                ] = f"Copied (direction: {direction}), MD5 NOT MATCHING."
+
+                self.services[service][
+                    "error_status"
+                ] = "Copy error md5sum not matching"
+                os.remove(destiny + ".tar.gz")
+                buisciii.utils.remove_checksum_files(destiny + ".tar.gz")
+                log.info(f"Service {service}: deleted {destiny}.tar.gz")
+
+        except Exception as e:
+            stderr.print(
+                f"[red] ERROR: {origin.split('/')[-1] + '.tar.gz'} "
+                f"could not be copied to its destiny archive folder, {destiny}.",
+                highlight=False,
+            )
+            log.error(
+                f"Directory {origin} could not be archived to {destiny}. Reason: {e}"
+            )
+            raise
+
+    def sync_directory(self, direction):
+        """
+        Description:
+            Move chosen services from a place to another depending on the direction chosen:
+                - direction = "archive": move service from "non_archived" to "archived".
+                - direction = "retrieve": move service from "archived" to "non_archived".
+            Make sure they are '.tar.gz' files.
+        """
+        log.info(
+            f"STARTING: Compressed service copy "
+            f"({('Data dir to Archive' if direction == 'archive' else 'Archive to Data dir' )})"
+        )
+
+        for service in self.services.keys():
+            self.sync_service(service, direction)
 
         log.info(
             f"FINISHED: Compressed service movement "
@@ -805,120 +913,135 @@ class Archive:
         )
         return
 
-    def uncompress_targz_directory(self, direction):
+    def uncompress_service(self, service, direction):
         """
         Description:
-            Uncompress chosen services:
+            Uncompress a single service:
                 - When archiving, you untar to archived_path.
                 - When retrieving, you untar to non_archived_path.
+
+        Returns:
+            "uncompressed", "already_uncompressed", "not_found" or None if skipped.
         """
+        # Check if there are any errors, skip
+        location_check = "Data dir" if direction == "archive" else "Archive"
+        if (
+            location_check not in self.services[service]["found"]
+            or self.services[service]["error_status"] != "No errors detected"
+        ):
+            log.info(
+                f"Service {service}: not found on the '{location_check}' directory or has errors. Skipping."
+            )
+            return None
 
-        log.info(
-            f"STARTING: Uncompressing services "
-            f"{('to Data dir for retrieval' if direction == 'retrieve' else 'to Archive dir for archive')}"
+        dir_to_untar = (
+            self.services[service]["archived_path"]
+            if (direction == "archive")
+            else self.services[service]["non_archived_path"]
         )
-        already_uncompressed_services = []
-        not_found_compressed_services = []
-        successfully_uncompressed_services = []
-
-        for service in self.services.keys():
-            # Check if there are any errors, skip
-            location_check = "Data dir" if direction == "archive" else "Archive"
-            if (
-                location_check not in self.services[service]["found"]
-                or self.services[service]["error_status"] != "No errors detected"
-            ):
-                log.info(
-                    f"Service {service}: not found on the '{location_check}' directory or has errors. Skipping."
-                )
-                continue
 
-            dir_to_untar = (
-                self.services[service]["archived_path"]
-                if (direction == "archive")
-                else self.services[service]["non_archived_path"]
+        # Check whether the compressed file is not there
+        if not os.path.exists(dir_to_untar + ".tar.gz"):
+            stderr.print(
+                f"The compressed service { service + '.tar.gz'} could not be found"
+            )
+            log.info(
+                f"Service {service}: not uncompressed because compressed file was not found."
+                "Uncompressed service was found."
             )
 
-            # Check whether the compressed file is not there
-            if not os.path.exists(dir_to_untar + ".tar.gz"):
+            self.services[service][
+                "uncompressed"
+            ] = "Could not be uncompressed, compressed file not found on destiny "
+            self.services[service][
+                "error_status"
+            ] = "Error uncompressing, compressed file not found."
+
+            return "not_found"
+        # Compressed file is there
+        else:
+            if os.path.exists(dir_to_untar):
                 stderr.print(
-                    f"The compressed service { service + '.tar.gz'} could not be found"
+                    f"Service {service} is already uncompressed in the destiny "
+                    f"folder {'/'.join(dir_to_untar.split('/')[:-1])[:-1]}"
                 )
-                log.info(
-                    f"Service {service}: not uncompressed because compressed file was not found."
-                    "Uncompressed service was found."
-                )
-                not_found_compressed_services.append(service)
 
-                self.services[service][
-                    "uncompressed"
-                ] = "Could not be uncompressed, compressed file not found on destiny "
-                self.services[service][
-                    "error_status"
-                ] = "Error uncompressing, compressed file not found."
+                prompt_response = ""
+                if self.skip_prompts:
+                    prompt_response = (
+                        f"Delete uncompressed {service} and uncompress again"
+                    )
+                    message = "(automatically delete and uncompress, --skip-prompts)"
+                else:
+                    prompt_response = self.prompt_selection(
+                        "What to do?",
+                        [
+                            "Skip (dont uncompress)",
+                            f"Delete uncompressed {service} and uncompress again",
+                        ],
+                    )
+                    message = "(delete and uncompress selected throught prompt)"
 
-                continue
-            # Compressed file is there
-            else:
-                if os.path.exists(dir_to_untar):
+                if prompt_response.startswith("Delete"):
                     stderr.print(
-                        f"Service {service} is already uncompressed in the destiny "
-                        f"folder {'/'.join(dir_to_untar.split('/')[:-1])[:-1]}"
+                        f"Deleting uncompressed service {service} automatically"
+                        f"{message}"
+                    )
+                    log.info(
+                        f"Service {service}: service was already found uncompressed in the destiny"
+                        f"folder {dir_to_untar}. Will delete the uncompressed service automatically"
+                        f" {message} to uncompress it again."
                     )
+                    shutil.rmtree(dir_to_untar)
+                    stderr.print("Deleted!")
+                else:
+                    self.services[service][
+                        "uncompressed"
+                    ] = "Was not uncompressed due to the presence of a previously uncompressed directory"
+                    log.info(
+                        f"Service {service}: service was already found uncompressed in the destiny "
+                        f"folder {dir_to_untar}. User decided to skip uncompression {message}"
+                    )
+                    return "already_uncompressed"
 
-                    prompt_response = ""
-                    if self.skip_prompts:
-                        prompt_response = (
-                            f"Delete uncompressed {service} and uncompress again"
-                        )
-                        message = (
-                            "(automatically delete and uncompress, --skip-prompts)"
-                        )
-                    else:
-                        prompt_response = buisciii.utils.prompt_selection(
-                            "What to do?",
-                            [
-                                "Skip (dont uncompress)",
-                                f"Delete uncompressed {service} and uncompress again",
-                            ],
-                        )
-                        message = "(delete and uncompress selected throught prompt)"
+            stderr.print(f"Uncompressing {dir_to_untar.split('/')[-1] + '.tar.gz'}")
 
-                    if prompt_response.startswith("Delete"):
-                        stderr.print(
-                            f"Deleting uncompressed service {service} automatically"
-                            f"{message}"
-                        )
-                        log.info(
-                            f"Service {service}: service was already found uncompressed in the destiny"
-                            f"folder {dir_to_untar}. Will delete the uncompressed service automatically"
-                            f" {message} to uncompress it again."
-                        )
-                        shutil.rmtree(dir_to_untar)
-                        stderr.print("Deleted!")
-                    else:
-                        already_uncompressed_services.append(service)
-                        self.services[service][
-                            "uncompressed"
-                        ] = "Was not uncompressed due to the presence of a previously uncompressed directory"
-                        log.info(
-                            f"Service {service}: service was already found uncompressed in the destiny "
-                            f"folder {dir_to_untar}. User decided to skip uncompression {message}"
-                        )
-                        continue
+            buisciii.utils.uncompress_targz_directory(
+                dir_to_untar + ".tar.gz", dir_to_untar
+            )
 
-                stderr.print(f"Uncompressing {dir_to_untar.split('/')[-1] + '.tar.gz'}")
+            stderr.print(f"Service {service} has been successfully uncompressed")
+            log.info(f"Service {service}: successfully uncompressed")
+            os.remove(dir_to_untar + ".tar.gz")
+            buisciii.utils.remove_checksum_files(dir_to_untar + ".tar.gz")
+            log.info(f"Service {service}: deleted {dir_to_untar}.tar.gz")
+            self.services[service]["uncompressed"] = "Uncompressed successfully"
+            return "uncompressed"
 
-                buisciii.utils.uncompress_targz_directory(
-                    dir_to_untar + ".tar.gz", dir_to_untar
-                )
+    def uncompress_targz_directory(self, direction):
+        """
+        Description:
+            Uncompress chosen services:
+                - When archiving, you untar to archived_path.
+                - When retrieving, you untar to non_archived_path.
+        """
+
+        log.info(
+            f"STARTING: Uncompressing services "
+            f"{('to Data dir for retrieval' if direction == 'retrieve' else 'to Archive dir for archive')}"
+        )
+        already_uncompressed_services = []
+        not_found_compressed_services = []
+        successfully_uncompressed_services = []
 
-                stderr.print(f"Service {service} has been successfully uncompressed")
-                log.info(f"Service {service}: successfully uncompressed")
-                os.remove(dir_to_untar + ".tar.gz")
-                log.info(f"Service {service}: deleted {dir_to_untar}.tar.gz")
-                self.services[service]["uncompressed"] = "Uncompressed successfully"
+        for service in self.services.keys():
+            status = self.uncompress_service(service, direction)
+            if status == "uncompressed":
                 successfully_uncompressed_services.append(service)
+            elif status == "already_uncompressed":
+                already_uncompressed_services.append(service)
+            elif status == "not_found":
+                not_found_compressed_services.append(service)
 
         stderr.print(
             f"Uncompressed services: {len(successfully_uncompressed_services)}: "
@@ -955,6 +1078,91 @@ class Archive:
         )
         return
 
+    def pipeline_service(self, service, direction):
+        """
+        Description:
+            Run the whole compress -> copy (md5 check) -> uncompress chain
+            for a single service.
+        """
+        steps = [self.targz_service, self.sync_service, self.uncompress_service]
+        for step in steps:
+            # Services stop before their next step when the user exits
+            if self.cancelled.is_set():
+                raise ArchiveCancelled("Archive cancelled by the user")
+            result = step(service, direction)
+        return result
+
+    def pipeline_directory(self, direction):
+        """
+        Description:
+            Compress, copy and uncompress all chosen services using a pool of
+            self.jobs workers. Each service moves on to the next step as soon as
+            the previous one has finished for it, so compression, copy and md5
+            hashing of different services overlap.
+        """
+        log.info(
+            f"STARTING: {direction} pipeline for {len(self.services)} services "
+            f"with {self.jobs} parallel jobs."
+        )
+        stderr.print(
+            f"Processing {len(self.services)} services with {self.jobs} parallel jobs"
+        )
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            futures = {
+                executor.submit(self.pipeline_service, service, direction): service
+                for service in self.services.keys()
+            }
+            for future in concurrent.futures.as_completed(futures):
+                service = futures[future]
+                try:
+                    future.result()
+                except (ArchiveCancelled, concurrent.futures.CancelledError):
+                    for pending_future in futures:
+                        pending_future.cancel()
+                    self.services[service][
+                        "error_status"
+                    ] = f"{direction.capitalize()} cancelled by the user"
+                except Exception as e:
+                    stderr.print(
+                        f"[red] ERROR: Service {service} could not be {direction + 'd'}: {e}"
+                    )
+                    log.error(
+                        f"Service {service}: {direction} pipeline stopped. Reason: {e}"
+                    )
+                    self.services[service][
+                        "error_status"
+                    ] = f"Error in {direction} pipeline: {e}"
+
+        finished_services = [
+            service
+            for service in self.services.keys()
+            if self.services[service]["uncompressed"] == "Uncompressed successfully"
+        ]
+        failed_services = [
+            service
+            for service in self.services.keys()
+            if self.services[service]["error_status"] != "No errors detected"
+        ]
+        stderr.print(
+            f"Finished {direction} for {len(finished_services)} services: "
+            f"{', '.join(finished_services)}"
+        )
+        if failed_services:
+            stderr.print(
+                f"[yellow]{len(failed_services)} services finished with errors: "
+                f"{', '.join(failed_services)}"
+            )
+        log.info(
+            f"FINISHED: {direction} pipeline. {len(finished_services)} services "
+            f"finished, {len(failed_services)} with errors "
+            f"({', '.join(failed_services)})."
+        )
+        if self.cancelled.is_set():
+            stderr.print("Exiting")
+            sys.exit(0)
+        return
+
     def delete_non_archived_dirs(self):
         """
         Description:
@@ -1136,9 +1344,12 @@ class Archive:
 
         elif self.option == "Full archive: compress and archive":
             self.scout_directory_sizes()
-            self.targz_directory(direction="archive")
-            self.sync_directory(direction="archive")
-            self.uncompress_targz_directory(direction="archive")
+            if self.jobs > 1:
+                self.pipeline_directory(direction="archive")
+            else:
+                self.targz_directory(direction="archive")
+                self.sync_directory(direction="archive")
+                self.uncompress_targz_directory(direction="archive")
             self.generate_tsv_table(filename=self.output_name)
 
         elif self.option.lstrip() == "Partial archive: compress NON-archived service":
@@ -1161,9 +1372,12 @@ class Archive:
             self.generate_tsv_table(filename=self.output_name)
 
         elif self.option == "Full retrieve: retrieve and uncompress":
-            self.targz_directory(direction="retrieve")
-            self.sync_directory(direction="retrieve")
-            self.uncompress_targz_directory(direction="retrieve")
+            if self.jobs > 1:
+                self.pipeline_directory(direction="retrieve")
+            else:
+                self.targz_directory(direction="retrieve")
+                self.sync_directory(direction="retrieve")
+                self.uncompress_targz_directory(direction="retrieve")
             self.generate_tsv_table(filename=self.output_name)
 
         elif self.option.lstrip() == "Partial retrieve: compress archived service":
@@ -5,6 +5,7 @@ import os
 import re
 import sys
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 import shutil
 import rich
@@ -50,16 +51,40 @@ class LastModificationFinder:
 
     def get_last_modified(self, directory):
         """
-        Update the latest modification timestamp for a directory.
+        Update the latest modification timestamp with the newest mtime of the
+        directory itself and of every file below it. The tree is listed with
+        os.scandir, which gives the entry types without an extra stat call;
+        the mtime of each file still takes one stat call (DirEntry.stat only
+        comes from the listing itself on Windows). Links to directories are
+        not followed.
         """
         last_modified_time = os.path.getmtime(directory)
 
-        for root, dirs, files in os.walk(self.path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                file_modified_time = os.path.getmtime(file_path)
-                if file_modified_time > last_modified_time:
-                    last_modified_time = file_modified_time
+        to_scan = [directory]
+        while to_scan:
+            scan_path = to_scan.pop()
+            try:
+                with os.scandir(scan_path) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir():
+                                if not entry.is_symlink():
+                                    to_scan.append(entry.path)
+                                continue
+                            file_modified_time = entry.stat().st_mtime
+                        except FileNotFoundError:
+                            # Broken link
+                            file_modified_time = entry.stat(
+                                follow_symlinks=False
+                            ).st_mtime
+                        except OSError as e:
+                            log.warning(f"Could not read {entry.path}, skipped: {e}")
+                            continue
+                        if file_modified_time > last_modified_time:
+                            last_modified_time = file_modified_time
+            except OSError as e:
+                # Skipped, as os.walk did
+                log.warning(f"Could not read {scan_path}, skipped: {e}")
 
         if last_modified_time > self.last_modified_time:
             self.last_modified_time = last_modified_time
@@ -88,6 +113,10 @@ class AutoremoveSftpService:
         else:
             self.path = path
 
+        # Number of top-level SFTP folders scanned at the same time
+        autoclean_conf = conf.get_configuration("autoclean_sftp") if conf else None
+        self.threads = (autoclean_conf or {}).get("threads", 16)
+
         # Define the margin threshold of days to mark old services
         self.days = timedelta(days=days)
         stderr.print(
@@ -118,11 +147,41 @@ class AutoremoveSftpService:
         else:
             return True
 
+    def find_services(self, directory, service_pattern):
+        """
+        Find the services below a directory and get their last modification.
+        Folders matching the service pattern are not descended any further.
+
+        Returns:
+            Dictionary {sftp-service_path : last_update}
+        """
+        services = {}
+        to_scan = [directory]
+        while to_scan:
+            scan_path = to_scan.pop()
+            try:
+                with os.scandir(scan_path) as entries:
+                    for entry in entries:
+                        if not entry.is_dir(follow_symlinks=False):
+                            continue
+                        if re.match(service_pattern, entry.name):
+                            # Get sftp-service last modification
+                            service_finder = LastModificationFinder(entry.path)
+                            services[entry.path] = (
+                                service_finder.find_last_modification()
+                            )
+                        else:
+                            to_scan.append(entry.path)
+            except OSError as e:
+                log.warning(f"Could not read {scan_path}, skipped: {e}")
+        return services
+
     # Uses regex to identify sftp-services & gets their latest modification
     def get_sftp_services(self):
         """
         Scan the SFTP directory and collect services matching the expected
         naming pattern along with their last modification time.
+        Each top-level SFTP folder is scanned by a different thread.
         """
         self.sftp_services = {}  # {sftp-service_path : last_update}
         service_pattern = (
@@ -130,18 +189,24 @@ class AutoremoveSftpService:
         )
         stderr.print("[blue]Scanning " + self.path + "...")
         log.info(f"Scanning {self.path}...")
-        for root, dirs, files in os.walk(self.path):
-            for dir_name in dirs:
-                match = re.match(service_pattern, dir_name)
-                if match:
-                    sftp_service_fullPath = os.path.join(root, dir_name)
-
-                    # Get sftp-service last modification
-                    service_finder = LastModificationFinder(sftp_service_fullPath)
-                    service_last_modification = service_finder.find_last_modification()
-                    self.sftp_services[sftp_service_fullPath] = (
-                        service_last_modification
+        top_folders = []
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                if not entry.is_dir(follow_symlinks=False):
+                    continue
+                if re.match(service_pattern, entry.name):
+                    service_finder = LastModificationFinder(entry.path)
+                    self.sftp_services[entry.path] = (
+                        service_finder.find_last_modification()
                     )
+                else:
+                    top_folders.append(entry.path)
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            for services in executor.map(
+                lambda folder: self.find_services(folder, service_pattern),
+                top_folders,
+            ):
+                self.sftp_services.update(services)
         if len(self.sftp_services) == 0:
             stderr.print(f"[yellow]No services found in {self.path}! Exiting...")
             log.warning(f"No services found in {self.path}! Exiting...")
@@ -11,10 +11,23 @@ import jinja2
 import markdown
 import pdfkit
 import PyPDF2
+from PyPDF2.generic import (
+    ArrayObject,
+    DictionaryObject,
+    IndirectObject,
+    NameObject,
+    NumberObject,
+    StreamObject,
+    TextStringObject,
+)
 import yaml
 import subprocess
 import json
 import shutil
+import hashlib
+import io
+import time
+from concurrent.futures import ProcessPoolExecutor
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.application import MIMEApplication
@@ -37,6 +50,544 @@ stderr = rich.console.Console(
 )
 
 
+def markdown_to_html(mk_text):
+    """
+    Description:
+        Convert markdown content into HTML.
+
+    Params:
+        mk_text [str]: markdown text to be converted into HTML.
+    """
+    return markdown.markdown(
+        mk_text,
+        extensions=[
+            "pymdownx.extra",
+            "pymdownx.b64",
+            "pymdownx.highlight",
+            "pymdownx.emoji",
+            "pymdownx.tilde",
+            "nl2br",
+        ],
+        extension_configs={
+            "pymdownx.b64": {"base_path": os.path.dirname(os.path.realpath(__file__))},
+            "pymdownx.highlight": {"noclasses": True},
+        },
+    )
+
+
+def wrap_html_file(html_text, file_name, html_template_file, css_path):
+    """
+    Description:
+        Write the HTML content into file_name + ".html", wrapped with the base
+        template and CSS styling.
+
+    Params:
+        html_text [str]: HTML content to be embedded into the base template.
+        file_name [str]: output file path without the `.html` extension.
+        html_template_file [str]: path to the base HTML template.
+        css_path [str]: path to the CSS folder.
+    """
+    file_name += ".html"
+    with open(html_template_file, "r") as fh:
+        file_read = fh.read()
+    file_read = file_read.replace("{text_to_add}", html_text)
+    file_read = file_read.replace("{path_to_css}", css_path)
+    with open(file_name, "w") as fh:
+        fh.write(file_read)
+    return file_name
+
+
+def render_pdf(mk_text, file_name, html_template_file, css_path, wkhtmltopdf):
+    """
+    Description:
+        Render markdown text to HTML and then to PDF with wkhtmltopdf. It is a
+        module function so that several documents can be rendered in a process
+        pool.
+
+    Params:
+        mk_text [str]: markdown text of the document.
+        file_name [str]: output file path without extension.
+        html_template_file [str]: path to the base HTML template.
+        css_path [str]: path to the CSS folder.
+        wkhtmltopdf [str]: path to the wkhtmltopdf executable.
+
+    Returns:
+        PDF file path and the seconds taken by each stage.
+    """
+    timings = {}
+    start = time.perf_counter()
+    html_text = markdown_to_html(mk_text)
+    timings["html"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    html_file = wrap_html_file(html_text, file_name, html_template_file, css_path)
+    timings["wrap"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pdf_file = html_file.replace(".html", ".pdf")
+    pdfkit.from_file(
+        html_file,
+        output_path=pdf_file,
+        configuration=pdfkit.configuration(wkhtmltopdf=wkhtmltopdf),
+    )
+    timings["pdf"] = time.perf_counter() - start
+    return pdf_file, timings
+
+
+def format_size(size):
+    """
+    Description:
+        Human readable size, e.g. 1.5 GB.
+    """
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024 or unit == "GB":
+            break
+        size /= 1024
+    return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+
+
+def scan_tree_sizes(root_path):
+    """
+    Description:
+        Total size, number of files and number of subdirectories of every
+        directory under root_path. Symbolic links are not followed.
+
+    Returns:
+        Dict with (size, files, dirs) for each directory path.
+    """
+    totals = {}
+
+    def scan(path):
+        size = files = dirs = 0
+        try:
+            entries = list(os.scandir(path))
+        except OSError as e:
+            log.warning(f"Could not read directory {path}: {e}")
+            entries = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                dir_size, dir_files, dir_dirs = scan(entry.path)
+                size += dir_size
+                files += dir_files
+                dirs += dir_dirs + 1
+            else:
+                size += entry.stat(follow_symlinks=False).st_size
+                files += 1
+        totals[path] = (size, files, dirs)
+        return size, files, dirs
+
+    scan(root_path)
+    return totals
+
+
+def write_tree(root_path, tree_file, max_depth=None, collapse_files=None):
+    """
+    Description:
+        Write a tree view of root_path, with the size of every entry, line by
+        line to tree_file.
+
+    Usage:
+        write_tree(sftp_path, tree_file_path, max_depth=4, collapse_files=100)
+
+    Params:
+        root_path [str]: folder to show.
+        tree_file [str]: path of the file to write.
+        max_depth [int]: levels of folders to show. The content of deeper
+            folders is summarized in one line. Default: all.
+        collapse_files [int]: folders with more files than this show them
+            summarized in one line. Default: never.
+
+    Returns:
+        Number of directories and files, and total size.
+    """
+    totals = scan_tree_sizes(root_path)
+    counts = {"dirs": 0, "files": 0}
+
+    def summary(files, size):
+        return f"{files} files, {format_size(size)}"
+
+    def write_dir(fh, path, prefix, depth):
+        try:
+            entries = sorted(os.scandir(path), key=lambda entry: entry.name)
+        except OSError:
+            entries = []
+        lines = [(entry, None) for entry in entries]
+        files = [entry for entry in entries if not entry.is_dir(follow_symlinks=False)]
+        if collapse_files is not None and len(files) > collapse_files:
+            # The files are shown in one line, before the folders
+            counts["files"] += len(files)
+            size = sum(entry.stat(follow_symlinks=False).st_size for entry in files)
+            lines = [(None, f"[{summary(len(files), size)}]")] + [
+                (entry, None)
+                for entry in entries
+                if entry.is_dir(follow_symlinks=False)
+            ]
+        for index, (entry, text) in enumerate(lines):
+            last = index == len(lines) - 1
+            connector = "└── " if last else "├── "
+            if entry is None:
+                fh.write(f"{prefix}{connector}{text}\n")
+            elif entry.is_dir(follow_symlinks=False):
+                counts["dirs"] += 1
+                size, dir_files, dir_dirs = totals.get(entry.path, (0, 0, 0))
+                fh.write(f"{prefix}{connector}[{format_size(size)}]  {entry.name}\n")
+                child_prefix = prefix + ("    " if last else "│   ")
+                if max_depth is not None and depth >= max_depth:
+                    counts["files"] += dir_files
+                    counts["dirs"] += dir_dirs
+                    if dir_files:
+                        fh.write(f"{child_prefix}└── [{summary(dir_files, size)}]\n")
+                else:
+                    write_dir(fh, entry.path, child_prefix, depth + 1)
+            else:
+                counts["files"] += 1
+                size = entry.stat(follow_symlinks=False).st_size
+                name = entry.name
+                if entry.is_symlink():
+                    name += " -> " + os.readlink(entry.path)
+                fh.write(f"{prefix}{connector}[{format_size(size)}]  {name}\n")
+
+    total_size = totals[root_path][0]
+    with open(tree_file, "w", encoding="utf-8") as fh:
+        fh.write(f"[{format_size(total_size)}]  {root_path}\n")
+        write_dir(fh, root_path, "", 1)
+        fh.write(
+            f"\n{counts['dirs']} directories, {counts['files']} files, "
+            f"{format_size(total_size)}\n"
+        )
+    return counts["dirs"], counts["files"], total_size
+
+
+class StreamingPdfMerger:
+    """
+    Description:
+        Merge PDF files writing every object to the output as soon as it is read,
+        instead of building the whole merged document in memory. Streams with the
+        same content (fonts, images) are written once and shared by every page
+        using them. The outline of each file is kept under one top-level entry.
+        Objects are numbered when first referenced and written from a queue, so
+        long chains (e.g. the /Next of outline entries) do not recurse.
+
+    Usage:
+        merger = StreamingPdfMerger(output_file)
+        merger.append(pdf_file, title)
+        size = merger.close()
+
+    Params:
+        output_file [str]: path of the merged PDF.
+    """
+
+    # Objects written at the end, once every page is known
+    CATALOG_ID = 1
+    PAGES_ID = 2
+
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self.fh = open(output_file, "wb")
+        self.fh.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+        self.offsets = {}
+        self.next_id = 3
+        self.page_ids = []
+        self.outline_items = []
+        self.dests = DictionaryObject()
+        self.named_dests = {}
+        self.use_outlines = False
+        self.stream_ids = {}
+        self.shared_streams = 0
+        self.appended = 0
+        self.renames = {}
+        # Streams being copied, and whether they were referenced meanwhile
+        self.copying = {}
+        # Objects already numbered but not written yet: (object id, reference)
+        self.pending = []
+
+    def allocate(self):
+        object_id = self.next_id
+        self.next_id += 1
+        return object_id
+
+    def write_object(self, object_id, obj):
+        self.offsets[object_id] = self.fh.tell()
+        self.fh.write(f"{object_id} 0 obj\n".encode())
+        obj.write_to_stream(self.fh, None)
+        self.fh.write(b"\nendobj\n")
+
+    def copy(self, obj, id_map):
+        """
+        Description:
+            Copy a direct object, replacing the references by the merged ones.
+            The referenced objects are written by write_pending.
+        """
+        if isinstance(obj, IndirectObject):
+            return IndirectObject(self.copy_reference(obj, id_map), 0, None)
+        if isinstance(obj, StreamObject):
+            # Streams must be indirect objects
+            object_id = self.allocate()
+            copied = self.copy(DictionaryObject(obj), id_map)
+            self.write_stream(object_id, copied, obj._data)
+            return IndirectObject(object_id, 0, None)
+        if isinstance(obj, DictionaryObject):
+            copied = DictionaryObject()
+            for key, value in obj.items():
+                if key in ("/Dest", "/D") and isinstance(value, str):
+                    value = self.renames.get(self.dest_key(value), value)
+                copied[NameObject(key)] = self.copy(value, id_map)
+            return copied
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self.copy(value, id_map) for value in obj)
+        return obj
+
+    @staticmethod
+    def dest_key(name):
+        # Names of the /Dests dictionary and of the /Dests name tree are apart
+        return (isinstance(name, NameObject), str(name))
+
+    def write_stream(self, object_id, stream_dict, data):
+        """
+        Description:
+            Write a stream with its dictionary already copied.
+        """
+        stream_dict[NameObject("/Length")] = NumberObject(len(data))
+        self.offsets[object_id] = self.fh.tell()
+        self.fh.write(f"{object_id} 0 obj\n".encode())
+        stream_dict.write_to_stream(self.fh, None)
+        self.fh.write(b"\nstream\n")
+        self.fh.write(data)
+        self.fh.write(b"\nendstream\nendobj\n")
+
+    def copy_reference(self, reference, id_map):
+        """
+        Description:
+            Get the merged object number of an object of the file being appended.
+            Objects are queued to be written by write_pending, except streams:
+            they are written right away, unless identical to one already written.
+        """
+        if reference.idnum in id_map:
+            object_id = id_map[reference.idnum]
+            if object_id in self.copying:
+                self.copying[object_id] = True
+            return object_id
+        obj = reference.get_object()
+        # Numbered before copying, as objects can reference each other
+        object_id = id_map[reference.idnum] = self.allocate()
+        if not isinstance(obj, StreamObject):
+            self.pending.append((object_id, reference))
+            return object_id
+
+        # Streams referenced from their own dictionary keep their number
+        self.copying[object_id] = False
+        copied = self.copy(DictionaryObject(obj), id_map)
+        copied.pop("/Length", None)
+        self_referenced = self.copying.pop(object_id)
+        serialized = io.BytesIO()
+        copied.write_to_stream(serialized, None)
+        digest = hashlib.sha256(serialized.getvalue() + obj._data).digest()
+        if not self_referenced and digest in self.stream_ids:
+            self.shared_streams += 1
+            if object_id == self.next_id - 1:
+                self.next_id -= 1
+            # Otherwise the number is left as a free entry of the xref table
+            id_map[reference.idnum] = self.stream_ids[digest]
+            return id_map[reference.idnum]
+        self.stream_ids[digest] = object_id
+        self.write_stream(object_id, copied, obj._data)
+        return object_id
+
+    def write_pending(self, id_map):
+        """
+        Description:
+            Write the queued objects, and the ones they reference in turn.
+        """
+        while self.pending:
+            object_id, reference = self.pending.pop()
+            self.write_object(object_id, self.copy(reference.get_object(), id_map))
+
+    def append(self, pdf_file, title=None):
+        """
+        Description:
+            Write the pages of a PDF file, with everything they use, to the
+            merged PDF, and keep its outline and named destinations.
+
+        Params:
+            pdf_file [str]: path of the PDF file to append.
+            title [str]: title of its top-level outline entry. Default: file name.
+        """
+        reader = PyPDF2.PdfReader(pdf_file)
+        id_map = {}
+        self.appended += 1
+        root = reader.trailer["/Root"]
+        if root.get("/PageMode") == "/UseOutlines":
+            self.use_outlines = True
+
+        # Named destinations already used by a previous file are renamed, so that
+        # the links and outline of each file keep pointing to its own pages
+        dests = []
+        if "/Dests" in root:
+            dests.extend(root["/Dests"].items())
+        if "/Names" in root and "/Dests" in root["/Names"]:
+            nodes = [root["/Names"]["/Dests"]]
+            while nodes:
+                node = nodes.pop()
+                names = node.get("/Names", [])
+                dests.extend(zip(names[::2], names[1::2]))
+                nodes.extend(kid.get_object() for kid in node.get("/Kids", []))
+        self.renames = {}
+        for name, _ in dests:
+            used = self.dests if isinstance(name, NameObject) else self.named_dests
+            if name in used:
+                new_type = (
+                    NameObject if isinstance(name, NameObject) else TextStringObject
+                )
+                new_name = new_type(f"{name}_{self.appended}")
+                self.renames[self.dest_key(name)] = new_name
+
+        # Pages are numbered first, so that links and outlines point to them
+        for page in reader.pages:
+            id_map[page.indirect_reference.idnum] = self.allocate()
+        first_page_id = None
+        for page in reader.pages:
+            page_id = id_map[page.indirect_reference.idnum]
+            first_page_id = first_page_id or page_id
+            copied = self.copy(
+                DictionaryObject(
+                    (key, value) for key, value in page.items() if key != "/Parent"
+                ),
+                id_map,
+            )
+            copied[NameObject("/Parent")] = IndirectObject(self.PAGES_ID, 0, None)
+            self.write_object(page_id, copied)
+            self.write_pending(id_map)
+            self.page_ids.append(page_id)
+            # Written objects are only needed by number from now on
+            reader.resolved_objects.clear()
+
+        for name, dest in dests:
+            used = self.dests if isinstance(name, NameObject) else self.named_dests
+            name = self.renames.get(self.dest_key(name), name)
+            used[name] = self.copy(dest, id_map)
+        self.write_pending(id_map)
+
+        item = {
+            "id": self.allocate(),
+            "title": title or os.path.basename(pdf_file),
+            "page_id": first_page_id,
+        }
+        outlines = root.raw_get("/Outlines") if "/Outlines" in root else None
+        if isinstance(outlines, IndirectObject):
+            # The entries of the file hang from its top-level entry
+            id_map[outlines.idnum] = item["id"]
+            outlines = outlines.get_object()
+            if "/First" in outlines:
+                item["first"] = self.copy(outlines.raw_get("/First"), id_map)
+                item["last"] = self.copy(outlines.raw_get("/Last"), id_map)
+                item["count"] = abs(outlines.get("/Count", 0))
+                self.write_pending(id_map)
+        self.outline_items.append(item)
+        reader.stream.close()
+
+    def close(self):
+        """
+        Description:
+            Write the outline, the page tree, the catalog and the cross-reference
+            table, and close the merged PDF.
+
+        Returns:
+            Size of the merged PDF in bytes.
+        """
+        catalog = DictionaryObject(
+            {
+                NameObject("/Type"): NameObject("/Catalog"),
+                NameObject("/Pages"): IndirectObject(self.PAGES_ID, 0, None),
+            }
+        )
+        if self.outline_items:
+            outlines_id = self.allocate()
+            for index, item in enumerate(self.outline_items):
+                entry = DictionaryObject(
+                    {
+                        NameObject("/Title"): TextStringObject(item["title"]),
+                        NameObject("/Parent"): IndirectObject(outlines_id, 0, None),
+                    }
+                )
+                if item["page_id"] is not None:
+                    entry[NameObject("/Dest")] = ArrayObject(
+                        [IndirectObject(item["page_id"], 0, None), NameObject("/Fit")]
+                    )
+                if index > 0:
+                    entry[NameObject("/Prev")] = IndirectObject(
+                        self.outline_items[index - 1]["id"], 0, None
+                    )
+                if index < len(self.outline_items) - 1:
+                    entry[NameObject("/Next")] = IndirectObject(
+                        self.outline_items[index + 1]["id"], 0, None
+                    )
+                if "first" in item:
+                    entry[NameObject("/First")] = item["first"]
+                    entry[NameObject("/Last")] = item["last"]
+                    entry[NameObject("/Count")] = NumberObject(item["count"])
+                self.write_object(item["id"], entry)
+            self.write_object(
+                outlines_id,
+                DictionaryObject(
+                    {
+                        NameObject("/Type"): NameObject("/Outlines"),
+                        NameObject("/First"): IndirectObject(
+                            self.outline_items[0]["id"], 0, None
+                        ),
+                        NameObject("/Last"): IndirectObject(
+                            self.outline_items[-1]["id"], 0, None
+                        ),
+                        NameObject("/Count"): NumberObject(
+                            sum(1 + item.get("count", 0) for item in self.outline_items)
+                        ),
+                    }
+                ),
+            )
+            catalog[NameObject("/Outlines")] = IndirectObject(outlines_id, 0, None)
+        if self.use_outlines:
+            catalog[NameObject("/PageMode")] = NameObject("/UseOutlines")
+        if self.dests:
+            catalog[NameObject("/Dests")] = self.dests
+        if self.named_dests:
+            names = ArrayObject()
+            for key in sorted(self.named_dests, key=lambda key: str(key)):
+                names.extend([key, self.named_dests[key]])
+            catalog[NameObject("/Names")] = DictionaryObject(
+                {NameObject("/Dests"): DictionaryObject({NameObject("/Names"): names})}
+            )
+        self.write_object(
+            self.PAGES_ID,
+            DictionaryObject(
+                {
+                    NameObject("/Type"): NameObject("/Pages"),
+                    NameObject("/Kids"): ArrayObject(
+                        IndirectObject(page_id, 0, None) for page_id in self.page_ids
+                    ),
+                    NameObject("/Count"): NumberObject(len(self.page_ids)),
+                }
+            ),
+        )
+        self.write_object(self.CATALOG_ID, catalog)
+
+        xref_offset = self.fh.tell()
+        self.fh.write(f"xref\n0 {self.next_id}\n0000000000 65535 f \n".encode())
+        for object_id in range(1, self.next_id):
+            if object_id in self.offsets:
+                self.fh.write(f"{self.offsets[object_id]:010} 00000 n \n".encode())
+            else:
+                self.fh.write(b"0000000000 65535 f \n")
+        self.fh.write(b"trailer\n")
+        DictionaryObject(
+            {
+                NameObject("/Size"): NumberObject(self.next_id),
+                NameObject("/Root"): IndirectObject(self.CATALOG_ID, 0, None),
+            }
+        ).write_to_stream(self.fh, None)
+        self.fh.write(f"\nstartxref\n{xref_offset}\n%%EOF\n".encode())
+        self.fh.close()
+        return os.path.getsize(self.output_file)
+
+
 class BioinfoDoc:
     def __init__(
         self,
@@ -85,7 +636,11 @@ class BioinfoDoc:
             self.resolution_id = resolution_id
         conf_api = conf.get_configuration("api_settings")
         self.rest_api = buisciii.drylab_api.RestServiceApi(
-            conf_api["server"], conf_api["api_url"], api_user, api_password
+            conf_api["server"],
+            conf_api["api_url"],
+            api_user,
+            api_password,
+            cache_ttl=conf_api.get("cache_ttl", 0),
         )
         self.resolution_info = self.rest_api.get_request(
             request_info="service-data", safe=True, resolution=self.resolution_id
@@ -473,98 +1028,23 @@ class BioinfoDoc:
         log.info(f"Markdown file created: {file_name}")
         return str(mk_text), file_name
 
-    def convert_markdown_to_html(self, mk_text):
+    def get_html_assets(self):
         """
         Description:
-            Convert markdown content into HTML.
-
-        Usage:
-            object.convert_markdown_to_html(mk_text)
-
-        Params:
-            mk_text [str]:
-                Markdown text to be converted into HTML.
-        """
-        html_text = markdown.markdown(
-            mk_text,
-            extensions=[
-                "pymdownx.extra",
-                "pymdownx.b64",
-                "pymdownx.highlight",
-                "pymdownx.emoji",
-                "pymdownx.tilde",
-                "nl2br",
-            ],
-            extension_configs={
-                "pymdownx.b64": {
-                    "base_path": os.path.dirname(os.path.realpath(__file__))
-                },
-                "pymdownx.highlight": {"noclasses": True},
-            },
-        )
-        log.info("Converting markdown to HTML...")
-        return html_text
-
-    def wrap_html(self, html_text, file_name):
-        """
-        Description:
-            Wrap HTML content with a base template and CSS styling.
-
-        Usage:
-            object.wrap_html(html_text, file_name)
-
-        Params:
-            html_text [str]:
-                HTML content to be embedded into the base template.
-            file_name [str]:
-                Output file path without the `.html` extension.
+            Get the paths to the base HTML template and the CSS folder.
         """
-        file_name += ".html"
+        package_path = os.path.dirname(os.path.realpath(__file__))
         html_template_file = os.path.join(
-            os.path.dirname(os.path.realpath(__file__)),
-            self.conf["html_template_path_file"],
-        )
-        css_path = os.path.join(
-            os.path.dirname(os.path.realpath(__file__)), self.conf["path_to_css"]
+            package_path, self.conf["html_template_path_file"]
         )
-        with open(html_template_file, "r") as fh:
-            file_read = fh.read()
-        file_read = file_read.replace("{text_to_add}", html_text)
-        file_read = file_read.replace("{path_to_css}", css_path)
-        with open(file_name, "w") as fh:
-            fh.write(file_read)
-        log.info(f"Wrapping HTML with template, output: {file_name}")
-        return file_name
-
-    def convert_to_pdf(self, html_file):
-        """
-        Description:
-            Convert an HTML file into a PDF document.
-
-        Usage:
-            object.convert_to_pdf(html_file)
-
-        Params:
-            html_file [str]:
-                Path to the HTML file to be converted into PDF.
-        """
-        log.info("Converting HTML to PDF...")
-        pdf_file = html_file.replace(".html", ".pdf")
-        try:
-            pdfkit.from_file(
-                html_file, output_path=pdf_file, configuration=self.config_pdfkit
-            )
-            log.info(f"PDF file created successfully: {pdf_file}")
-        except OSError:
-            stderr.print("[red]Unable to convert to PDF!")
-            log.error("Unable to convert to PDF")
-            raise
-        return
+        css_path = os.path.join(package_path, self.conf["path_to_css"])
+        return html_template_file, css_path
 
     def generate_documentation_files(self, type):
         """
         Description:
-            Generate markdown, HTML and PDF files for documentation.
+            Generate the markdown of the documentation, to be rendered to PDF
+            with render_documents.
 
         Usage:
             object.generate_documentation_files(type)
@@ -574,6 +1054,9 @@ class BioinfoDoc:
                 Type of documentation to generate. Supported values:
                 - "service_info": service information documentation.
                 - "delivery": delivery documentation.
+
+        Returns:
+            Markdown text and output file path without extension.
         """
         if type == "service_info":
             file_path = os.path.join(self.service_folder, self.service_info_folder)
@@ -595,11 +1078,121 @@ class BioinfoDoc:
 
         mk_text, file_name = self.create_markdown(file_path)
         file_name_without_ext = file_name.replace(".md", "")
-        html_text = self.convert_markdown_to_html(mk_text)
-        html_file_name = self.wrap_html(html_text, file_name_without_ext)
-        self.convert_to_pdf(html_file_name)
-        pdf_file = html_file_name.replace(".html", ".pdf")
-        return pdf_file
+        return mk_text, file_name_without_ext
+
+    def get_render_key(self, mk_text, wkhtmltopdf):
+        """
+        Description:
+            Hash everything a rendered PDF depends on: its markdown, the HTML
+            template, the CSS, the report images and the wkhtmltopdf executable.
+
+        Returns:
+            Hex digest identifying the PDF in the render cache.
+        """
+        package_path = os.path.dirname(os.path.realpath(__file__))
+        html_template_file, css_path = self.get_html_assets()
+        sha = hashlib.sha256(mk_text.encode())
+        asset_files = [html_template_file]
+        for folder in [
+            css_path,
+            os.path.join(package_path, "assets/reports/md/images"),
+        ]:
+            for root, _, files in os.walk(folder):
+                asset_files.extend(os.path.join(root, name) for name in files)
+        for asset_file in sorted(asset_files):
+            sha.update(os.path.relpath(asset_file, package_path).encode())
+            with open(asset_file, "rb") as fh:
+                sha.update(hashlib.sha256(fh.read()).digest())
+        wkhtmltopdf_stat = os.stat(wkhtmltopdf)
+        sha.update(
+            f"{wkhtmltopdf}:{wkhtmltopdf_stat.st_size}:{wkhtmltopdf_stat.st_mtime_ns}".encode()
+        )
+        return sha.hexdigest()
+
+    def render_documents(self, documents, cacheable=()):
+        """
+        Description:
+            Render several markdown documents to PDF at the same time, each one in
+            a process of a pool (and its own wkhtmltopdf). The time taken by each
+            stage of each document is logged.
+            The cacheable documents are taken from the render cache when an
+            identical one has already been rendered, and saved in it otherwise.
+
+        Usage:
+            object.render_documents({"delivery": (mk_text, file_name), ...})
+
+        Params:
+            documents [dict]:
+                Name of each document and its markdown text and output file path
+                without extension.
+            cacheable [list]:
+                Names of the documents that do not depend on the resolution.
+
+        Returns:
+            Dict with the PDF file of each document.
+        """
+        html_template_file, css_path = self.get_html_assets()
+        wkhtmltopdf = self.config_pdfkit.wkhtmltopdf
+        if isinstance(wkhtmltopdf, bytes):
+            wkhtmltopdf = wkhtmltopdf.decode()
+        pdf_files = {}
+        cache_files = {}
+        if self.conf.get("render_cache", False):
+            cache_dir = os.path.join(buisciii.utils.get_cache_dir(), "renders")
+            os.makedirs(cache_dir, exist_ok=True)
+            for name in cacheable:
+                if name not in documents:
+                    continue
+                mk_text, file_name = documents[name]
+                cache_files[name] = os.path.join(
+                    cache_dir, self.get_render_key(mk_text, wkhtmltopdf) + ".pdf"
+                )
+                if os.path.isfile(cache_files[name]):
+                    pdf_files[name] = file_name + ".pdf"
+                    buisciii.utils.clone_file(cache_files[name], pdf_files[name])
+                    log.info(f"Took {name} document from the render cache")
+        documents = {
+            name: document
+            for name, document in documents.items()
+            if name not in pdf_files
+        }
+        if not documents:
+            return pdf_files
+        log.info(f"Rendering {len(documents)} documents to PDF...")
+        start = time.perf_counter()
+        with ProcessPoolExecutor(
+            max_workers=min(len(documents), self.conf.get("render_processes", 3))
+        ) as executor:
+            futures = {
+                name: executor.submit(
+                    render_pdf,
+                    mk_text,
+                    file_name,
+                    html_template_file,
+                    css_path,
+                    wkhtmltopdf,
+                )
+                for name, (mk_text, file_name) in documents.items()
+            }
+            for name, future in futures.items():
+                try:
+                    pdf_files[name], timings = future.result()
+                except OSError:
+                    stderr.print(f"[red]Unable to convert the {name} document to PDF!")
+                    log.error(f"Unable to convert the {name} document to PDF")
+                    raise
+                log.info(
+                    f"Rendered {name} document in "
+                    + ", ".join(
+                        f"{stage} {seconds:.2f}s" for stage, seconds in timings.items()
+                    )
+                )
+                if name in cache_files:
+                    tmp_file = f"{cache_files[name]}.{os.getpid()}.tmp"
+                    buisciii.utils.clone_file(pdf_files[name], tmp_file)
+                    os.replace(tmp_file, cache_files[name])
+        log.info(f"Documents rendered in {time.perf_counter() - start:.2f}s")
+        return pdf_files
 
     def join_pdf_files(self, documentation_pdf, results_pdf, service_pdf):
         """
@@ -628,15 +1221,42 @@ class BioinfoDoc:
             self.delivery_sub_folder,
             delivery_pdf_name,
         )
+        pdf_files = [
+            (title, pdf_file)
+            for title, pdf_file in (
+                ("Delivery", documentation_pdf),
+                ("Results", results_pdf),
+                ("Service", service_pdf),
+            )
+            if pdf_file is not None
+        ]
         try:
             log.info("Merging PDF files...")
-            mergeFile = PyPDF2.PdfMerger()
-            mergeFile.append(PyPDF2.PdfReader(documentation_pdf, "rb"))
-            if results_pdf is not None:
-                mergeFile.append(PyPDF2.PdfReader(results_pdf, "rb"))
-            if service_pdf is not None:
-                mergeFile.append(PyPDF2.PdfReader(service_pdf, "rb"))
-            mergeFile.write(delivery_pdf_file)
+            merge_mode = self.conf.get("merge_mode", "stream")
+            shared_streams = 0
+            if merge_mode == "stream":
+                merger = StreamingPdfMerger(delivery_pdf_file)
+                try:
+                    for title, pdf_file in pdf_files:
+                        merger.append(pdf_file, title)
+                    merger.close()
+                    shared_streams = merger.shared_streams
+                except Exception as e:
+                    merger.fh.close()
+                    stderr.print(
+                        f"[yellow]Streaming PDF merge failed ({type(e).__name__}: {e}), merging with PyPDF2"
+                    )
+                    log.warning(
+                        f"Streaming PDF merge failed, merging with PyPDF2: {type(e).__name__}: {e}"
+                    )
+                    merge_mode = "pypdf2"
+            if merge_mode == "pypdf2":
+                mergeFile = PyPDF2.PdfMerger()
+                for _, pdf_file in pdf_files:
+                    mergeFile.append(PyPDF2.PdfReader(pdf_file, "rb"))
+                mergeFile.write(delivery_pdf_file)
+            input_size = sum(os.path.getsize(pdf_file) for _, pdf_file in pdf_files)
+            output_size = os.path.getsize(delivery_pdf_file)
             stderr.print(
                 "[green]Successfully merged the PDFs %s, %s and %s to the directory '%s'"
                 % (
@@ -652,7 +1272,15 @@ class BioinfoDoc:
                 ),
                 highlight=False,
             )
-            log.info(f"Merged PDF saved to: {delivery_pdf_file}")
+            stderr.print(
+                f"Merged PDF size: {output_size / 1024 ** 2:.2f} MB "
+                f"(inputs {input_size / 1024 ** 2:.2f} MB, "
+                f"{shared_streams} repeated streams written once)"
+            )
+            log.info(
+                f"Merged PDF saved to: {delivery_pdf_file} ({output_size} bytes, "
+                f"inputs {input_size} bytes, {shared_streams} shared streams)"
+            )
 
         except OSError:
             stderr.print("[red]ERROR: Merging PDFs failed.")
@@ -683,7 +1311,8 @@ class BioinfoDoc:
     def create_results_doc(self, md_list, md_type):
         """
         Description:
-            Generate PDF documentation from result or service markdown files.
+            Join the result or service markdown files into one document, to be
+            rendered to PDF with render_documents.
 
         Usage:
             object.create_results_doc(md_list, md_type)
@@ -696,6 +1325,9 @@ class BioinfoDoc:
                 Type of markdown being processed. Can be:
                     - "service": service description markdown
                     - "results": results markdown
+
+        Returns:
+            Markdown text and output file path without extension.
         """
         stderr.print(
             "Creating service results markdown file for " + self.service_folder + " !"
@@ -729,11 +1361,7 @@ class BioinfoDoc:
             f_name = self.resolution_number + "_results.md"
         file_name = os.path.join(file_path, f_name)
         file_name_without_ext = file_name.replace(".md", "")
-        html_text = self.convert_markdown_to_html(mk_text)
-        html_file_name = self.wrap_html(html_text, file_name_without_ext)
-        self.convert_to_pdf(html_file_name)
-        pdf_file = html_file_name.replace(".html", ".pdf")
-        return pdf_file
+        return mk_text, file_name_without_ext
 
     def clean_files(self):
         """
@@ -761,22 +1389,26 @@ class BioinfoDoc:
             Generate and store a tree view of the service content on the SFTP.
         """
         sftp_path = os.path.join(self.sftp_folder, self.service_name)
+        tree_file_name = (
+            self.resolution_number + "_" + self.delivery_sub_folder + ".tree"
+        )
+        tree_file_path = os.path.join(
+            self.service_folder,
+            self.service_result_folder,
+            self.delivery_sub_folder,
+            tree_file_name,
+        )
+        if not os.path.isdir(sftp_path):
+            stderr.print(f"[red]ERROR: SFTP folder {sftp_path} does not exist")
+            log.error(f"ERROR: SFTP folder {sftp_path} does not exist")
+            raise FileNotFoundError(sftp_path)
         try:
-            tree_result = subprocess.run(
-                ["tree", sftp_path], capture_output=True, text=True, check=True
-            )
-            tree_file_name = (
-                self.resolution_number + "_" + self.delivery_sub_folder + ".tree"
-            )
-            tree_file_path = os.path.join(
-                self.service_folder,
-                self.service_result_folder,
-                self.delivery_sub_folder,
-                tree_file_name,
+            dirs, files, size = write_tree(
+                sftp_path,
+                tree_file_path,
+                max_depth=self.conf.get("tree_max_depth"),
+                collapse_files=self.conf.get("tree_collapse_files"),
             )
-            f = open(tree_file_path, "w")
-            f.write(tree_result.stdout)
-            f.close()
             stderr.print(
                 "[green]Successfully created tree file from '%s' in '%s'"
                 % (sftp_path, tree_file_path),
@@ -784,12 +1416,9 @@ class BioinfoDoc:
             )
             log.info(
                 f"Successfully created tree file from '{sftp_path}' in '{tree_file_path}'"
+                f" ({dirs} directories, {files} files, {format_size(size)})"
             )
 
-        except subprocess.CalledProcessError:
-            stderr.print("[red]ERROR: Failed to create tree from SFTP")
-            log.error("ERROR: Failed to create tree from SFTP")
-            raise
         except IOError:
             stderr.print("[red]ERROR: Failed to create tree file")
             log.error("ERROR: Failed to create tree file")
@@ -1030,38 +1659,49 @@ class BioinfoDoc:
         """
         self.create_structure()
         if self.type == "service_info":
-            self.generate_documentation_files("service_info")
+            self.render_documents(
+                {"service_info": self.generate_documentation_files("service_info")}
+            )
             return
         elif self.type == "delivery":
-            doc_pdf = self.generate_documentation_files("delivery")
+            # The documents are rendered together once all their markdown is ready
+            documents = {"delivery": self.generate_documentation_files("delivery")}
             self.copy_images()
             if self.results_md_list:
-                result_pdf = self.create_results_doc(self.results_md_list, "results")
+                documents["results"] = self.create_results_doc(
+                    self.results_md_list, "results"
+                )
             else:
                 stderr.print("Results markdown does not exist.")
                 log.warning("Results markdown does not exist.")
-                if buisciii.utils.prompt_yn_question(
+                if not buisciii.utils.prompt_yn_question(
                     "Do you want to continue without it?", dflt=True
                 ):
-                    result_pdf = None
-                else:
                     stderr.print("Bye.")
                     log.info("Bye.")
                     sys.exit()
             if self.delivery_md_list:
-                service_pdf = self.create_results_doc(self.delivery_md_list, "service")
+                documents["service"] = self.create_results_doc(
+                    self.delivery_md_list, "service"
+                )
             else:
                 stderr.print("Delivery markdown does not exist.")
                 log.warning("Delivery markdown does not exist.")
-                if buisciii.utils.prompt_yn_question(
+                if not buisciii.utils.prompt_yn_question(
                     "Do you want to continue without it?", dflt=True
                 ):
-                    service_pdf = None
-                else:
                     stderr.print("Bye.")
                     log.info("Bye.")
                     sys.exit()
-            results_pdf = self.join_pdf_files(doc_pdf, result_pdf, service_pdf)
+            # Results and service documents only depend on the services requested
+            pdf_files = self.render_documents(
+                documents, cacheable=["results", "service"]
+            )
+            results_pdf = self.join_pdf_files(
+                pdf_files["delivery"],
+                pdf_files.get("results"),
+                pdf_files.get("service"),
+            )
             self.clean_files()
             self.sftp_tree()
             email_html = self.email_creation()
@@ -4,13 +4,13 @@
 import sys
 import os
 import logging
-import shutil
+from collections import defaultdict
 from rich.console import Console
 
 # Local imports
 import buisciii
 import buisciii.utils
-import buisciii.drylab_api
+import buisciii.service_context
 import buisciii.service_json
 
 log = logging.getLogger(__name__)
@@ -23,6 +23,98 @@ stderr = Console(
 )
 
 
+class ServiceTreeIndex:
+    """
+    Description:
+        Index of every file and directory name in a service tree, built with a
+        single walk, so that all the lookups done while cleaning don't need to
+        walk the tree again.
+
+    Usage:
+        index = ServiceTreeIndex(path)
+        paths = index.find("virus_coverage/plots")
+
+    Params:
+        path [str]: root of the service tree.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # key: name, values: [(root, is_dir)] in os.walk order
+        self.entries = defaultdict(list)
+        # paths removed since the index was built
+        self.removed = set()
+        for root, dirs, files in os.walk(path):
+            for name in dirs:
+                self.entries[name].append((root, True))
+            for name in files:
+                self.entries[name].append((root, False))
+
+    def is_removed(self, path):
+        """
+        Description:
+            Check if the path, or any of its parents, was discarded.
+        """
+        if not self.removed:
+            return False
+        while path.startswith(self.path):
+            if path in self.removed:
+                return True
+            parent = os.path.dirname(path)
+            if parent == path:
+                break
+            path = parent
+        return False
+
+    def discard(self, path):
+        """
+        Description:
+            Mark a removed file or directory (and its content) as no longer present.
+        """
+        self.removed.add(path)
+
+    def find(self, item_to_find, only_dirs=False):
+        """
+        Description:
+            Get the paths of the files or directories called like item_to_find.
+            If item_to_find contains subpaths (e.g. virus_coverage/plots), the
+            parent directories must match too.
+
+        Params:
+            item_to_find [str]: name, optionally preceded by its parent directories.
+            only_dirs [bool]: return only directories.
+        """
+        # If there are subpaths, split them into different components (e.g., ["virus_coverage", "plots"], from virus_coverage/plots)
+        path_parts = item_to_find.split(os.sep)
+        target_name = path_parts[-1]
+        parent_dirs = os.sep.join(path_parts[:-1])
+        found = []
+        for root, is_dir in self.entries.get(target_name, []):
+            if only_dirs and not is_dir:
+                continue
+            if root.endswith(parent_dirs):
+                full_path = os.path.join(root, target_name)
+                if not self.is_removed(full_path):
+                    found.append(full_path)
+        return found
+
+    def find_suffix(self, suffixes):
+        """
+        Description:
+            Get the paths of the files or directories whose name ends with one of
+            the suffixes, deepest first so that they can be renamed safely.
+        """
+        suffixes = tuple(suffixes)
+        found = []
+        for name, locations in self.entries.items():
+            if name.endswith(suffixes) and name not in suffixes:
+                for root, _ in locations:
+                    full_path = os.path.join(root, name)
+                    if not self.is_removed(full_path):
+                        found.append(full_path)
+        return sorted(found, key=lambda path: path.count(os.sep), reverse=True)
+
+
 class CleanUp:
     def __init__(
         self,
@@ -33,28 +125,20 @@ class CleanUp:
         api_user=None,
         api_password=None,
         conf=None,
+        context=None,
     ):
         # Access the API with the resolution name to obtain the data
-        if resolution_id is None:
-            self.resolution_id = buisciii.utils.prompt_resolution_id()
-        else:
-            self.resolution_id = resolution_id
+        # (or reuse the data already obtained by a previous module)
+        if context is None:
+            context = buisciii.service_context.ServiceContext(
+                resolution_id, api_user, api_password, conf
+            )
+        self.resolution_id = context.resolution_id
 
-        # Obtain info from iSkyLIMS API
         self.conf = conf.get_configuration("cleanning")
-        conf_api = conf.get_configuration("xtutatis_api_settings")
-        rest_api = buisciii.drylab_api.RestServiceApi(
-            conf_api["server"], conf_api["api_url"], api_user, api_password
-        )
-        self.resolution_info = rest_api.get_request(
-            request_info="service-data", safe=True, resolution=self.resolution_id
-        )
-        self.service_folder = self.resolution_info["resolutions"][0][
-            "resolution_full_number"
-        ]
-        self.services_requested = self.resolution_info["resolutions"][0][
-            "available_services"
-        ]
+        self.resolution_info = context.resolution_info
+        self.service_folder = context.service_folder
+        self.services_requested = context.services_requested
         self.service_samples = [
             sample_id["sample_name"] for sample_id in self.resolution_info["samples"]
         ]
@@ -87,17 +171,14 @@ class CleanUp:
                 "Either give a path or make the terminal ask you for a path, not both"
             )
         else:
-            self.path = buisciii.utils.get_service_paths(
-                conf,
-                "services_and_colaborations",
-                self.resolution_info,
-                "non_archived_path",
-            )
+            self.path = context.data_path
 
         self.full_path = os.path.join(self.path, self.service_folder)
+        # Built on first use, see get_tree_index()
+        self.tree_index = None
 
         # Load service conf
-        self.services_to_clean = buisciii.utils.get_service_ids(self.services_requested)
+        self.services_to_clean = context.service_ids
         self.delete_folders = self.get_clean_items(
             self.services_to_clean, type="folders"
         )
@@ -226,6 +307,19 @@ class CleanUp:
         else:
             return self.nocopy
 
+    def get_tree_index(self):
+        """
+        Description:
+            Return the index of the service tree, walking it only if it was not
+            built yet or if it was invalidated by a renaming.
+
+        Usage:
+            tree_index = object.get_tree_index()
+        """
+        if self.tree_index is None:
+            self.tree_index = ServiceTreeIndex(self.full_path)
+        return self.tree_index
+
     def scan_dirs(self, to_find):
         """
         Description:
@@ -237,6 +331,9 @@ class CleanUp:
         (either files or directories) won't be added into the
         dictionary.
 
+        The lookups are done on the service tree index, so the tree is
+        walked only once for all the items.
+
         Usage:
             to_rename, to_delete = object.scan_dirs(to_find=list)
 
@@ -244,27 +341,14 @@ class CleanUp:
 
         """
         self.check_path_exists()
+        tree_index = self.get_tree_index()
         pathlist = []
         found = []
 
         for item_to_find in to_find:
-            # If there are subpaths in to_find, split them into different components (e.g., ["virus_coverage", "plots"], from virus_coverage/plots)
-            path_parts = item_to_find.split(os.sep)
-            target_name = path_parts[-1]
-            parent_dirs = path_parts[:-1]
-
-            for root, dirs, files in os.walk(self.full_path):
-                if root.endswith(os.sep.join(parent_dirs)):
-                    # Check for matching directories, if any
-                    if target_name in dirs:
-                        full_path = os.path.join(root, target_name)
-                        pathlist.append(full_path)
-                        found.append(item_to_find)
-                    # Check for matching files, if any
-                    if target_name in files:
-                        full_path = os.path.join(root, target_name)
-                        pathlist.append(full_path)
-                        found.append(item_to_find)
+            item_paths = tree_index.find(item_to_find)
+            pathlist.extend(item_paths)
+            found.extend([item_to_find] * len(item_paths))
 
         # Check found list without duplicates
         if not sorted(list(dict.fromkeys(found))) == sorted(to_find):
@@ -288,14 +372,11 @@ class CleanUp:
 
         """
         self.check_path_exists()
-        workdirs = []
-        # key: root, values: [[files inside], [dirs inside]]
-        for root, dirs, files in os.walk(self.full_path):
-            for name in dirs:
-                if name == "work":
-                    if os.path.exists(os.path.join(root, name)):
-                        workdir = os.path.join(root, name)
-                        workdirs.append(workdir)
+        workdirs = [
+            workdir
+            for workdir in self.get_tree_index().find("work", only_dirs=True)
+            if os.path.exists(workdir)
+        ]
         return workdirs
 
     def rename(self, to_find, add, verbose=True):
@@ -320,7 +401,12 @@ class CleanUp:
             log.info("No directories renamed!")
             sys.exit()
 
-        path_content = self.scan_dirs(to_find=to_find)
+        # Deepest first, so nested matches are renamed before their parents
+        path_content = sorted(
+            self.scan_dirs(to_find=to_find),
+            key=lambda path: path.count(os.sep),
+            reverse=True,
+        )
         unfiltered_path_content = [f.path for f in os.scandir(self.full_path)]
         for directory_to_rename in path_content:
             renamed_directory = str(directory_to_rename + add)
@@ -337,6 +423,7 @@ class CleanUp:
                 newpath = directory_to_rename + add
                 try:
                     os.replace(directory_to_rename, newpath)
+                    self.tree_index = None
                     if verbose:
                         print(f"Renamed {directory_to_rename} to {newpath}.")
                 except PermissionError:
@@ -347,7 +434,102 @@ class CleanUp:
                     raise
         return
 
-    def purge_files(self):
+    def get_files_to_purge(self):
+        """
+        Description:
+            Get the paths of the sample files that must be deleted.
+
+        Usage:
+            files = object.get_files_to_purge()
+
+        Params:
+
+        """
+        if self.service_samples is None or self.delete_files == "":
+            return []
+        files_to_delete = []
+        for sample_info in self.service_samples:
+            for file in self.delete_files:
+                file_to_delete = file.replace("sample_name", sample_info)
+                if file_to_delete not in files_to_delete:
+                    files_to_delete.append(file_to_delete)
+        return self.scan_dirs(to_find=files_to_delete)
+
+    def get_folder_items_to_purge(self, sacredtexts=["lablog", "logs"], add=""):
+        """
+        Description:
+            Get the paths of the items inside the folders to purge, except the
+            sacred ones.
+
+        Usage:
+            items = object.get_folder_items_to_purge(sacredtexts=["lablog", "logs"], add="_DEL")
+
+        Params:
+            sacredtexts [list]: names (str) of the files that will not be deleted.
+            add [str]: folders ending with it were already purged and are skipped.
+        """
+        if self.delete_folders == "":
+            return []
+        items = []
+        for directory in self.scan_dirs(to_find=self.delete_folders):
+            # if not empty, and not previously DEL add it to the content
+            if not directory.endswith(add):
+                for item in os.listdir(directory):
+                    if item not in sacredtexts:
+                        items.append(os.path.join(directory, item))
+        return items
+
+    def remove_items(self, paths, verbose=True):
+        """
+        Description:
+            Remove files and folders with the parallel deletion engine and mark
+            them as removed in the tree index. Items inside an already removed
+            folder are skipped.
+
+        Usage:
+            object.remove_items(paths)
+
+        Params:
+            paths [list]: paths of the files and folders to remove.
+            verbose [bool]: print each removed item.
+        """
+        tree_index = self.get_tree_index()
+        paths = [path for path in paths if not tree_index.is_removed(path)]
+        if not paths:
+            return 0, 0
+        threads = self.conf.get("delete_threads", 16)
+        files, size = buisciii.utils.remove_paths(paths, threads=threads)
+        for path in paths:
+            tree_index.discard(path)
+            if verbose:
+                stderr.print("[green]Successfully removed " + path)
+                log.info(f"Successfully removed {path}!")
+        stderr.print(f"Removed {files} files, {size / pow(1024, 3):.3f} GB freed.")
+        return files, size
+
+    def show_size_to_free(self, paths):
+        """
+        Description:
+            Dry run of the deletion: print the number of files and the total size
+            that removing the paths would free, without removing anything.
+
+        Usage:
+            object.show_size_to_free(paths)
+
+        Params:
+            paths [list]: paths of the files and folders that would be removed.
+        """
+        threads = self.conf.get("delete_threads", 16)
+        files, size = buisciii.utils.remove_paths(paths, threads=threads, dry_run=True)
+        stderr.print(
+            f"{files} files will be removed, freeing {size / pow(1024, 3):.3f} GB."
+        )
+        log.info(
+            f"{files} files will be removed, freeing {size / pow(1024, 3):.3f} GB."
+        )
+        return files, size
+
+    def purge_files(self, files=None):
         """
         Description:
             Remove the files that must be deleted before the service delivery.
@@ -356,23 +538,16 @@ class CleanUp:
             object.purge_files()
 
         Params:
-
+            files [list]: paths to remove. If None, they are searched in the service.
         """
-        if self.service_samples is not None:
-            files_to_delete = []
-            for sample_info in self.service_samples:
-                for file in self.delete_files:
-                    file_to_delete = file.replace("sample_name", sample_info)
-                    if file_to_delete not in files_to_delete:
-                        files_to_delete.append(file_to_delete)
-            path_content = self.scan_dirs(to_find=files_to_delete)
-            for file in path_content:
-                os.remove(file)
-                stderr.print("[green]Successfully removed " + file)
-                log.info(f"Successfully removed {file}!")
+        if files is None:
+            files = self.get_files_to_purge()
+        self.remove_items(files)
         return
 
-    def purge_folders(self, sacredtexts=["lablog", "logs"], add="", verbose=True):
+    def purge_folders(
+        self, sacredtexts=["lablog", "logs"], add="", verbose=True, items=None
+    ):
         """
         Description:
             Remove the files that must be deleted for the delivery of the service.
@@ -384,27 +559,14 @@ class CleanUp:
 
         Params:
             sacredtexts [list]: names (str) of the files that will not be deleted.
-
+            items [list]: paths to remove. If None, they are searched in the service.
         """
-        path_content = self.scan_dirs(to_find=self.delete_folders)
-
-        for directory in path_content:
-            # if not empty, and not previously DEL add it to the content
-            if not directory.endswith(add):
-                for item in os.listdir(directory):
-                    if item not in sacredtexts:
-                        item_path = os.path.join(directory, item)
-                        # shutil if dir, os.remove if file
-                        if os.path.isdir(item_path):
-                            shutil.rmtree(item_path)
-                        else:
-                            os.remove(item_path)
-                        if verbose:
-                            stderr.print("[green]Successfully removed " + item_path)
-                            log.info(f"Successfully removed {item_path}!")
+        if items is None:
+            items = self.get_folder_items_to_purge(sacredtexts=sacredtexts, add=add)
+        self.remove_items(items, verbose=verbose)
         return
 
-    def delete_work(self):
+    def delete_work(self, work_dir=None):
         """
         Description:
             Removes the whole work folder.
@@ -413,14 +575,12 @@ class CleanUp:
             object.delete_work()
 
         Params:
-
+            work_dir [list]: work folders to remove. If None, they are searched in the service.
         """
-        work_dir = self.find_work()
+        if work_dir is None:
+            work_dir = self.find_work()
         if work_dir:
-            for work_folder in work_dir:
-                shutil.rmtree(work_folder)
-                stderr.print("[green]Successfully removed " + work_folder)
-                log.info(f"Successfully removed {work_folder}!")
+            self.remove_items(work_dir)
         else:
             stderr.print("There is no work folder!")
             log.warning("There is no work folder!")
@@ -429,6 +589,7 @@ class CleanUp:
         """
         Description:
             Remove both files and purge folders defined for the service, and rename to tag.
+            The space that will be freed is shown before asking for confirmation.
 
         Usage:
             object.delete()
@@ -438,6 +599,10 @@ class CleanUp:
         """
         # Show removable items
         self.show_removable()
+        folder_items = self.get_folder_items_to_purge(sacredtexts=sacredtexts, add=add)
+        work_dir = self.find_work()
+        files = self.get_files_to_purge()
+        self.show_size_to_free(folder_items + work_dir + files)
 
         # Ask for confirmation
         if not buisciii.utils.prompt_yn_question("Is it okay?", dflt=True):
@@ -447,16 +612,18 @@ class CleanUp:
 
         # Purge folders
         if self.delete_folders != "":
-            self.purge_folders(sacredtexts=sacredtexts, add=add, verbose=verbose)
+            self.purge_folders(
+                sacredtexts=sacredtexts, add=add, verbose=verbose, items=folder_items
+            )
         else:
             stderr.print("There are no folders to delete!")
             log.info("There are no folders to delete!")
 
         # Purge work
-        self.delete_work()
+        self.delete_work(work_dir=work_dir)
         # Delete files
         if self.delete_files != "":
-            self.purge_files()
+            self.purge_files(files=files)
         else:
             stderr.print("No files to remove!")
             log.info("No files to remove!")
@@ -467,20 +634,23 @@ class CleanUp:
             Reverts the naming (adding of the _NC tag).
 
         """
-        to_rename = self.scan_dirs(to_find=terminations)
+        self.check_path_exists()
+        to_rename = self.get_tree_index().find_suffix(terminations)
         if not to_rename:
             stderr.print("[yellow] WARNING: I have nothing to revert renaming from!")
             log.warning("WARNING: I have nothing to revert renaming from!")
             return
         for dir_to_rename in to_rename:
-            # remove all the terminations
+            # remove the termination
             for term in terminations:
                 if dir_to_rename.endswith(term):
-                    newname = dir_to_rename.replace(term, "")
+                    newname = dir_to_rename[: -len(term)]
                     os.replace(dir_to_rename, newname)
-            if verbose:
-                stderr.print(f"Replaced {dir_to_rename} with {newname}.")
-                log.info(f"Replaced {dir_to_rename} with {newname}.")
+                    if verbose:
+                        stderr.print(f"Replaced {dir_to_rename} with {newname}.")
+                        log.info(f"Replaced {dir_to_rename} with {newname}.")
+                    break
+        self.tree_index = None
 
     def full_clean(self):
         """
@@ -2,8 +2,11 @@
 
 # Generic imports
 import os
+import fnmatch
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from rich.console import Console
+import rich.table
 import sysrsync
 from sysrsync.exceptions import RsyncError
 from datetime import datetime
@@ -11,7 +14,7 @@ from datetime import datetime
 # Local imports
 import buisciii
 import buisciii.utils
-import buisciii.drylab_api
+import buisciii.service_context
 import buisciii.service_json
 
 log = logging.getLogger(__name__)
@@ -34,39 +37,29 @@ class CopySftp:
         api_user=None,
         api_password=None,
         conf=None,
+        context=None,
     ):
-        if resolution_id is None:
-            self.resolution_id = buisciii.utils.prompt_resolution_id()
-        else:
-            self.resolution_id = resolution_id
+        # Obtain info from iSkyLIMS API, unless already given
+        if context is None:
+            context = buisciii.service_context.ServiceContext(
+                resolution_id, api_user, api_password, conf
+            )
+        self.resolution_id = context.resolution_id
 
         # Load conf
         self.conf = conf.get_configuration("sftp_copy")
-        conf_api = conf.get_configuration("xtutatis_api_settings")
-
-        # Obtain info from iSkyLIMS API
-        rest_api = buisciii.drylab_api.RestServiceApi(
-            conf_api["server"], conf_api["api_url"], api_user, api_password
-        )
 
-        self.resolution_info = rest_api.get_request(
-            request_info="service-data", safe=True, resolution=self.resolution_id
-        )
+        self.resolution_info = context.resolution_info
         if sftp_folder is None:
-            self.sftp_folder = buisciii.utils.get_sftp_folder(
-                conf, self.resolution_info
-            )[0]
+            self.sftp_folder = context.sftp_folder
         else:
             self.sftp_folder = sftp_folder
 
-        self.service_folder = self.resolution_info["resolutions"][0][
-            "resolution_full_number"
-        ]
-        self.services_requested = self.resolution_info["resolutions"][0][
-            "available_services"
-        ]
+        self.service_folder = context.service_folder
+        self.services_requested = context.services_requested
         self.sftp_options = conf.get_find("sftp_copy", "options")
-        self.services_to_copy = buisciii.utils.get_service_ids(self.services_requested)
+        self.permissions = conf.get_configuration("global").get("permissions")
+        self.services_to_copy = context.service_ids
 
         self.last_folders = self.get_last_folders(
             self.services_to_copy, type="last_folder"
@@ -97,14 +90,26 @@ class CopySftp:
                 "Either give a path or make the terminal ask you for a path, not both."
             )
         else:
-            self.path = buisciii.utils.get_service_paths(
-                conf,
-                "services_and_colaborations",
-                self.resolution_info,
-                "non_archived_path",
-            )
+            self.path = context.data_path
 
         self.full_path = os.path.join(self.path, self.service_folder)
+        self.checksum_cache = buisciii.utils.get_checksum_cache(conf)
+        # Delivery manifest: size, mtime and md5 of every file, and whether its
+        # SFTP copy has been verified. Used to resume interrupted deliveries.
+        self.manifest_file = os.path.join(self.full_path, "DOC", "sftp_manifest.tsv")
+        self.pending_file = os.path.join(
+            self.full_path, "DOC", "sftp_pending_files.txt"
+        )
+        self.log_file = os.path.join(
+            self.full_path,
+            "DOC",
+            "rsync_" + datetime.today().strftime("%Y%m%d") + ".log",
+        )
+        # Files written by the delivery itself are not delivered
+        self.exclusions = self.conf["exclusions"] + [
+            os.path.basename(delivery_file)
+            for delivery_file in [self.manifest_file, self.pending_file, self.log_file]
+        ]
 
     def get_last_folders(self, services_ids, type="last_folder"):
         """
@@ -137,14 +142,238 @@ class CopySftp:
 
         return last_folders_list
 
-    def listdirs(self, final_path):
+    def is_excluded(self, relative_path):
+        """
+        Description:
+            Check a path against the exclusions, as rsync does: patterns with a
+            "/" are matched against the path, the rest against the name.
+        """
+        for pattern in self.exclusions:
+            pattern = pattern.strip("'\"")
+            if "/" in pattern:
+                if fnmatch.fnmatch(relative_path, pattern.strip("/")):
+                    return True
+            elif fnmatch.fnmatch(os.path.basename(relative_path), pattern):
+                return True
+        return False
+
+    def get_delivery_files(self):
+        """
+        Description:
+            Walk the service folder as rsync -L does (following symlinks) and get
+            the files to deliver, skipping the excluded ones.
+
+        Returns:
+            Dict {relative path: (size, mtime_ns)}
+        """
+        files = {}
+        # Folders reached through several paths are delivered under each of them,
+        # only a symlink to one of its own parent folders would loop forever
+        pending = [("", frozenset())]
+        while pending:
+            relative_dir, ancestors = pending.pop()
+            directory = os.path.join(self.full_path, relative_dir)
+            try:
+                dir_stat = os.stat(directory)
+            except OSError as e:
+                log.warning(f"Folder not delivered: {directory}: {e}")
+                continue
+            dir_id = (dir_stat.st_dev, dir_stat.st_ino)
+            if dir_id in ancestors:
+                log.warning(f"Symlink loop not followed: {directory}")
+                continue
+            ancestors = ancestors | {dir_id}
+            with os.scandir(directory) as it:
+                for entry in it:
+                    relative_path = os.path.join(relative_dir, entry.name)
+                    if self.is_excluded(relative_path):
+                        continue
+                    try:
+                        if entry.is_dir():
+                            pending.append((relative_path, ancestors))
+                            continue
+                        stat = entry.stat()
+                    except OSError:
+                        log.warning(f"Broken link not delivered: {entry.path}")
+                        continue
+                    files[relative_path] = (stat.st_size, stat.st_mtime_ns)
+        return files
+
+    def read_manifest(self):
+        """
+        Description:
+            Read the delivery manifest of a previous copy-sftp, if any.
+
+        Returns:
+            Dict {relative path: [size, mtime_ns, md5, verified]}
+        """
+        manifest = {}
+        if not os.path.isfile(self.manifest_file):
+            return manifest
+        with open(self.manifest_file) as fh:
+            for line in fh:
+                if line.startswith("#"):
+                    continue
+                relative_path, size, mtime_ns, md5, verified = line.rstrip("\n").split(
+                    "\t"
+                )
+                manifest[relative_path] = [
+                    int(size),
+                    int(mtime_ns),
+                    md5,
+                    verified == "yes",
+                ]
+        return manifest
+
+    def write_manifest(self, manifest):
+        """
+        Description:
+            Save the delivery manifest in DOC, replacing the previous one.
+        """
+        tmp_file = self.manifest_file + ".tmp"
+        with open(tmp_file, "w") as fh:
+            fh.write("# path\tsize\tmtime_ns\tmd5\tverified\n")
+            for relative_path, (size, mtime_ns, md5, verified) in sorted(
+                manifest.items()
+            ):
+                verified = "yes" if verified else "no"
+                fh.write(f"{relative_path}\t{size}\t{mtime_ns}\t{md5}\t{verified}\n")
+        os.replace(tmp_file, self.manifest_file)
+
+    def hash_files(self, folder, relative_paths):
         """
         Description:
-            Print all files contained within a given directory and its subdirectories.
+            Get the md5 of the given files of a folder in parallel, through the
+            checksum cache.
+
+        Returns:
+            Dict {relative path: md5}, None for the files that could not be read.
+        """
+
+        def hash_file(relative_path):
+            try:
+                return buisciii.utils.get_cached_checksums(
+                    os.path.join(folder, relative_path), ("md5",), self.checksum_cache
+                )["md5"]
+            except OSError as e:
+                log.warning(f"Could not read {relative_path}: {e.strerror}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=self.conf.get("threads", 8)) as executor:
+            return dict(zip(relative_paths, executor.map(hash_file, relative_paths)))
+
+    def deliver(self, permission_options):
+        """
+        Description:
+            Copy the service folder to the SFTP with rsync, resuming from the
+            delivery manifest: only files that are not verified in the SFTP yet, or
+            that changed since, are sent. The copies are then verified against
+            the md5 of the originals, and the manifest updated.
+
+        Params:
+            permission_options [list]: rsync options applying the permissions.
+
+        Returns:
+            List of the files whose SFTP copy does not match.
         """
-        for path, subdirs, files in os.walk(final_path):
-            for name in files:
-                print(os.path.join(path, name))
+        destination = os.path.join(self.sftp_folder, self.service_folder)
+        files = self.get_delivery_files()
+        previous = self.read_manifest()
+        to_hash = [
+            relative_path
+            for relative_path, stat in files.items()
+            if previous.get(relative_path, [None, None])[:2] != list(stat)
+        ]
+        stderr.print(
+            f"[blue]{len(files)} files to deliver, {len(to_hash)} new or changed since the last delivery"
+        )
+        source_md5 = self.hash_files(self.full_path, to_hash)
+
+        manifest = {}
+        unverified = []
+        for relative_path, (size, mtime_ns) in sorted(files.items()):
+            if relative_path in source_md5:
+                md5, verified = source_md5[relative_path], False
+            else:
+                md5, verified = previous[relative_path][2:]
+            try:
+                copy_size = os.stat(os.path.join(destination, relative_path)).st_size
+            except OSError:
+                copy_size = None
+            # Verified copies are only sent again if they changed in the SFTP
+            verified = verified and copy_size == size
+            manifest[relative_path] = [size, mtime_ns, md5, verified]
+            if not verified and copy_size == size:
+                unverified.append(relative_path)
+        # Copies left by an interrupted delivery are checked instead of resent
+        if unverified:
+            stderr.print(f"[blue]Checking {len(unverified)} files already in the SFTP")
+            for relative_path, md5 in self.hash_files(destination, unverified).items():
+                manifest[relative_path][3] = md5 == manifest[relative_path][2]
+        pending = [
+            relative_path
+            for relative_path, (_, _, _, verified) in manifest.items()
+            if not verified
+        ]
+        self.write_manifest(manifest)
+
+        if not pending:
+            stderr.print("[green]Every file is already delivered and verified")
+            return []
+        stderr.print(f"[blue]Sending {len(pending)} files")
+        with open(self.pending_file, "w") as fh:
+            fh.write("\0".join(pending) + "\0")
+        # The manifest already decides what is sent: with --update, a bad copy
+        # newer than its original would never be replaced
+        options = [
+            option for option in self.sftp_options if option not in ("--update", "-u")
+        ]
+        sysrsync.run(
+            source=self.full_path,
+            destination=destination,
+            options=options
+            + permission_options
+            + ["--from0", "--files-from=" + self.pending_file],
+            exclusions=self.exclusions,
+            sync_source_contents=True,
+        )
+
+        stderr.print(f"[blue]Verifying {len(pending)} files in the SFTP")
+        copy_md5 = self.hash_files(destination, pending)
+        failed = []
+        for relative_path in pending:
+            md5 = manifest[relative_path][2]
+            manifest[relative_path][3] = (
+                md5 is not None and copy_md5[relative_path] == md5
+            )
+            if not manifest[relative_path][3]:
+                failed.append(relative_path)
+        self.write_manifest(manifest)
+        return failed
+
+    def show_delivery_summary(self):
+        """
+        Description:
+            Print the number of files and their size in every last folder
+            delivered to the SFTP.
+        """
+        table = rich.table.Table(title=f"Delivered to {self.sftp_folder}")
+        table.add_column("Folder", justify="left")
+        table.add_column("Files", justify="right")
+        table.add_column("Size (GB)", justify="right")
+        for folder in self.last_folders:
+            final_folder = os.path.join(self.sftp_folder, self.service_folder, folder)
+            files = 0
+            size = 0
+            for path, _, file_names in os.walk(final_folder):
+                for name in file_names:
+                    try:
+                        size += os.lstat(os.path.join(path, name)).st_size
+                    except OSError:
+                        continue
+                    files += 1
+            table.add_row(folder, str(files), f"{size / pow(1024, 3):.2f}")
+        stderr.print(table)
 
     def copy_sftp(self):
         """
@@ -152,26 +381,35 @@ class CopySftp:
             Copy the service folder to the configured SFTP destination using rsync.
         """
         if self.service_folder in self.full_path:
-            today_date = datetime.today().strftime("%Y%m%d")
-            log_command = (
-                "--log-file=" + self.full_path + "/DOC/rsync_" + today_date + ".log"
-            )
-            self.sftp_options.append(log_command)
+            self.sftp_options.append("--log-file=" + self.log_file)
             stderr.print(
                 f"[yellow]The service folder will now be copied to the '{self.sftp_folder}' SFTP folder."
             )
             log.info(
                 f"The service folder will be copied to the '{self.sftp_folder}' SFTP folder."
             )
+            # Apply global permissions while copying, if enabled for the SFTP
+            permission_options = []
+            if self.conf.get("apply_permissions", False):
+                permission_options = buisciii.utils.get_rsync_permission_options(
+                    self.permissions
+                )
             try:
                 if self.conf["protocol"] == "rsync":
-                    sysrsync.run(
-                        source=self.full_path,
-                        destination=self.sftp_folder,
-                        options=self.sftp_options,
-                        exclusions=self.conf["exclusions"],
-                        sync_source_contents=False,
-                    )
+                    failed = self.deliver(permission_options)
+                    if self.conf.get("apply_permissions", False) and not (
+                        permission_options
+                    ):
+                        buisciii.utils.remake_permissions(
+                            os.path.join(self.sftp_folder, self.service_folder),
+                            self.permissions,
+                        )
+                    if failed:
+                        for relative_path in failed:
+                            log.error(f"SFTP copy does not match: {relative_path}")
+                        message = f"{len(failed)} files do not match their SFTP copy (see the log). Run copy-sftp again to resend them."
+                        stderr.print(f"[red]ERROR: {message}", highlight=False)
+                        raise ValueError(message)
                     stderr.print(
                         "[green]Data copied to the SFTP folder successfully!",
                         highlight=False,
@@ -194,14 +432,7 @@ class CopySftp:
                 log.warning("Data copied to the SFTP with errors.")
                 raise
             finally:
-                for folders_list in self.last_folders:
-                    final_folder = os.path.join(
-                        self.sftp_folder, self.service_folder, folders_list
-                    )
-                    stderr.print(
-                        "Listing the content of the final folder %s:" % folders_list
-                    )
-                    self.listdirs(final_folder)
+                self.show_delivery_summary()
         else:
             stderr.print(
                 "[red]ERROR: Service number %s not in the source path %s"
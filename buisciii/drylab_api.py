@@ -1,9 +1,15 @@
 #!/usr/bin/env python
 import logging
+import hashlib
 import json
+import os
 import requests
 import sys
+import time
 import rich
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import buisciii.utils
 
 log = logging.getLogger(__name__)
@@ -14,14 +20,113 @@ stderr = rich.console.Console(
     force_terminal=buisciii.utils.rich_force_colors(),
 )
 
+# Requests whose responses are kept in the on-disk cache.
+CACHED_REQUESTS = ["service-data"]
+
+
+class ApiConnectionError(Exception):
+    """
+    iSkyLIMS could not be reached. Raised in the threads of a batch request, so
+    that the program exits from the main thread.
+    """
+
+
+def get_api_cache_dir():
+    """
+    Description:
+        Return the folder where iSkyLIMS responses are cached, creating it
+        (readable only by the user) if needed.
+    """
+    cache_dir = os.path.join(buisciii.utils.get_cache_dir(), "iskylims")
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    return cache_dir
+
+
+def get_cache_file(url_http):
+    url_hash = hashlib.sha1(url_http.encode()).hexdigest()
+    return os.path.join(get_api_cache_dir(), url_hash + ".json")
+
+
+def read_cache(url_http, ttl):
+    """
+    Description:
+        Return the cached response for url_http, or None if it is not cached
+        or older than ttl seconds.
+    """
+    cache_file = get_cache_file(url_http)
+    try:
+        if time.time() - os.path.getmtime(cache_file) > ttl:
+            return None
+        with open(cache_file, "r") as fh:
+            cached = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    if cached.get("url") != url_http:
+        return None
+    return cached.get("data")
+
+
+def write_cache(url_http, data):
+    cache_file = get_cache_file(url_http)
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_file, "w") as fh:
+            json.dump({"url": url_http, "data": data}, fh)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        log.warning(f"Could not write iSkyLIMS cache file {cache_file}: {e}")
+
+
+def clear_cache():
+    """
+    Description:
+        Remove all the cached iSkyLIMS responses.
+    """
+    cache_dir = get_api_cache_dir()
+    for cache_file in os.listdir(cache_dir):
+        try:
+            os.remove(os.path.join(cache_dir, cache_file))
+        except OSError as e:
+            log.warning(f"Could not remove iSkyLIMS cache file {cache_file}: {e}")
+    log.info("iSkyLIMS cache cleared")
+
 
 class RestServiceApi:
-    def __init__(self, server, url, user, password):
+    def __init__(
+        self,
+        server,
+        url,
+        user,
+        password,
+        timeout=60,
+        retries=3,
+        max_workers=8,
+        cache_ttl=0,
+    ):
         self.request_url = server + url
         self.headers = {
             "accept": "application/json",
             "Content-Type": "application/json",
         }
+        # One pooled session (keep-alive) for all the requests to iSkyLIMS.
+        # GET requests are retried with backoff on connection or server errors.
+        self.timeout = timeout
+        self.max_workers = max_workers
+        # Responses of CACHED_REQUESTS are reused for cache_ttl seconds (0 disables)
+        self.cache_ttl = cache_ttl
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.5,
+            status_forcelist=[500, 502, 503, 504],
+            allowed_methods=["GET"],
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            max_retries=retry, pool_connections=max_workers, pool_maxsize=max_workers
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
         if not user:
             stderr.print("[red]Missing user for api request")
             buisciii.utils.ask_for_some_text("API user: ")
@@ -35,27 +140,82 @@ class RestServiceApi:
     # by Guille: I used an f-string instead of all the + stuff, I think thats cleaner?
     # by Guille: **kwargs time!
     def get_request(self, request_info, safe=True, **kwargs):
-        url_http = f"{self.request_url}{request_info}?{''.join([f'{key}={value}&' for key,value in kwargs.items()])[:-1]}"
         try:
-            req = requests.get(url_http, headers=self.headers)
-            if req.status_code > 201:
-                if safe:
-                    resolution = kwargs.get("resolution", "unknown")
-                    log.info(
-                        f"Resolution {resolution} does not exist. Status code: {req.status_code}"
-                    )
-                    stderr.print(
-                        f"Resolution {resolution} does not exist! Please make sure the resolution ID is correct and has been created"
-                    )
-                    sys.exit(1)
-                else:
-                    return req.status_code
-            return json.loads(req.text)
-        except requests.ConnectionError:
+            return self.get_request_or_raise(request_info, safe=safe, **kwargs)
+        except ApiConnectionError:
             log.error("Unable to open connection towards iSkyLIMS, aborting")
             sys.exit(1)
             return False
 
+    def get_request_or_raise(self, request_info, safe=True, **kwargs):
+        """
+        Description:
+            get_request, raising ApiConnectionError if iSkyLIMS cannot be reached.
+        """
+        url_http = f"{self.request_url}{request_info}?{''.join([f'{key}={value}&' for key,value in kwargs.items()])[:-1]}"
+        use_cache = self.cache_ttl and request_info in CACHED_REQUESTS
+        if use_cache:
+            data = read_cache(url_http, self.cache_ttl)
+            if data is not None:
+                log.debug(f"Using cached iSkyLIMS response for {url_http}")
+                return data
+        try:
+            req = self.session.get(url_http, headers=self.headers, timeout=self.timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise ApiConnectionError(url_http) from e
+        if req.status_code > 201:
+            if safe:
+                resolution = kwargs.get("resolution", "unknown")
+                log.info(
+                    f"Resolution {resolution} does not exist. Status code: {req.status_code}"
+                )
+                stderr.print(
+                    f"Resolution {resolution} does not exist! Please make sure the resolution ID is correct and has been created"
+                )
+                sys.exit(1)
+            else:
+                return req.status_code
+        data = json.loads(req.text)
+        if use_cache:
+            write_cache(url_http, data)
+        return data
+
+    def get_request_batch(self, request_info, parameter, values, **kwargs):
+        """
+        Description:
+            Run the same get request for several values of one parameter
+            concurrently, e.g. "service-data" for a list of services. If
+            iSkyLIMS cannot be reached, the pending requests are cancelled and
+            the program exits, as get_request does.
+
+        Usage:
+            rest_api.get_request_batch("service-data", "service", ["SRVCNM1", "SRVCNM2"])
+
+        Returns:
+            Dictionary {value: response}. The response is the json data, or the status
+            code if the request failed (as get_request with safe=False).
+        """
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        futures = {
+            executor.submit(
+                self.get_request_or_raise,
+                request_info,
+                safe=False,
+                **{parameter: value},
+                **kwargs,
+            ): value
+            for value in values
+        }
+        done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+        failed = [future for future in done if future.exception() is not None]
+        executor.shutdown(wait=True, cancel_futures=bool(failed))
+        if failed:
+            if not isinstance(failed[0].exception(), ApiConnectionError):
+                raise failed[0].exception()
+            log.error("Unable to open connection towards iSkyLIMS, aborting")
+            sys.exit(1)
+        return {value: future.result() for future, value in futures.items()}
+
     def put_request(
         self, request_info, parameter1, value1, parameter2, value2, safe=True
     ):
@@ -71,8 +231,12 @@ class RestServiceApi:
             + "="
             + value2
         )
+        if self.cache_ttl:
+            clear_cache()
         try:
-            req = requests.put(url_http, headers=self.headers, auth=self.auth)
+            req = self.session.put(
+                url_http, headers=self.headers, auth=self.auth, timeout=self.timeout
+            )
             if req.status_code > 201:
                 if safe:
                     log.error(
@@ -84,16 +248,22 @@ class RestServiceApi:
                     return req.status_code
             # return json.loads(req.text)
             return True
-        except requests.ConnectionError:
+        except (requests.ConnectionError, requests.Timeout):
             log.error("Unable to open connection towards iSkyLIMS")
             sys.exit(1)
             return False
 
     def post_request(self, request_info, data, safe=True):
         url_http = self.request_url + request_info
+        if self.cache_ttl:
+            clear_cache()
         try:
-            req = requests.post(
-                url_http, data=data, headers=self.headers, auth=self.auth
+            req = self.session.post(
+                url_http,
+                data=data,
+                headers=self.headers,
+                auth=self.auth,
+                timeout=self.timeout,
             )
             if req.status_code > 201:
                 if safe:
@@ -106,7 +276,7 @@ class RestServiceApi:
                     return req.status_code
             return True
 
-        except requests.ConnectionError:
+        except (requests.ConnectionError, requests.Timeout):
             log.error("Unable to open connection towards iSkyLIMS, aborting")
             sys.exit(1)
             return False
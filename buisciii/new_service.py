@@ -2,15 +2,13 @@
 
 # Generic imports
 import sys
-import re
 import os
 import logging
-import glob
 import json
 import shutil
 import rich
-import subprocess
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 # Local imports
 import buisciii
@@ -56,7 +54,11 @@ class NewService:
         conf_api = conf.get_configuration("xtutatis_api_settings")
         # Obtain info from iSkyLIMS API
         self.rest_api = buisciii.drylab_api.RestServiceApi(
-            conf_api["server"], conf_api["api_url"], api_user, api_password
+            conf_api["server"],
+            conf_api["api_url"],
+            api_user,
+            api_password,
+            cache_ttl=conf_api.get("cache_ttl", 0),
         )
         self.resolution_info = self.rest_api.get_request(
             request_info="service-data", safe=True, resolution=self.resolution_id
@@ -99,12 +101,50 @@ class NewService:
             )
         self.full_path = os.path.join(self.path, self.service_folder)
         self.setup_logging_cb = setup_logging_cb
+        # Checksums of unchanged FASTQ files are not computed again
+        self.checksum_cache = buisciii.utils.get_checksum_cache(conf)
+
+    def get_sample_files(self, file_names, samples, extension=""):
+        """
+        Description:
+            Group the files that belong to the given samples, named
+            <sample_name>_*<extension>, as glob would match them. Each file is
+            matched with set lookups of its prefixes, so the cost does not grow
+            with the number of samples.
+
+        Usage:
+            fastqs = object.get_sample_files(file_names, samples, ".fastq.gz")
+
+        Params:
+            file_names [list]: file names, e.g. as listed in the md5 file.
+            samples [list]: samples (dict) from iSkyLIMS.
+            extension [str]: only files ending with it are selected.
+
+        Returns:
+            Dictionary {sample_name: [file_names]}
+        """
+        sample_names = {sample["sample_name"] for sample in samples}
+        sample_files = defaultdict(list)
+        for file_name in file_names:
+            base_name = os.path.basename(file_name)
+            if not base_name.endswith(extension):
+                continue
+            # A file can match several samples if a sample name is a prefix of another
+            prefix_end = base_name.find("_")
+            while prefix_end != -1:
+                if base_name[:prefix_end] in sample_names:
+                    sample_files[base_name[:prefix_end]].append(file_name)
+                prefix_end = base_name.find("_", prefix_end + 1)
+        return sample_files
 
     def check_md5(self):
         """
         Description:
             Verify MD5 checksums of FASTQ files for all service samples grouped by sequencing project.
+            The md5 file of each project is read once, and the FASTQ files of the service samples
+            are hashed in parallel. Every mismatch or missing file is reported.
         """
+        threads = self.conf.get("md5_threads", 8)
         samples_by_project = defaultdict(list)
         for sample in self.service_samples:
             samples_by_project[sample["project_name"]].append(sample)
@@ -117,32 +157,57 @@ class NewService:
                 message = f"ERROR: .md5 file not found at {md5_file_path}"
                 stderr.print(f"[red]{message}")
                 log.error(message)
-
-            sample_names_pattern = "|".join(
-                [re.escape(s["sample_name"]) + ".*\\.fastq\\.gz" for s in samples]
-            )
+                raise FileNotFoundError(f".md5 file not found at {md5_file_path}")
 
             log.info(f"Checking MD5 integrity for {md5_file_path}...")
             stderr.print(f"Checking MD5 integrity for {md5_file_path}...")
 
-            try:
-                cmd = f"grep -E '{sample_names_pattern}' {md5_file_path} | md5sum -c -"
-                subprocess.run(
-                    cmd,
-                    shell=True,
-                    check=True,
-                    cwd=os.path.dirname(md5_file_path),
-                    executable="/bin/bash",
+            expected_md5 = buisciii.utils.read_md5sum_file(md5_file_path)
+            sample_fastqs = self.get_sample_files(
+                expected_md5.keys(), samples, ".fastq.gz"
+            )
+            for sample in samples:
+                if sample["sample_name"] not in sample_fastqs:
+                    message = f"WARNING: No FASTQ files found in {md5_file_path} for sample {sample['sample_name']}"
+                    stderr.print(f"[yellow]{message}")
+                    log.warning(message)
+            fastq_files = list(
+                dict.fromkeys(
+                    file_name for files in sample_fastqs.values() for file_name in files
                 )
-                message = "MD5 check passed!"
-                stderr.print(f"[green]{message}")
-                log.info(message)
+            )
 
-            except subprocess.CalledProcessError:
-                message = f"ERROR: MD5 check failed for project {project_name}"
+            def check_file(file_name):
+                file_path = os.path.join(os.path.dirname(md5_file_path), file_name)
+                try:
+                    md5 = buisciii.utils.get_cached_checksums(
+                        file_path, ("md5",), self.checksum_cache
+                    )["md5"]
+                except OSError as e:
+                    return file_name, f"could not be read ({e.strerror})"
+                if md5 != expected_md5[file_name]:
+                    return file_name, f"expected {expected_md5[file_name]}, got {md5}"
+                return file_name, None
+
+            failed = 0
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                for file_name, error in executor.map(check_file, fastq_files):
+                    if error is not None:
+                        failed += 1
+                        message = f"MD5 check FAILED for {file_name}: {error}"
+                        stderr.print(f"[red]{message}")
+                        log.error(message)
+
+            if failed:
+                message = f"ERROR: MD5 check failed for {failed} of {len(fastq_files)} files in project {project_name}"
                 stderr.print(f"[red]{message}")
                 log.error(message)
-                raise
+                raise ValueError(
+                    f"MD5 check failed for {failed} files in project {project_name}"
+                )
+            message = f"MD5 check passed! ({len(fastq_files)} files)"
+            stderr.print(f"[green]{message}")
+            log.info(message)
 
     def create_folder(self):
         """
@@ -183,10 +248,52 @@ class NewService:
             log.info("Assuming folder already exists! Moving forward!")
             return False
 
+    def get_template_plan(self, templates, ignore=("README", "__pycache__")):
+        """
+        Description:
+            Merge the requested templates into a single copy plan. When several
+            templates contain the same path, the last one wins, as when they were
+            copied one over the other.
+
+        Usage:
+            plan = object.get_template_plan(["viralrecon", "mtbseq"])
+
+        Params:
+            templates [list]: template folder names in buisciii/templates.
+            ignore [tuple]: names that are not copied.
+
+        Returns:
+            Dictionary {relative path: (template source path, is_dir)}
+        """
+        plan = {}
+        for template in dict.fromkeys(templates):
+            template_path = os.path.join(
+                os.path.dirname(__file__), "templates", template
+            )
+            if not os.path.isdir(template_path):
+                raise FileNotFoundError(f"Template {template_path} not found")
+            for root, dirs, files in os.walk(template_path):
+                dirs[:] = [name for name in dirs if name not in ignore]
+                rel_root = os.path.relpath(root, template_path)
+                for name in dirs:
+                    plan[os.path.normpath(os.path.join(rel_root, name))] = (
+                        os.path.join(root, name),
+                        True,
+                    )
+                for name in files:
+                    if name not in ignore:
+                        plan[os.path.normpath(os.path.join(rel_root, name))] = (
+                            os.path.join(root, name),
+                            False,
+                        )
+        return plan
+
     def copy_template(self):
         """
         Description:
             Copy the service template directories into the service folder.
+            The templates of all the requested services are merged first, so
+            each file is written only once.
         """
         log.info(
             f"The template service folders for '{self.full_path}' will now be copied into the service directory"
@@ -196,34 +303,43 @@ class NewService:
         )
         services_ids = buisciii.utils.get_service_ids(self.services_requested)
         services_json = buisciii.service_json.ServiceJson()
+        service_templates = []
         for service_id in services_ids:
             try:
-                service_template = services_json.get_find(service_id, "template")
+                service_templates.append(services_json.get_find(service_id, "template"))
             except KeyError:
                 message = f"ERROR: Service ID {service_id} not found in the services.json file!"
                 stderr.print(f"[red]{message}")
                 log.error(message)
                 raise
-            try:
-                shutil.copytree(
-                    os.path.join(
-                        os.path.dirname(__file__), "templates", service_template
-                    ),
-                    self.full_path,
-                    dirs_exist_ok=True,
-                    ignore=shutil.ignore_patterns("README", "__pycache__"),
-                )
-                log.info(
-                    f"Successfully copied the template {service_template} to the directory '{self.full_path}'!"
-                )
-                stderr.print(
-                    f"[green]Successfully copied the template '{service_template}' to the directory '{self.full_path}'!"
-                )
-            except OSError:
-                message = "ERROR: Copying template failed!"
-                stderr.print(f"[red]{message}")
-                log.error(message)
-                raise
+        try:
+            plan = self.get_template_plan(service_templates)
+            os.makedirs(self.full_path, exist_ok=True)
+            # Sorted paths create each folder before its content
+            for rel_path in sorted(plan):
+                src, is_dir = plan[rel_path]
+                dst = os.path.join(self.full_path, rel_path)
+                if is_dir:
+                    os.makedirs(dst, exist_ok=True)
+                else:
+                    buisciii.utils.clone_file(src, dst)
+            # Folder permissions and times, once their content is written
+            for rel_path in sorted(plan, reverse=True):
+                src, is_dir = plan[rel_path]
+                if is_dir:
+                    shutil.copystat(src, os.path.join(self.full_path, rel_path))
+        except OSError:
+            message = "ERROR: Copying template failed!"
+            stderr.print(f"[red]{message}")
+            log.error(message)
+            raise
+        for service_template in dict.fromkeys(service_templates):
+            log.info(
+                f"Successfully copied the template {service_template} to the directory '{self.full_path}'!"
+            )
+            stderr.print(
+                f"[green]Successfully copied the template '{service_template}' to the directory '{self.full_path}'!"
+            )
         return True
 
     def create_samples_id(self):
@@ -247,13 +363,36 @@ class NewService:
         """
         Description:
             Create symbolic links to FASTQ files for all samples in the RAW directory.
+            Each project folder in fastq_repo is listed only once.
         """
+        # List each project folder once and group its files by sample
+        samples_by_project = defaultdict(list)
+        for sample in self.service_samples:
+            samples_by_project[sample["project_name"]].append(sample)
+        project_files = {}
+        for project_name, samples in samples_by_project.items():
+            project_path = os.path.join(self.conf["fastq_repo"], project_name)
+            try:
+                file_names = sorted(
+                    name
+                    for name in os.listdir(project_path)
+                    if not name.startswith(".")
+                )
+            except FileNotFoundError:
+                file_names = []
+            project_files[project_name] = self.get_sample_files(file_names, samples)
+
         samples_files = []
         for sample in self.service_samples:
             regex = os.path.join(
                 self.conf["fastq_repo"], sample["project_name"], "{}_*"
             ).format(sample["sample_name"])
-            sample_file = glob.glob(regex)
+            sample_file = [
+                os.path.join(self.conf["fastq_repo"], sample["project_name"], file)
+                for file in project_files[sample["project_name"]].get(
+                    sample["sample_name"], []
+                )
+            ]
 
             if sample_file:
                 samples_files.append(sample_file)
@@ -282,18 +421,22 @@ class NewService:
                 stderr.print(message)
                 sys.exit()
 
-        for sample in samples_files:
-            for file in sample:
-                try:
-                    os.symlink(
-                        file,
-                        os.path.join(self.full_path, "RAW", os.path.basename(file)),
-                    )
-                except OSError:
-                    message = f"ERROR: Symbolic links creation failed for file {file}"
-                    stderr.print(f"[red]{message}")
-                    log.error(message)
-                    raise
+        # Create all the links in one pass, once per file
+        raw_path = os.path.join(self.full_path, "RAW")
+        links = {
+            os.path.join(raw_path, os.path.basename(file)): file
+            for sample in samples_files
+            for file in sample
+        }
+        for link, file in links.items():
+            try:
+                os.symlink(file, link)
+            except OSError:
+                message = f"ERROR: Symbolic links creation failed for file {file}"
+                stderr.print(f"[red]{message}")
+                log.error(message)
+                raise
+        log.info(f"Created {len(links)} symbolic links in {raw_path}")
 
     def samples_json(self):
         """
@@ -2,19 +2,25 @@
 
 # Generic imports
 import os
+import fnmatch
+import heapq
 import logging
 import re
+import shlex
 import subprocess
+import sys
 import sysrsync
+from collections import defaultdict
+from datetime import datetime
 
 import rich
+import rich.table
 import shutil
 
 # Local imports
 import buisciii
 import buisciii.utils
-import buisciii.drylab_api
-import buisciii.config_json
+import buisciii.service_context
 
 log = logging.getLogger(__name__)
 
@@ -26,6 +32,56 @@ stderr = rich.console.Console(
 )
 
 
+def scan_scratch_copy(scratch_path, exclusions):
+    """
+    Description:
+        Walk the scratch copy of a service, without descending into the folders
+        excluded from the copy (e.g. work).
+
+    Returns:
+        Dict {relative path: (size, mtime_ns, is_dir)}
+    """
+    exclusions = [pattern.strip("'\"") for pattern in exclusions]
+    snapshot = {}
+    pending = [""]
+    while pending:
+        relative_dir = pending.pop()
+        with os.scandir(os.path.join(scratch_path, relative_dir)) as it:
+            for entry in it:
+                if any(fnmatch.fnmatch(entry.name, ex) for ex in exclusions):
+                    continue
+                relative_path = os.path.join(relative_dir, entry.name)
+                stat = entry.stat(follow_symlinks=False)
+                is_dir = entry.is_dir(follow_symlinks=False)
+                snapshot[relative_path] = (stat.st_size, stat.st_mtime_ns, is_dir)
+                if is_dir:
+                    pending.append(relative_path)
+    return snapshot
+
+
+def write_manifest(scratch_path, manifest_file, exclusions):
+    """
+    Description:
+        Save the snapshot (path, size, mtime) of the scratch copy of a service.
+        Also run at the end of the copy jobs submitted with sbatch, so that the
+        snapshot is taken before the analysis starts changing the copy.
+
+    Usage:
+        python -c "import sys, buisciii.scratch; buisciii.scratch.write_manifest(
+            sys.argv[1], sys.argv[2], sys.argv[3:])" scratch_path manifest_file ...
+    """
+    snapshot = scan_scratch_copy(scratch_path, exclusions)
+    with open(manifest_file + ".tmp", "w") as fh:
+        fh.write("# path\tsize\tmtime_ns\n")
+        for relative_path, (size, mtime_ns, _) in sorted(snapshot.items()):
+            # These could not be read back, so they will be copied back as new
+            if "\t" in relative_path or "\n" in relative_path:
+                continue
+            fh.write(f"{relative_path}\t{size}\t{mtime_ns}\n")
+    os.replace(manifest_file + ".tmp", manifest_file)
+    log.info(f"Scratch manifest with {len(snapshot)} entries saved")
+
+
 class Scratch:
     def __init__(
         self,
@@ -37,8 +93,13 @@ class Scratch:
         api_user=None,
         api_password=None,
         conf=None,
+        context=None,
+        jobs=None,
+        wait=None,
     ):
-        if resolution_id is None:
+        if context is not None:
+            self.resolution_id = context.resolution_id
+        elif resolution_id is None:
             self.resolution_id = buisciii.utils.prompt_resolution_id()
         else:
             self.resolution_id = resolution_id
@@ -55,20 +116,22 @@ class Scratch:
             )
         else:
             self.direction = direction
+        # Obtain info from iSkyLIMS API, unless already given
+        if context is None:
+            context = buisciii.service_context.ServiceContext(
+                self.resolution_id, api_user, api_password, conf
+            )
         # Load conf
-        conf_api = conf.get_configuration("xtutatis_api_settings")
-        # Obtain info from iSkyLIMS API
-        rest_api = buisciii.drylab_api.RestServiceApi(
-            conf_api["server"], conf_api["api_url"], api_user, api_password
-        )
         self.conf = conf.get_configuration("scratch_copy")
+        self.permissions = conf.get_configuration("global").get("permissions")
+        # Number of rsync processes copying the service to scratch
+        self.jobs = max(1, int(jobs or self.conf.get("jobs", 1)))
+        self.scout_conf = conf.get_configuration("archive").get("scout", {})
+        # Wait for the copy (srun) or submit it as a Slurm job (sbatch)
+        self.wait = self.conf.get("wait", True) if wait is None else wait
 
-        self.resolution_info = rest_api.get_request(
-            request_info="service-data", safe=True, resolution=self.resolution_id
-        )
-        self.service_folder = self.resolution_info["resolutions"][0][
-            "resolution_full_number"
-        ]
+        self.resolution_info = context.resolution_info
+        self.service_folder = context.service_folder
         if self.tmp_dir.startswith("/scratch/bi"):
             tmp_dir = self.tmp_dir.replace(
                 "/scratch/bi", "/data/ucct/bi/scratch_tmp/bi", 1
@@ -99,15 +162,15 @@ class Scratch:
                 "Either give a path or make the terminal ask you for a path, not both."
             )
         else:
-            self.path = buisciii.utils.get_service_paths(
-                conf,
-                "services_and_colaborations",
-                self.resolution_info,
-                "non_archived_path",
-            )
+            self.path = context.data_path
             self.full_path = os.path.join(self.path, self.service_folder)
 
         self.out_file = os.path.join(self.full_path, "DOC", "service_info.txt")
+        # Snapshot of the scratch copy, used to copy back only what changed
+        self.manifest_file = os.path.join(self.full_path, "DOC", "scratch_manifest.tsv")
+        self.return_list_file = os.path.join(
+            self.full_path, "DOC", "scratch_return_files.txt"
+        )
 
     def srun_command(self, srun_settings, command):
         """
@@ -119,6 +182,353 @@ class Scratch:
         exit_code = subprocess.call(srun_command)
         return exit_code
 
+    def sbatch_command(self, srun_settings, command, ntasks=1, then=None):
+        """
+        Description:
+            Submit the command as a Slurm job with 'sbatch', without waiting for
+            it. The job id and its log (in DOC) are recorded in service_info.txt,
+            to be followed with 'buisciii scratch --status'.
+
+        Params:
+            then [list]: command run by the job after the command, if it succeeded.
+
+        Returns:
+            Job id.
+        """
+        log_file = os.path.join(
+            self.full_path, "DOC", f"scratch_{self.direction}_%j.log"
+        )
+        wrap = shlex.join(command)
+        if then is not None:
+            wrap += " && " + shlex.join(then)
+        sbatch_command = [
+            "sbatch",
+            "--parsable",
+            "--job-name",
+            f"{self.direction}_{self.service_folder}",
+            "--output",
+            log_file,
+            "--ntasks",
+            str(ntasks),
+            *srun_settings,
+            "--wrap",
+            wrap,
+        ]
+        log.info(f"Submitting: {shlex.join(sbatch_command)}")
+        process = subprocess.run(
+            sbatch_command, capture_output=True, text=True, check=True
+        )
+        # --parsable prints "jobid" or "jobid;cluster"
+        job_id = process.stdout.strip().split(";")[0]
+        with open(self.out_file, "a") as f:
+            f.write(
+                f"Slurm job {self.direction}: {job_id} {log_file.replace('%j', job_id)}\n"
+            )
+        log.info(f"Submitted job {job_id} ({self.direction})")
+        stderr.print(
+            f"[green]Submitted job {job_id}. Follow it with 'buisciii scratch --status {self.resolution_id}'"
+        )
+        return job_id
+
+    def transfer(self, rsync_command):
+        """
+        Description:
+            Run an rsync command with srun, or submit it with sbatch when not
+            waiting for it (reporting its progress in the job log).
+
+        Returns:
+            Exit code of srun, None if the job was submitted.
+        """
+        if self.wait:
+            return self.srun_command(self.srun_settings, rsync_command)
+        self.sbatch_command(self.srun_settings, rsync_command + ["--info=progress2"])
+        return None
+
+    def write_service_info(self):
+        """
+        Description:
+            Write DOC/service_info.txt with the scratch and service folders.
+        """
+        with open(self.out_file, "w") as f:
+            f.write("Temporal directory: " + self.scratch_tmp_path + "\n")
+            f.write("Origin service directory: " + self.full_path + "\n")
+
+    def get_copy_shards(self):
+        """
+        Description:
+            Split the top-level files and folders of the service into self.jobs
+            groups of similar size: each one, largest first, goes to the group
+            with less data. Folder sizes are scouted as in archive, sharing its
+            size cache.
+
+        Returns:
+            List of (size, [paths]) with the non-empty groups.
+        """
+        cache_file = os.path.join(
+            buisciii.utils.get_cache_dir(), "archive_dir_sizes.json"
+        )
+        size_cache = (
+            buisciii.utils.load_size_cache(cache_file)
+            if self.scout_conf.get("cache", True)
+            else None
+        )
+        entries = []
+        with os.scandir(self.full_path) as service_entries:
+            for entry in service_entries:
+                if entry.is_dir(follow_symlinks=False):
+                    size = buisciii.utils.get_dir_size(
+                        entry.path,
+                        threads=self.scout_conf.get("threads", 16),
+                        cache=size_cache,
+                    )
+                else:
+                    size = entry.stat(follow_symlinks=False).st_size
+                entries.append((size, entry.path))
+        if size_cache is not None:
+            buisciii.utils.save_size_cache(cache_file, size_cache)
+
+        shards = [(0, shard, []) for shard in range(self.jobs)]
+        for size, path in sorted(entries, reverse=True):
+            shard_size, shard, paths = heapq.heappop(shards)
+            paths.append(path)
+            heapq.heappush(shards, (shard_size + size, shard, paths))
+        return [(size, sorted(paths)) for size, _, paths in sorted(shards) if paths]
+
+    def get_sharded_command(self, destination, shards, extra_options=()):
+        """
+        Description:
+            Build the command run by every task of a sharded copy: each task
+            (SLURM_PROCID) runs the rsync of its group and prints its exit code.
+            The target folder is created beforehand, so that the tasks don't race
+            for it.
+
+        Params:
+            destination [str]: folder (as seen from the nodes) where the service
+                folder is created.
+            shards [list]: groups returned by get_copy_shards.
+            extra_options [list]: rsync options added to the configured ones.
+
+        Returns:
+            Command list, to be run by srun with one task per group.
+        """
+        target = os.path.join(destination, self.service_folder, "")
+        os.makedirs(self.scratch_tmp_path, exist_ok=True)
+        shutil.copymode(self.full_path, self.scratch_tmp_path)
+
+        cases = []
+        for task, (_, paths) in enumerate(shards):
+            rsync_command = [
+                "rsync",
+                *self.conf["options"],
+                *extra_options,
+                *paths,
+                target,
+            ]
+            for exclusion in self.conf["exclusions"]:
+                rsync_command += ["--exclude", exclusion]
+            cases.append(f"{task}) {shlex.join(rsync_command)} ;;")
+        script = (
+            'case "$SLURM_PROCID" in '
+            + " ".join(cases)
+            + ' esac; code=$?; echo "rsync exit code: $code"; exit $code'
+        )
+        return ["sh", "-c", script]
+
+    def sharded_rsync(self, destination):
+        """
+        Description:
+            Copy the service folder with several rsync processes, each one copying
+            a group of top-level folders (see get_copy_shards), as tasks of a single
+            srun step. The output of every task is merged into one log in DOC
+            and the exit code is the highest one of the tasks.
+
+        Params:
+            destination [str]: folder (as seen from the nodes) where the service
+                folder is created.
+
+        Returns:
+            Exit code, 0 if every rsync succeeded.
+        """
+        shards = self.get_copy_shards()
+        srun_command = [
+            "srun",
+            *self.srun_settings,
+            "--ntasks",
+            str(len(shards)),
+            "--label",
+            *self.get_sharded_command(destination, shards),
+        ]
+        stderr.print(
+            f"[blue]Copying with {len(shards)} rsync processes in a single srun step"
+        )
+        log.info(f"Sharded copy command: {shlex.join(srun_command)}")
+        process = subprocess.Popen(
+            srun_command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+        )
+        # srun --label prefixes every line with the task number
+        task_logs = defaultdict(list)
+        task_codes = {}
+        for line in process.stdout:
+            task, _, text = line.partition(": ")
+            task = task.strip()
+            if not task.isdigit():
+                task_logs["srun"].append(line)
+                continue
+            task_logs[int(task)].append(text)
+            if text.startswith("rsync exit code: "):
+                task_codes[int(task)] = int(text.split(": ")[1])
+        srun_code = process.wait()
+
+        log_file = os.path.join(
+            self.full_path,
+            "DOC",
+            "rsync_scratch_" + datetime.today().strftime("%Y%m%d") + ".log",
+        )
+        table = rich.table.Table(title="Sharded copy to scratch")
+        table.add_column("Shard", justify="center")
+        table.add_column("Top-level items", justify="center")
+        table.add_column("Size (GB)", justify="center")
+        table.add_column("Exit code", justify="center")
+        with open(log_file, "w") as fh:
+            for task, (size, paths) in enumerate(shards):
+                code = task_codes.get(task, srun_code or 1)
+                task_codes[task] = code
+                table.add_row(
+                    str(task), str(len(paths)), f"{size / pow(1024, 3):.3f}", str(code)
+                )
+                fh.write(f"### Shard {task}: exit code {code}\n")
+                fh.write("".join(f"# {path}\n" for path in paths))
+                fh.writelines(task_logs[task])
+            if task_logs["srun"]:
+                fh.write("### srun\n")
+                fh.writelines(task_logs["srun"])
+        stderr.print(table)
+        log.info(f"Sharded copy log saved to {log_file}")
+        return max(task_codes.values(), default=srun_code)
+
+    def scan_scratch_copy(self):
+        """
+        Description:
+            Walk the scratch copy of the service (see scan_scratch_copy).
+        """
+        return scan_scratch_copy(self.scratch_tmp_path, self.conf["exclusions"])
+
+    def write_manifest(self):
+        """
+        Description:
+            Save the snapshot of the scratch copy just made in
+            DOC/scratch_manifest.tsv.
+        """
+        write_manifest(
+            self.scratch_tmp_path, self.manifest_file, self.conf["exclusions"]
+        )
+
+    def get_manifest_command(self):
+        """
+        Description:
+            Command writing the manifest from the node running a copy job, where
+            the copy is in tmp_dir.
+        """
+        return [
+            sys.executable,
+            "-c",
+            "import sys, buisciii.scratch; "
+            "buisciii.scratch.write_manifest(sys.argv[1], sys.argv[2], sys.argv[3:])",
+            os.path.join(self.tmp_dir, self.service_folder),
+            self.manifest_file,
+            *self.conf["exclusions"],
+        ]
+
+    def remove_manifest(self):
+        """
+        Description:
+            Remove the manifest of a previous copy, so that it is not used to
+            copy back a copy that failed or is still running.
+        """
+        if os.path.isfile(self.manifest_file):
+            os.remove(self.manifest_file)
+            log.info(f"Removed the manifest of the previous copy {self.manifest_file}")
+
+    def read_manifest(self):
+        """
+        Description:
+            Read DOC/scratch_manifest.tsv.
+
+        Returns:
+            Dict {relative path: (size, mtime_ns)}, or None if there is no manifest.
+        """
+        if not os.path.isfile(self.manifest_file):
+            return None
+        manifest = {}
+        with open(self.manifest_file) as fh:
+            for line in fh:
+                if line.startswith("#"):
+                    continue
+                relative_path, size, mtime_ns = line.rstrip("\n").split("\t")
+                manifest[relative_path] = (int(size), int(mtime_ns))
+        return manifest
+
+    def get_changed_files(self, manifest):
+        """
+        Description:
+            Compare the scratch copy with the manifest written when it was made.
+            New folders are listed alone, as rsync copies them recursively.
+
+        Returns:
+            Sorted list of the relative paths new or changed since the copy, and
+            their size in bytes.
+        """
+        snapshot = self.scan_scratch_copy()
+        new_dirs = set()
+        changed = []
+        size = 0
+        for relative_path in sorted(snapshot):
+            entry_size, mtime_ns, is_dir = snapshot[relative_path]
+            # Contents of new folders are copied along with them
+            if os.path.dirname(relative_path) in new_dirs:
+                if is_dir:
+                    new_dirs.add(relative_path)
+                else:
+                    size += entry_size
+                continue
+            if relative_path in manifest:
+                if is_dir or manifest[relative_path] == (entry_size, mtime_ns):
+                    continue
+            elif is_dir:
+                new_dirs.add(relative_path)
+            if not is_dir:
+                size += entry_size
+            changed.append(relative_path)
+        return changed, size
+
+    def submit_copy_scratch(self):
+        """
+        Description:
+            Submit the copy to scratch as a Slurm job. The job writes the manifest
+            of the copy as soon as the copy succeeds.
+        """
+        progress = ["--info=progress2"]
+        if self.jobs > 1:
+            shards = self.get_copy_shards()
+            task_command = self.get_sharded_command(self.tmp_dir, shards, progress)
+            command = ["srun", "--ntasks", str(len(shards)), "--label", *task_command]
+        else:
+            shards = [None]
+            command = sysrsync.get_rsync_command(
+                source=self.full_path,
+                destination=self.tmp_dir,
+                options=self.conf["options"] + progress,
+                exclusions=self.conf["exclusions"],
+                sync_source_contents=False,
+            )
+        self.write_service_info()
+        self.sbatch_command(
+            self.srun_settings,
+            command,
+            ntasks=len(shards),
+            then=self.get_manifest_command(),
+        )
+
     def copy_scratch(self):
         """
         Description:
@@ -133,7 +543,13 @@ class Scratch:
         if self.service_folder in self.full_path:
             protocol = self.conf["protocol"]
             try:
-                if protocol == "rsync":
+                self.remove_manifest()
+                if protocol == "rsync" and not self.wait:
+                    self.submit_copy_scratch()
+                    return True
+                if protocol == "rsync" and self.jobs > 1:
+                    exit_code = self.sharded_rsync(self.tmp_dir)
+                elif protocol == "rsync":
                     rsync_command = sysrsync.get_rsync_command(
                         source=self.full_path,
                         destination=self.tmp_dir,
@@ -149,10 +565,8 @@ class Scratch:
                         "This protocol is not allowed at the moment!"
                     )
                 if exit_code == 0:
-                    f = open(self.out_file, "w")
-                    f.write("Temporal directory: " + self.scratch_tmp_path + "\n")
-                    f.write("Origin service directory: " + self.full_path + "\n")
-                    f.close()
+                    self.write_service_info()
+                    self.write_manifest()
                     log.info(
                         f"Successfully copied the directory to '{self.scratch_tmp_path}'"
                     )
@@ -206,23 +620,63 @@ class Scratch:
                     if self.conf["protocol"] == "rsync":
                         # Bear in mind that scratch_tmp cannot be used due to permission issues!
                         scratch_bi_path = "".join([self.tmp_dir, self.service_folder])
-                        rsync_command = sysrsync.get_rsync_command(
-                            source=scratch_bi_path,
-                            destination=dest_dir,
-                            options=self.conf["options"],
-                            exclusions=self.conf["exclusions"],
-                            sync_source_contents=False,
+                        # Permissions are applied by rsync while copying when possible
+                        permission_options = (
+                            buisciii.utils.get_rsync_permission_options(
+                                self.permissions
+                            )
                         )
-                        self.srun_command(self.srun_settings, rsync_command)
+                        manifest = self.read_manifest()
+                        if manifest is None:
+                            stderr.print(
+                                "[yellow]No scratch manifest found, the whole service will be copied back"
+                            )
+                            rsync_command = sysrsync.get_rsync_command(
+                                source=scratch_bi_path,
+                                destination=dest_dir,
+                                options=self.conf["options"] + permission_options,
+                                exclusions=self.conf["exclusions"],
+                                sync_source_contents=False,
+                            )
+                            self.transfer(rsync_command)
+                        else:
+                            # Only what is new or changed since copy_scratch is sent
+                            changed, size = self.get_changed_files(manifest)
+                            stderr.print(
+                                f"[blue]{len(changed)} new or changed items ({size / pow(1024, 3):.2f} GB) will be copied back"
+                            )
+                            log.info(
+                                f"{len(changed)} new or changed items ({size} bytes) will be copied back"
+                            )
+                            if changed:
+                                with open(self.return_list_file, "w") as fh:
+                                    fh.write("\0".join(changed) + "\0")
+                                rsync_command = sysrsync.get_rsync_command(
+                                    source=scratch_bi_path,
+                                    destination=dest_folder,
+                                    options=self.conf["options"]
+                                    + permission_options
+                                    + [
+                                        "--from0",
+                                        "--files-from",
+                                        self.return_list_file,
+                                    ],
+                                    exclusions=self.conf["exclusions"],
+                                    sync_source_contents=True,
+                                )
+                                self.transfer(rsync_command)
 
-                        # After successful rsync, apply correct permissions
-                        conf = buisciii.config_json.ConfigJson()
-                        permissions_config = conf.get_configuration("global").get(
-                            "permissions"
-                        )
-                        buisciii.utils.remake_permissions(
-                            self.full_path, permissions_config
-                        )
+                        if not self.wait:
+                            if not permission_options:
+                                stderr.print(
+                                    "[yellow]rsync cannot apply the permissions: run 'buisciii fix-permissions' once the job has finished"
+                                )
+                            return True
+                        # Otherwise, after successful rsync, apply correct permissions
+                        if not permission_options:
+                            buisciii.utils.remake_permissions(
+                                self.full_path, self.permissions
+                            )
 
                         log.info(f"Successfully copied the directory to {dest_folder}")
                         stderr.print(
@@ -294,6 +748,120 @@ class Scratch:
             )
         return True
 
+    def get_jobs(self):
+        """
+        Description:
+            Read the Slurm jobs recorded in service_info.txt.
+
+        Returns:
+            List of (direction, job id, log file).
+        """
+        jobs = []
+        if os.path.isfile(self.out_file):
+            with open(self.out_file) as f:
+                for line in f:
+                    match = re.match(r"Slurm job (\S+): (\S+) (.+)$", line.rstrip("\n"))
+                    if match:
+                        jobs.append(match.groups())
+        return jobs
+
+    def get_job_state(self, job_id):
+        """
+        Description:
+            Ask sacct for the state of a job.
+
+        Returns:
+            Dict with State, Elapsed and ExitCode ("unknown" if sacct fails).
+        """
+        fields = ["State", "Elapsed", "ExitCode"]
+        try:
+            process = subprocess.run(
+                ["sacct", "-j", job_id, "-X", "-n", "-P", "-o", ",".join(fields)],
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            values = process.stdout.splitlines()[0].split("|")
+        except (OSError, subprocess.CalledProcessError, IndexError):
+            log.warning(f"Could not get the state of job {job_id} from sacct")
+            values = ["unknown"] * len(fields)
+        return dict(zip(fields, values))
+
+    def get_job_progress(self, log_file):
+        """
+        Description:
+            Parse the last rsync --info=progress2 report of every task in a job
+            log. Sharded copies label each line with the task number.
+
+        Returns:
+            Tuple (bytes transferred, percentage, ETA), None if not reported yet.
+        """
+        progress_re = re.compile(r"([\d,]+)\s+(\d+)%\s+\S+/s\s+(\d+:\d{2}:\d{2})")
+        last_report = {}
+        try:
+            with open(log_file, errors="replace", newline="\n") as f:
+                for line in f:
+                    task = re.match(r"\s*(\d+): ", line)
+                    task = task.group(1) if task else ""
+                    # progress2 rewrites its line with carriage returns
+                    for report in line.split("\r"):
+                        match = progress_re.search(report)
+                        if match:
+                            last_report[task] = match.groups()
+        except OSError:
+            return None
+        if not last_report:
+            return None
+        transferred = sum(
+            int(sent.replace(",", "")) for sent, _, _ in last_report.values()
+        )
+        percentage = min(int(pct) for _, pct, _ in last_report.values())
+        eta = max(eta for _, _, eta in last_report.values())
+        return transferred, percentage, eta
+
+    def show_status(self):
+        """
+        Description:
+            Show the state of the Slurm jobs submitted for the service (sacct)
+            and the progress reported by rsync in their logs.
+        """
+        jobs = self.get_jobs()
+        if not jobs:
+            stderr.print(f"[yellow]No Slurm jobs recorded in {self.out_file}")
+            return True
+        table = rich.table.Table(title=f"Scratch jobs of {self.service_folder}")
+        for column in ["Direction", "Job", "State", "Elapsed", "Exit code"]:
+            table.add_column(column, justify="center")
+        for column in ["Transferred (GB)", "Progress", "ETA"]:
+            table.add_column(column, justify="center")
+        for direction, job_id, log_file in jobs:
+            state = self.get_job_state(job_id)
+            if not os.path.isfile(log_file):
+                # Not created yet while the job is pending, or removed
+                log.warning(f"Log {log_file} of job {job_id} not found")
+                progress_cells = ["no log", "-", "-"]
+            else:
+                progress = self.get_job_progress(log_file)
+                if progress is None:
+                    progress_cells = ["-", "-", "-"]
+                else:
+                    transferred, percentage, eta = progress
+                    progress_cells = [
+                        f"{transferred / pow(1024, 3):.2f}",
+                        f"{percentage}%",
+                        eta,
+                    ]
+            table.add_row(
+                direction,
+                job_id,
+                state["State"],
+                state["Elapsed"],
+                state["ExitCode"],
+                *progress_cells,
+            )
+        stderr.print(table)
+        return True
+
     def handle_scratch(self):
         """
         Description:
@@ -305,3 +873,5 @@ class Scratch:
             self.revert_copy_scratch()
         elif self.direction == "remove_scratch":
             self.remove_scratch()
+        elif self.direction == "status":
+            self.show_status()
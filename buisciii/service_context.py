@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+# Generic imports
+import os
+import logging
+from rich.console import Console
+
+# Local imports
+import buisciii
+import buisciii.utils
+import buisciii.drylab_api
+
+log = logging.getLogger(__name__)
+
+stderr = Console(
+    stderr=True,
+    style="dim",
+    highlight=False,
+    force_terminal=buisciii.utils.rich_force_colors(),
+)
+
+
+class ServiceContext:
+    """
+    Description:
+        Resolution data shared by the modules working on the same service.
+        The iSkyLIMS request and the path resolution are done once, so that
+        chained commands (e.g. finish) do not repeat them.
+
+    Usage:
+        context = ServiceContext(resolution_id, api_user, api_password, conf)
+        clean = buisciii.clean.CleanUp(context=context, option="clean", conf=conf)
+
+    Params:
+        resolution_id [str]: resolution id. Asked if not given.
+        api_user [str]: user for the iSkyLIMS API.
+        api_password [str]: password for the iSkyLIMS API.
+        conf [ConfigJson]: configuration object.
+    """
+
+    def __init__(
+        self,
+        resolution_id=None,
+        api_user=None,
+        api_password=None,
+        conf=None,
+    ):
+        if resolution_id is None:
+            self.resolution_id = buisciii.utils.prompt_resolution_id()
+        else:
+            self.resolution_id = resolution_id
+
+        self.conf = conf
+        conf_api = conf.get_configuration("xtutatis_api_settings")
+        self.rest_api = buisciii.drylab_api.RestServiceApi(
+            conf_api["server"],
+            conf_api["api_url"],
+            api_user,
+            api_password,
+            cache_ttl=conf_api.get("cache_ttl", 0),
+        )
+        self.resolution_info = self.rest_api.get_request(
+            request_info="service-data", safe=True, resolution=self.resolution_id
+        )
+        self.service_folder = self.resolution_info["resolutions"][0][
+            "resolution_full_number"
+        ]
+        self.services_requested = self.resolution_info["resolutions"][0][
+            "available_services"
+        ]
+        self.service_samples = self.resolution_info.get("samples")
+        self.data_path = buisciii.utils.get_service_paths(
+            conf,
+            "services_and_colaborations",
+            self.resolution_info,
+            "non_archived_path",
+        )
+        self.archived_path = buisciii.utils.get_service_paths(
+            conf,
+            "services_and_colaborations",
+            self.resolution_info,
+            "archived_path",
+        )
+        self.full_path = os.path.join(self.data_path, self.service_folder)
+        self._sftp_folder = None
+        self._service_ids = None
+        log.info(f"Service context loaded for resolution {self.resolution_id}")
+
+    @property
+    def sftp_folder(self):
+        """
+        Description:
+            SFTP folder of the service user. Only resolved (and asked, if the
+            user has several) the first time it is needed.
+        """
+        if self._sftp_folder is None:
+            self._sftp_folder = buisciii.utils.get_sftp_folder(
+                self.conf, self.resolution_info
+            )[0]
+        return self._sftp_folder
+
+    @property
+    def service_ids(self):
+        """
+        Description:
+            Service IDs selected for the resolution. The selection is asked only
+            the first time it is needed.
+        """
+        if self._service_ids is None:
+            self._service_ids = buisciii.utils.get_service_ids(self.services_requested)
+        return self._service_ids
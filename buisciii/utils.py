@@ -1,18 +1,30 @@
 #!/usr/bin/env python
 import logging
 import calendar
+import collections
+import concurrent.futures
 import datetime
+import fcntl
+import functools
+import grp
+import gzip
 import hashlib
 import json
 import os
+import shutil
+import sqlite3
 import tarfile
 import sys
 import subprocess
+import threading
+import time
 
-import questionary
 import rich
+import rich.progress
 import yaml
 
+# questionary is imported by the prompt functions, as it is slow to import
+
 import buisciii
 import buisciii.config_json
 import buisciii.service_json
@@ -38,6 +50,8 @@ stderr = rich.console.Console(
 
 
 def prompt_resolution_id():
+    import questionary
+
     stderr.print(
         "Specify the name resolution id for the service you want to create."
         "You can obtain this from iSkyLIMS. eg. SRVCNM564.1"
@@ -47,6 +61,8 @@ def prompt_resolution_id():
 
 
 def prompt_service_id():
+    import questionary
+
     stderr.print(
         "Specify the name service ID for the service you want to create."
         "You can obtain this from iSkyLIMS. eg. SRVCNM564"
@@ -62,6 +78,8 @@ def prompt_year(lower_limit, upper_limit):
     Check whether or not this input is within the limits
     Maybe too specific for utils
     """
+    import questionary
+
     while True:
         year = questionary.text(f"Year ({lower_limit}-{upper_limit})").unsafe_ask()
 
@@ -100,6 +118,8 @@ def prompt_day(lower_limit, upper_limit):
     Maybe too specific for utils
     And similar to the prompt_year function (different context tho)
     """
+    import questionary
+
     while True:
         day = questionary.text(f"Day ({lower_limit} - {upper_limit})").unsafe_ask()
         try:
@@ -118,45 +138,61 @@ def prompt_day(lower_limit, upper_limit):
 
 
 def prompt_service_dir_path():
+    import questionary
+
     stderr.print("Service path to copy to execution temporal directory")
     source = questionary.path("Source path").unsafe_ask()
     return source
 
 
 def prompt_tmp_dir_path():
+    import questionary
+
     stderr.print("Temporal directory destination to execute sercive")
     source = questionary.path("Source path").unsafe_ask()
     return source
 
 
 def prompt_source_path():
+    import questionary
+
     stderr.print("Directory containing files cd to transfer")
     source = questionary.path("Source path").unsafe_ask()
     return source
 
 
 def prompt_destination_path():
+    import questionary
+
     stderr.print("Directory to which the files will be transfered")
     destination = questionary.path("Destination path").unsafe_ask()
     return destination
 
 
 def prompt_selection(msg, choices):
+    import questionary
+
     selection = questionary.select(msg, choices=choices).unsafe_ask()
     return selection
 
 
 def prompt_path(msg):
+    import questionary
+
     source = questionary.path(msg).unsafe_ask()
     return source
 
 
 def prompt_yn_question(msg, dflt):
+    import questionary
+
     confirmation = questionary.confirm(msg, default=dflt).unsafe_ask()
     return confirmation
 
 
 def prompt_skip_folder_creation():
+    import questionary
+
     stderr.print("Do you want to skip folder creation? (y/N)")
     confirmation = questionary.confirm("Skip?", default=False).unsafe_ask()
     return confirmation
@@ -191,11 +227,15 @@ def get_service_ids(services_requested):
 
 
 def ask_for_some_text(msg):
+    import questionary
+
     input_text = questionary.text(msg).unsafe_ask()
     return input_text
 
 
 def ask_password(msg):
+    import questionary
+
     password = questionary.password(msg).unsafe_ask()
     return password
 
@@ -282,40 +322,440 @@ def append_end_to_service_id_list(services_requested):
     return service_ids_requested
 
 
-def get_dir_size(path):
+def get_cache_dir():
+    """
+    Return the buisciii directory inside the user's cache dir, creating it if needed.
+    """
+    cache_dir = os.path.join(
+        os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "buisciii"
+    )
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def load_size_cache(cache_file):
+    """
+    Load the directory size cache used by get_dir_size.
+    Returns an empty cache if the file does not exist or cannot be read.
     """
-    Get the size in bytes of a given directory
+    try:
+        with open(cache_file) as fh:
+            return json.load(fh)
+    except (OSError, ValueError) as e:
+        log.info(f"Directory size cache {cache_file} could not be loaded: {e}")
+        return {}
+
+
+def save_size_cache(cache_file, cache):
     """
+    Save the directory size cache used by get_dir_size.
+    """
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_file, "w") as fh:
+            json.dump(cache, fh)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        log.warning(f"Directory size cache {cache_file} could not be saved: {e}")
+    return
+
+
+def scan_dir_entries(path, cache=None):
+    """
+    Get the size in bytes of the files directly inside a directory and the
+    names of its subdirectories, with a single scandir call.
+    If the directory mtime matches the one in the cache, the cached values
+    are returned without listing the directory.
+
+    Returns:
+        (path, mtime_ns, size, subdirs)
+    """
+    try:
+        mtime = os.stat(path, follow_symlinks=False).st_mtime_ns
+    except OSError as e:
+        log.warning(f"Directory could not be read while scouting size: {e}")
+        return path, None, 0, []
+
+    if cache is not None and path in cache and cache[path][0] == mtime:
+        return path, mtime, cache[path][1], cache[path][2]
+
     size = 0
+    subdirs = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+                    # Links to directories are neither followed nor counted
+                    elif not (entry.is_symlink() and entry.is_dir()):
+                        size += entry.stat(follow_symlinks=False).st_size
+                except OSError as e:
+                    log.warning(f"File could not be read while scouting size: {e}")
+    except OSError as e:
+        # Skipped as os.walk did. Without mtime it is not cached, so it is
+        # listed again next time
+        log.warning(f"Directory could not be read while scouting size: {e}")
+        return path, None, 0, []
+    return path, mtime, size, subdirs
+
+
+def get_dir_size(path, threads=16, cache=None):
+    """
+    Get the size in bytes of a given directory.
 
-    for path, dirs, files in os.walk(path):
-        for file in files:
-            try:
-                if os.path.islink(os.path.join(path, file)):
-                    size += os.lstat(os.path.join(path, file)).st_size
-                else:
-                    size += os.path.getsize(os.path.join(path, file))
-            except FileNotFoundError as e:
-                log.warning(f"File not found error while scouting size: {e}")
+    Subdirectories are scanned by a pool of threads so that the latency of
+    network filesystems overlaps. If a cache dictionary is given (see
+    load_size_cache), directories whose mtime has not changed are not listed
+    again, and the cache is updated with the new values. Note a file rewritten
+    in place does not change the mtime of its directory.
+    """
+    size = 0
+    scanned = set()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = {executor.submit(scan_dir_entries, path, cache)}
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                dir_path, mtime, dir_size, subdirs = future.result()
+                size += dir_size
+                scanned.add(dir_path)
+                if cache is not None and mtime is not None:
+                    cache[dir_path] = [mtime, dir_size, subdirs]
+                for subdir in subdirs:
+                    pending.add(
+                        executor.submit(
+                            scan_dir_entries, os.path.join(dir_path, subdir), cache
+                        )
+                    )
+
+    # Forget directories that no longer exist under this path
+    if cache is not None:
+        prefix = os.path.join(path, "")
+        for cached_path in [
+            cached_path
+            for cached_path in cache
+            if cached_path.startswith(prefix) and cached_path not in scanned
+        ]:
+            del cache[cached_path]
 
     return size
 
 
-def targz_dir(tar_name, directory):
+def unlink_dir_entries(path, dry_run=False):
+    """
+    Remove the files (and links) directly inside a directory with a single
+    scandir call, and list its subdirectories. With dry_run nothing is removed.
+
+    Returns:
+        (path, files, size, subdirs)
+    """
+    files = 0
+    size = 0
+    subdirs = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                        continue
+                    size += entry.stat(follow_symlinks=False).st_size
+                    if not dry_run:
+                        os.unlink(entry.path)
+                    files += 1
+                except FileNotFoundError as e:
+                    log.warning(f"File not found error while removing: {e}")
+    except FileNotFoundError as e:
+        log.warning(f"Directory not found error while removing: {e}")
+    return path, files, size, subdirs
+
+
+def drop_nested_paths(paths):
+    """
+    Remove duplicates and the paths that are inside another of the given paths.
+    """
+    kept = []
+    # Sorting by components places every path right after its parents
+    for path in sorted(set(paths), key=lambda path: path.split(os.sep)):
+        if kept and path.startswith(os.path.join(kept[-1], "")):
+            continue
+        kept.append(path)
+    return kept
+
+
+def remove_paths(paths, threads=16, dry_run=False, progress=True):
     """
-    Generate a tar gz file with the contents of a directory
+    Remove files and directory trees.
+
+    Directories are walked by a pool of threads, each task unlinking the files
+    of one directory, and are then removed bottom-up (deepest level first), so
+    that the latency of network filesystems overlaps. With dry_run nothing is
+    removed and only the totals are computed. While removing, the files/s and
+    the space freed are shown. Paths inside another given path are counted once.
+
+    Returns:
+        (files, size): number of files removed and bytes freed.
     """
-    with tarfile.open(tar_name, "w:gz") as out_tar:
-        out_tar.add(directory, arcname=os.path.basename(directory))
-    return True
+    files = 0
+    size = 0
+    dirs = []
+    start = time.time()
+    action = "Scanning" if dry_run else "Removing"
+    with rich.progress.Progress(
+        rich.progress.SpinnerColumn(),
+        rich.progress.TextColumn("{task.description}"),
+        console=stderr,
+        transient=True,
+        disable=not progress,
+    ) as progress_bar, concurrent.futures.ThreadPoolExecutor(
+        max_workers=threads
+    ) as executor:
+        task = progress_bar.add_task(action)
+        pending = set()
+        for path in drop_nested_paths(paths):
+            if os.path.isdir(path) and not os.path.islink(path):
+                pending.add(executor.submit(unlink_dir_entries, path, dry_run))
+            elif os.path.lexists(path):
+                size += os.lstat(path).st_size
+                if not dry_run:
+                    os.unlink(path)
+                files += 1
+            else:
+                log.warning(f"{path} not found, nothing to remove")
+
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                dir_path, dir_files, dir_size, subdirs = future.result()
+                dirs.append(dir_path)
+                files += dir_files
+                size += dir_size
+                for subdir in subdirs:
+                    pending.add(executor.submit(unlink_dir_entries, subdir, dry_run))
+            rate = files / max(time.time() - start, 1e-6)
+            progress_bar.update(
+                task,
+                description=f"{action}: {files} files, {size / pow(1024, 3):.3f} GB, {rate:.0f} files/s",
+            )
+
+        if not dry_run:
+            dirs_by_depth = collections.defaultdict(list)
+            for dir_path in dirs:
+                dirs_by_depth[dir_path.count(os.sep)].append(dir_path)
+            for depth in sorted(dirs_by_depth, reverse=True):
+                list(executor.map(os.rmdir, dirs_by_depth[depth]))
+
+    if not dry_run:
+        elapsed = time.time() - start
+        log.info(
+            f"Removed {files} files ({size / pow(1024, 3):.3f} GB) in {elapsed:.1f}s"
+        )
+    return files, size
+
+
+class ParallelGzipWriter:
+    """
+    File-like object that compresses the written data in chunks using a pool of
+    threads and writes them, in order, as members of a multi-member gzip file.
+    Any gzip reader (tarfile, gzip, pigz, gunzip) reads it as a single stream.
+    """
+
+    def __init__(self, fileobj, level=6, threads=None, chunk_size=16 * 1024 * 1024):
+        self.fh = fileobj
+        self.level = level
+        self.chunk_size = chunk_size
+        self.threads = threads or os.cpu_count() or 1
+        self.buffer = bytearray()
+        self.pending = collections.deque()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.threads)
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.chunk_size:
+            self.submit(bytes(self.buffer[: self.chunk_size]))
+            del self.buffer[: self.chunk_size]
+        return len(data)
+
+    def submit(self, chunk):
+        self.pending.append(
+            self.executor.submit(gzip.compress, chunk, self.level, mtime=0)
+        )
+        # Keep memory bounded: never more than two chunks per thread in flight
+        while len(self.pending) >= 2 * self.threads:
+            self.fh.write(self.pending.popleft().result())
+
+    def close(self):
+        if self.buffer:
+            self.submit(bytes(self.buffer))
+            self.buffer = bytearray()
+        while self.pending:
+            self.fh.write(self.pending.popleft().result())
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.executor.shutdown(cancel_futures=True)
+
+
+class ChecksumWriter:
+    """
+    File-like object that writes to a file and computes its checksums on the fly,
+    so the file never has to be read again to get them.
+    """
+
+    def __init__(self, file_name, algorithms=("md5",)):
+        self.fh = open(file_name, "wb")
+        self.hashes = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+
+    def write(self, data):
+        for file_hash in self.hashes.values():
+            file_hash.update(data)
+        return self.fh.write(data)
+
+    def hexdigests(self):
+        return {
+            algorithm: file_hash.hexdigest()
+            for algorithm, file_hash in self.hashes.items()
+        }
+
+    def close(self):
+        self.fh.flush()
+        os.fsync(self.fh.fileno())
+        self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def copy_stream(stream, out_fh, chunk_size=1024 * 1024):
+    """
+    Copy a readable stream into a file object, closing the stream at the end
+    so the process writing to it does not block if the copy fails.
+    """
+    try:
+        shutil.copyfileobj(stream, out_fh, chunk_size)
+    finally:
+        stream.close()
+
+
+def get_compression_codec(codec="auto"):
+    """
+    Return the codec that will be used to compress: "pigz" or "zstd" if the
+    executable is installed, "gzip" (in-process parallel gzip) otherwise.
+    "auto" prefers pigz. zstd is only used when explicitly selected, as it
+    is not readable by gzip tools.
+    """
+    if codec in ["auto", "pigz"] and shutil.which("pigz"):
+        return "pigz"
+    if codec == "zstd":
+        if shutil.which("zstd"):
+            return "zstd"
+        log.warning("zstd executable not found, falling back to gzip compression")
+    elif codec == "pigz":
+        log.warning("pigz executable not found, falling back to gzip compression")
+    return "gzip"
+
+
+def get_compression_format(file_name):
+    """
+    Detect the compression format of a file from its magic number.
+    Returns "gzip", "zstd" or None.
+    """
+    with open(file_name, "rb") as fh:
+        magic = fh.read(4)
+    if magic.startswith(b"\x1f\x8b"):
+        return "gzip"
+    if magic == b"\x28\xb5\x2f\xfd":
+        return "zstd"
+    return None
+
+
+def targz_dir(
+    tar_name, directory, codec="auto", level=6, threads=0, checksums=("md5",)
+):
+    """
+    Generate a compressed tar file with the contents of a directory.
+    The checksums of the compressed file are computed while it is written and
+    stored next to it (tar_name.md5, tar_name.sha256...).
+
+    Params:
+        codec: "auto", "pigz", "zstd" or "gzip" (see get_compression_codec).
+        level: compression level passed to the codec.
+        threads: number of compression threads. 0 uses all available cpus.
+        checksums: hashlib algorithms to compute, "md5" and/or "sha256".
+
+    Returns:
+        Dictionary with the hex digest of each algorithm.
+    """
+    threads = threads or os.cpu_count() or 1
+    codec = get_compression_codec(codec)
+    log.info(f"Compressing {directory} with {codec} (level {level}, {threads} threads)")
+
+    with ChecksumWriter(tar_name, checksums) as out_fh:
+        if codec == "gzip":
+            with ParallelGzipWriter(out_fh, level=level, threads=threads) as gz_fh:
+                with tarfile.open(fileobj=gz_fh, mode="w|") as out_tar:
+                    out_tar.add(directory, arcname=os.path.basename(directory))
+        else:
+            if codec == "pigz":
+                command = ["pigz", f"-{level}", "-p", str(threads), "-c"]
+            else:
+                command = ["zstd", f"-{level}", f"-T{threads}", "-q", "-c"]
+            process = subprocess.Popen(
+                command, stdin=subprocess.PIPE, stdout=subprocess.PIPE
+            )
+            with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+                reader = executor.submit(copy_stream, process.stdout, out_fh)
+                try:
+                    with tarfile.open(fileobj=process.stdin, mode="w|") as out_tar:
+                        out_tar.add(directory, arcname=os.path.basename(directory))
+                finally:
+                    process.stdin.close()
+                    exit_code = process.wait()
+                reader.result()
+            if exit_code != 0:
+                raise subprocess.CalledProcessError(exit_code, command)
+
+    digests = out_fh.hexdigests()
+    for algorithm, digest in digests.items():
+        write_checksum_file(tar_name, algorithm, digest)
+    return digests
 
 
 def uncompress_targz_directory(tar_name, directory):
     """
-    Untar GZ file
+    Untar a compressed file. The compression format is detected from the file
+    itself, so gzip archives from previous versions and zstd archives are
+    both restored.
     """
-    with tarfile.open(tar_name) as out_tar:
-        out_tar.extractall("/".join(directory.split("/")[:-1]))
+    output_dir = "/".join(directory.split("/")[:-1])
+    if get_compression_format(tar_name) == "zstd":
+        command = ["zstd", "-d", "-q", "-c", tar_name]
+        process = subprocess.Popen(command, stdout=subprocess.PIPE)
+        try:
+            with tarfile.open(fileobj=process.stdout, mode="r|") as out_tar:
+                out_tar.extractall(output_dir)
+        finally:
+            process.stdout.close()
+            exit_code = process.wait()
+        if exit_code != 0:
+            raise subprocess.CalledProcessError(exit_code, command)
+    else:
+        with tarfile.open(tar_name) as out_tar:
+            out_tar.extractall(output_dir)
     return
 
 
@@ -330,6 +770,209 @@ def get_md5(file_path, chunk_size=1 * 1024 * 1024 * 1024):  # 1 GB
     return hash_md5.hexdigest()
 
 
+def write_checksum_file(file_path, algorithm, digest):
+    """
+    Write the checksum of a file to its sidecar manifest (file_path.md5,
+    file_path.sha256), in the format read by md5sum -c / sha256sum -c.
+    """
+    with open(f"{file_path}.{algorithm}", "w") as fh:
+        fh.write(f"{digest}  {os.path.basename(file_path)}\n")
+    return
+
+
+def read_checksum_file(file_path, algorithm="md5"):
+    """
+    Return the checksum stored in the sidecar manifest of a file,
+    or None if it does not exist.
+    """
+    checksum_file = f"{file_path}.{algorithm}"
+    if not os.path.exists(checksum_file):
+        return None
+    with open(checksum_file) as fh:
+        content = fh.read().split()
+    return content[0] if content else None
+
+
+def remove_checksum_files(file_path, algorithms=("md5", "sha256")):
+    """
+    Remove the sidecar checksum manifests of a file, if any.
+    """
+    for algorithm in algorithms:
+        if os.path.exists(f"{file_path}.{algorithm}"):
+            os.remove(f"{file_path}.{algorithm}")
+    return
+
+
+def copy_file_with_checksums(
+    origin, destiny, algorithms=("md5",), chunk_size=64 * 1024 * 1024
+):
+    """
+    Copy a file reading it only once, and return the checksums of the copied
+    data computed while it is written to destiny.
+    """
+    with open(origin, "rb") as in_fh, ChecksumWriter(destiny, algorithms) as out_fh:
+        shutil.copyfileobj(in_fh, out_fh, chunk_size)
+    shutil.copystat(origin, destiny)
+    return out_fh.hexdigests()
+
+
+# ioctl request to share the data blocks of a file (reflink) on btrfs, xfs...
+FICLONE = 0x40049409
+
+
+def clone_file(src, dst):
+    """
+    Copy a file, with its permissions and times, doing the cheapest copy the
+    filesystem supports: a reflink (copy-on-write clone), then copy_file_range
+    (in-kernel copy) and finally a regular copy.
+    """
+    with open(src, "rb") as src_fh, open(dst, "wb") as dst_fh:
+        try:
+            fcntl.ioctl(dst_fh.fileno(), FICLONE, src_fh.fileno())
+        except OSError:
+            try:
+                size = os.fstat(src_fh.fileno()).st_size
+                copied = 0
+                while copied < size:
+                    count = os.copy_file_range(
+                        src_fh.fileno(), dst_fh.fileno(), size - copied
+                    )
+                    if count == 0:
+                        break
+                    copied += count
+            except (AttributeError, OSError):
+                src_fh.seek(0)
+                dst_fh.seek(0)
+                dst_fh.truncate()
+                shutil.copyfileobj(src_fh, dst_fh)
+    shutil.copystat(src, dst)
+
+
+def get_checksums(file_path, algorithms=("md5",), chunk_size=64 * 1024 * 1024):
+    """
+    Given a file, read it once and return the hex digest of each algorithm
+    """
+    hashes = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            for file_hash in hashes.values():
+                file_hash.update(chunk)
+    return {algorithm: file_hash.hexdigest() for algorithm, file_hash in hashes.items()}
+
+
+class ChecksumCache:
+    """
+    Persistent cache of file checksums, stored in a SQLite database in the user
+    cache dir. Entries are keyed by (device, inode, size, mtime_ns), so a file
+    that has not changed since it was hashed is not read again, whatever its
+    path. The object can be shared between threads.
+    """
+
+    def __init__(self, db_file=None):
+        if db_file is None:
+            db_file = os.path.join(get_cache_dir(), "checksums.sqlite")
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_file, timeout=60, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS checksums ("
+                "device INTEGER, inode INTEGER, size INTEGER, mtime_ns INTEGER, "
+                "algorithm TEXT, digest TEXT, "
+                "PRIMARY KEY (device, inode, size, mtime_ns, algorithm))"
+            )
+
+    @staticmethod
+    def file_key(file_stat):
+        return (
+            file_stat.st_dev,
+            file_stat.st_ino,
+            file_stat.st_size,
+            file_stat.st_mtime_ns,
+        )
+
+    def get(self, file_stat, algorithm="md5"):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT digest FROM checksums WHERE device = ? AND inode = ? "
+                "AND size = ? AND mtime_ns = ? AND algorithm = ?",
+                (*self.file_key(file_stat), algorithm),
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, file_stat, algorithm, digest):
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?, ?)",
+                (*self.file_key(file_stat), algorithm, digest),
+            )
+
+    def store(self, file_path, checksums):
+        """
+        Save checksums {algorithm: digest} computed by other means (e.g. while
+        copying the file) for the current version of file_path.
+        """
+        file_stat = os.stat(file_path)
+        for algorithm, digest in checksums.items():
+            self.set(file_stat, algorithm, digest)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+def get_cached_checksums(file_path, algorithms=("md5",), cache=None):
+    """
+    Same as get_checksums, but the checksums of files that have not changed
+    since they were last hashed are taken from the ChecksumCache, and the new
+    ones are saved in it. Without cache, the file is always read.
+    """
+    if cache is None:
+        return get_checksums(file_path, algorithms)
+    file_stat = os.stat(file_path)
+    checksums = {algorithm: cache.get(file_stat, algorithm) for algorithm in algorithms}
+    missing = [algorithm for algorithm, digest in checksums.items() if digest is None]
+    if missing:
+        checksums.update(get_checksums(file_path, missing))
+        # Only save them if the file did not change while it was being read
+        if ChecksumCache.file_key(os.stat(file_path)) == ChecksumCache.file_key(
+            file_stat
+        ):
+            for algorithm in missing:
+                cache.set(file_stat, algorithm, checksums[algorithm])
+    return checksums
+
+
+def get_checksum_cache(conf):
+    """
+    Return a ChecksumCache if it is enabled in the global configuration
+    ("checksum_cache"), or None.
+    """
+    if not conf.get_configuration("global").get("checksum_cache", False):
+        return None
+    try:
+        return ChecksumCache()
+    except sqlite3.Error as e:
+        log.warning(f"Checksum cache could not be opened, files will be hashed: {e}")
+        return None
+
+
+def read_md5sum_file(md5_file):
+    """
+    Parse a file in md5sum format ("<md5>  <file>" per line) into a dictionary
+    {file: md5}. File names are kept as written, relative to the md5 file.
+    """
+    checksums = {}
+    with open(md5_file, "r") as fh:
+        for line in fh:
+            fields = line.strip().split(maxsplit=1)
+            if len(fields) != 2:
+                continue
+            md5, file_name = fields
+            # md5sum marks files read in binary mode with "*"
+            checksums[file_name.lstrip("*")] = md5.lower()
+    return checksums
+
+
 def ask_date(previous_date=None, posterior_date=None, initial_year=2010):
     """
     Ask the year, then the month, then the day of the month
@@ -495,30 +1138,188 @@ def validate_date(date_previous, date_posterior):
     return
 
 
-def remake_permissions(copied_folder_path, permissions_config):
+@functools.lru_cache(maxsize=None)
+def rsync_supports_chown():
+    """
+    Check if the rsync of this host accepts --chown (rsync >= 3.1.0).
+    """
+    try:
+        output = subprocess.run(
+            ["rsync", "--version"], capture_output=True, text=True, check=True
+        ).stdout
+        version = output.split("version", 1)[1].split()[0]
+        major, minor = (int(number) for number in version.split(".")[:2])
+    except (OSError, subprocess.CalledProcessError, IndexError, ValueError):
+        log.warning("Could not get the rsync version")
+        return False
+    return (major, minor) >= (3, 1)
+
+
+def get_rsync_permission_options(permissions_config):
+    """
+    Build the rsync options that apply the permissions configuration (see
+    remake_permissions) while the files are transferred, so that no pass over
+    the copied files is needed afterwards. The modes are only applied if rsync
+    preserves permissions (-p). Returns an empty list if rsync cannot apply
+    them, in which case remake_permissions should be used after the copy.
+
+    permissions_config["rsync_chown"] is true or false when the rsync running
+    the copy is known (e.g. in the cluster nodes), or "auto" (default) to check
+    the rsync of this host.
+    """
+    if not permissions_config:
+        return []
+    rsync_chown = permissions_config.get("rsync_chown", "auto")
+    if rsync_chown == "auto":
+        rsync_chown = rsync_supports_chown()
+    if not rsync_chown:
+        return []
+    chmod = []
+    if "directory_chmod" in permissions_config:
+        chmod.append("D" + permissions_config["directory_chmod"])
+    if "file_chmod" in permissions_config:
+        chmod.append("F" + permissions_config["file_chmod"])
+    options = ["--chmod=" + ",".join(chmod)] if chmod else []
+    # Files created by rsync are already owned by the user, only the group is set.
+    # rsync 3.1 only applies --chown to groups that are transferred (-g)
+    options += ["-g", "--chown=:" + permissions_config.get("group", "bi")]
+    return options
+
+
+def fix_dir_permissions(path, uid, gid, directory_mode, file_mode):
+    """
+    Set the owner and mode of the entries directly inside a directory, skipping
+    the ones that are already right. Links are not followed nor changed.
+
+    Returns:
+        (counts, subdirs, errors): counts of changed entries, subdirectories to
+        process and the (path, error) pairs of the entries that failed.
+    """
+    counts = collections.Counter()
+    subdirs = []
+    errors = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_symlink():
+                    continue
+                entry_stat = entry.stat(follow_symlinks=False)
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                    mode = directory_mode
+                    counts["directories"] += 1
+                else:
+                    mode = file_mode
+                    counts["files"] += 1
+                if entry_stat.st_uid != uid or entry_stat.st_gid != gid:
+                    os.chown(entry.path, uid, gid, follow_symlinks=False)
+                    counts["owner_changed"] += 1
+                if mode is not None and (entry_stat.st_mode & 0o7777) != mode:
+                    os.chmod(entry.path, mode)
+                    counts["mode_changed"] += 1
+            except OSError as e:
+                errors.append((entry.path, e))
+    return counts, subdirs, errors
+
+
+def remake_permissions(copied_folder_path, permissions_config, threads=16):
     """
     Change permissions of all files and directories in a given absolute path.
 
+    The owner is set to the current user and the configured group ("bi" by
+    default) and the modes to directory_chmod/file_chmod. The tree is walked
+    with os.scandir by a pool of threads, and only the entries that are not
+    already right are changed. Links are not followed.
+
     Args:
         copied_folder_path: The path to the folder that was copied
         permissions_config: Dictionary containing permissions configuration (e.g., {'directory_chmod': '755', 'file_chmod': '664'})
+        threads: Number of directories processed at the same time
+
+    Returns:
+        Counter with the number of directories and files found, and of entries
+        whose owner ("owner_changed") or mode ("mode_changed") was changed.
     """
-    subprocess.run(
-        f"chown -R $(whoami):bi {copied_folder_path}", shell=True, check=True
+    permissions_config = permissions_config or {}
+    uid = os.getuid()
+    group = permissions_config.get("group", "bi")
+    try:
+        gid = grp.getgrnam(group).gr_gid
+    except KeyError:
+        stderr.print(f"[red]ERROR: Group {group} does not exist")
+        log.error(f"ERROR: Group {group} does not exist")
+        raise
+    directory_mode = (
+        int(permissions_config["directory_chmod"], 8)
+        if "directory_chmod" in permissions_config
+        else None
+    )
+    file_mode = (
+        int(permissions_config["file_chmod"], 8)
+        if "file_chmod" in permissions_config
+        else None
     )
 
-    # Change permissions for directories
-    if "directory_chmod" in permissions_config:
-        subprocess.run(
-            f"find {copied_folder_path} -type d -exec chmod {permissions_config['directory_chmod']} {{}} \;",
-            shell=True,
-            check=True,
+    # The top folder itself, then its content
+    counts = collections.Counter({"directories": 1})
+    errors = []
+    root_stat = os.stat(copied_folder_path)
+    try:
+        if root_stat.st_uid != uid or root_stat.st_gid != gid:
+            os.chown(copied_folder_path, uid, gid)
+            counts["owner_changed"] += 1
+        if (
+            directory_mode is not None
+            and (root_stat.st_mode & 0o7777) != directory_mode
+        ):
+            os.chmod(copied_folder_path, directory_mode)
+            counts["mode_changed"] += 1
+    except OSError as e:
+        errors.append((copied_folder_path, e))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = {
+            executor.submit(
+                fix_dir_permissions,
+                copied_folder_path,
+                uid,
+                gid,
+                directory_mode,
+                file_mode,
+            )
+        }
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                dir_counts, subdirs, dir_errors = future.result()
+                counts.update(dir_counts)
+                errors.extend(dir_errors)
+                for subdir in subdirs:
+                    pending.add(
+                        executor.submit(
+                            fix_dir_permissions,
+                            subdir,
+                            uid,
+                            gid,
+                            directory_mode,
+                            file_mode,
+                        )
+                    )
+
+    log.info(
+        f"Permissions of {copied_folder_path}: {counts['directories']} directories and "
+        f"{counts['files']} files checked, owner changed in {counts['owner_changed']} "
+        f"and mode changed in {counts['mode_changed']}"
+    )
+    if errors:
+        for path, error in errors:
+            log.error(f"ERROR: Could not fix permissions of {path}: {error}")
+        stderr.print(
+            f"[red]ERROR: Could not fix permissions of {len(errors)} entries in {copied_folder_path}"
         )
-
-    # Change permissions for files
-    if "file_chmod" in permissions_config:
-        subprocess.run(
-            f"find {copied_folder_path} -type f -exec chmod {permissions_config['file_chmod']} {{}} \;",
-            shell=True,
-            check=True,
+        raise PermissionError(
+            f"Could not fix permissions of {len(errors)} entries in {copied_folder_path}"
         )
+    return counts
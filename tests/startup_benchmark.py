@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""
+Startup benchmark of the buisciii CLI, based on python -X importtime.
+
+Measures the import time of what `buisciii --help` and `buisciii list` load, and
+fails if it is over the budget or if any of the heavy dependencies of other
+commands is imported.
+
+Usage:
+    python tests/startup_benchmark.py [--budget 300] [--repeat 5]
+"""
+
+import argparse
+import re
+import subprocess
+import sys
+
+# What each command imports before doing its work
+COMMANDS = {
+    "--help": "import buisciii.__main__",
+    "list": "import buisciii.__main__, buisciii.list",
+}
+
+# Dependencies that only some commands need
+HEAVY_MODULES = [
+    "pdfkit",
+    "PyPDF2",
+    "jinja2",
+    "markdown",
+    "sysrsync",
+    "questionary",
+    "requests",
+]
+
+
+def measure(statement):
+    """
+    Run the statement in a new interpreter with -X importtime.
+    Returns the total import time in ms and the set of imported modules.
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    total = 0
+    modules = set()
+    for line in process.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \|( +)(\S+)$", line)
+        if not match:
+            continue
+        cumulative, indent, module = match.groups()
+        modules.add(module)
+        # Only the package imports count, not the interpreter startup (site, etc.)
+        if len(indent) == 1 and module.startswith("buisciii"):
+            total += int(cumulative)
+    return total / 1000, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--budget", type=float, default=300, help="Maximum import time in ms"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Runs per command, the best is kept"
+    )
+    args = parser.parse_args()
+
+    failed = False
+    for command, statement in COMMANDS.items():
+        runs = [measure(statement) for _ in range(args.repeat)]
+        best = min(total for total, _ in runs)
+        heavy = sorted(set(HEAVY_MODULES) & runs[0][1])
+        status = "OK"
+        if best > args.budget or heavy:
+            status = "FAIL"
+            failed = True
+        print(
+            f"{status} buisciii {command}: {best:.0f} ms (budget {args.budget:.0f} ms)"
+        )
+        if heavy:
+            print(f"    imports heavy modules: {', '.join(heavy)}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
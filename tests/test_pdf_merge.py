@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""
+Merge of the delivery PDFs with StreamingPdfMerger: long outlines (wkhtmltopdf
+adds one entry per heading) and fonts and images repeated between the files.
+
+Usage:
+    python -m pytest -c /dev/null --rootdir . tests/test_pdf_merge.py
+
+tox.ini only holds the flake8 settings, hence -c /dev/null.
+"""
+
+import PyPDF2
+from PyPDF2.generic import (
+    DecodedStreamObject,
+    DictionaryObject,
+    NameObject,
+)
+
+import buisciii.bioinfo_doc
+
+OUTLINE_ENTRIES = 1000
+
+
+def make_stream(writer, data):
+    stream = DecodedStreamObject()
+    stream.set_data(data)
+    return writer._add_object(stream)
+
+
+def write_long_outline_pdf(pdf_file, pages=5):
+    writer = PyPDF2.PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(200, 200)
+    for entry in range(OUTLINE_ENTRIES):
+        writer.add_outline_item(f"Heading {entry}", entry % pages)
+    writer.write(pdf_file)
+
+
+def write_assets_pdf(pdf_file, pages=3):
+    """
+    Every page has its own content, and uses the same font file and image.
+    A second image object has the same data as the first one.
+    """
+    writer = PyPDF2.PdfWriter()
+    font_file = make_stream(writer, b"font program")
+    image = make_stream(writer, b"image pixels")
+    image_copy = make_stream(writer, b"image pixels")
+    for page_number in range(pages):
+        writer.add_blank_page(200, 200)
+        page = writer.pages[page_number]
+        page[NameObject("/Contents")] = make_stream(
+            writer, f"BT (page {page_number}) Tj ET".encode()
+        )
+        page[NameObject("/Resources")] = DictionaryObject(
+            {
+                NameObject("/Font"): DictionaryObject(
+                    {
+                        NameObject("/F1"): DictionaryObject(
+                            {NameObject("/FontFile"): font_file}
+                        )
+                    }
+                ),
+                NameObject("/XObject"): DictionaryObject(
+                    {NameObject("/Im0"): image, NameObject("/Im1"): image_copy}
+                ),
+            }
+        )
+    writer.write(pdf_file)
+
+
+def test_streaming_merge(tmp_path):
+    long_pdf = str(tmp_path / "long.pdf")
+    assets_pdf = str(tmp_path / "assets.pdf")
+    merged_pdf = str(tmp_path / "merged.pdf")
+    write_long_outline_pdf(long_pdf)
+    write_assets_pdf(assets_pdf)
+
+    merger = buisciii.bioinfo_doc.StreamingPdfMerger(merged_pdf)
+    merger.append(long_pdf, "Delivery")
+    merger.append(assets_pdf, "Results")
+    merger.append(assets_pdf, "Service")
+    merger.close()
+
+    # The image copy in the first file, then the 3 contents, the font and the
+    # two images of the second one
+    assert merger.shared_streams == 1 + 3 + 1 + 2
+    reader = PyPDF2.PdfReader(merged_pdf, strict=True)
+    assert len(reader.pages) == 5 + 3 + 3
+    # [Delivery, [its entries], Results, Service]
+    delivery, entries, results, service = reader.outline
+    assert [delivery.title, results.title, service.title] == [
+        "Delivery",
+        "Results",
+        "Service",
+    ]
+    assert len(entries) == OUTLINE_ENTRIES
+    assert reader.get_destination_page_number(entries[-1]) == (OUTLINE_ENTRIES - 1) % 5
+    assert reader.get_destination_page_number(service) == 8
+    # Both files share the font and image objects
+    resources = [page["/Resources"] for page in reader.pages[5:]]
+    assert (
+        len({res["/Font"]["/F1"].raw_get("/FontFile").idnum for res in resources}) == 1
+    )
+    assert len({res["/XObject"].raw_get("/Im1").idnum for res in resources}) == 1
+    assert reader.pages[10]["/Contents"].get_object().get_data() == b"BT (page 2) Tj ET"
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+Copy of a service to scratch and back with --no_wait, using the fake Slurm
+commands in tests/fake_slurm (sbatch runs the job right away).
+
+Checks that the manifest is written by the copy job itself, so that files
+changed by the analysis before anyone runs 'scratch --status' are copied back.
+
+Usage:
+    python -m pytest -c /dev/null --rootdir . tests/test_scratch_async.py
+
+tox.ini only holds the flake8 settings, hence -c /dev/null.
+"""
+
+import os
+import shutil
+import types
+
+import pytest
+
+import buisciii.config_json
+import buisciii.scratch
+
+FAKE_SLURM = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_slurm")
+SERVICE = "SRVCNM123_20240101_TEST123_researcher_S"
+
+
+def make_scratch(tmp_path, direction):
+    conf = buisciii.config_json.ConfigJson()
+    conf.json_data["global"]["permissions"] = {}
+    conf.json_data["scratch_copy"]["srun_settings"] = {"--chdir": str(tmp_path)}
+    context = types.SimpleNamespace(
+        resolution_id="SRVCNM123.1",
+        resolution_info={},
+        service_folder=SERVICE,
+        data_path=str(tmp_path / "services"),
+    )
+    return buisciii.scratch.Scratch(
+        tmp_dir=str(tmp_path / "scratch") + "/",
+        direction=direction,
+        conf=conf,
+        context=context,
+        wait=False,
+    )
+
+
+@pytest.mark.skipif(shutil.which("rsync") is None, reason="rsync is not installed")
+def test_delta_return_after_async_copy(tmp_path, monkeypatch):
+    monkeypatch.setenv("PATH", FAKE_SLURM + os.pathsep + os.environ["PATH"])
+    monkeypatch.setenv("FAKE_SLURM_DIR", str(tmp_path / "slurm"))
+    service_path = tmp_path / "services" / SERVICE
+    for folder in ["DOC", "RAW", "ANALYSIS/01-fastqc", "TMP"]:
+        (service_path / folder).mkdir(parents=True)
+    (service_path / "RAW" / "sample.fastq.gz").write_text("reads")
+    (service_path / "ANALYSIS" / "lablog").write_text("nextflow run")
+    (tmp_path / "scratch").mkdir()
+
+    make_scratch(tmp_path, "service_to_scratch").handle_scratch()
+    copy = make_scratch(tmp_path, "status")
+    assert os.path.isfile(copy.manifest_file)
+
+    # The analysis runs before anyone asks for the status of the copy
+    scratch_path = tmp_path / "scratch" / SERVICE
+    lablog = scratch_path / "ANALYSIS" / "lablog"
+    lablog.write_text("nextflow run -resume")
+    os.utime(lablog, ns=(lablog.stat().st_mtime_ns + 10**9,) * 2)
+    (scratch_path / "ANALYSIS" / "01-fastqc" / "report.html").write_text("ok")
+    copy.handle_scratch()
+
+    make_scratch(tmp_path, "scratch_to_service").handle_scratch()
+    with open(copy.return_list_file) as fh:
+        returned = set(filter(None, fh.read().split("\0")))
+    assert returned == {"ANALYSIS/lablog", "ANALYSIS/01-fastqc/report.html"}
+    assert (service_path / "ANALYSIS" / "lablog").read_text() == "nextflow run -resume"
+    assert (service_path / "ANALYSIS" / "01-fastqc" / "report.html").exists()